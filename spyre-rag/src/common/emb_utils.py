@@ -1,34 +1,188 @@
+import base64
 import json
+import os
+import threading
+import time
 import requests
 import numpy as np
 from common.misc_utils import get_logger
 
-logger = get_logger("embed")
+logger = get_logger("Embedding")
 
-from common.misc_utils import get_logger
+# Embedding batches are formed by a token budget, capped to a number of chunks, and sent concurrently
+EMB_BATCH_TOKENS = int(os.getenv("EMB_BATCH_TOKENS", "16384"))
+EMB_BATCH_SIZE = int(os.getenv("EMB_BATCH_SIZE", "256"))
+EMB_CONCURRENCY = int(os.getenv("EMB_CONCURRENCY", "4"))
 
-logger = get_logger("Embedding")
+# Rough number of characters per token, used when the token count of a text isn't known
+CHARS_PER_TOKEN = 4
+
+# Optional reduction of the embeddings to EMB_DIMENSION values, applied to the documents and the queries alike:
+# "truncate" keeps the leading values (models trained with Matryoshka representation learning), "pca" projects them
+# on the principal components of the first EMB_PCA_SAMPLE_SIZE chunks of the corpus
+EMB_REDUCTIONS = ("none", "truncate", "pca")
+EMB_REDUCTION = os.getenv("EMB_REDUCTION", "none").lower()
+EMB_DIMENSION = int(os.getenv("EMB_DIMENSION", "0"))
+EMB_PCA_SAMPLE_SIZE = int(os.getenv("EMB_PCA_SAMPLE_SIZE", "4096"))
 
 _embedder_instance = None
 
+def estimate_tokens(text):
+    return len(text or "") // CHARS_PER_TOKEN + 1
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def _encode_array(array):
+    return base64.b64encode(np.ascontiguousarray(array, dtype=np.float32).tobytes()).decode("ascii")
+
+def _decode_array(data, shape):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).reshape(shape)
+
+class TruncateProjection:
+    """
+    Keeps the first 'dimension' values of the embeddings, normalized again.
+    """
+    name = "truncate"
+
+    def __init__(self, dimension):
+        self.dimension = int(dimension)
+
+    def apply(self, vectors):
+        return list(_normalize(np.asarray(vectors, dtype=np.float32)[:, :self.dimension]))
+
+class PcaProjection:
+    """
+    Projects the centered embeddings on their first 'dimension' principal components, normalized again.
+    """
+    name = "pca"
+
+    def __init__(self, mean, components):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.dimension = self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors, dimension):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) < dimension:
+            raise ValueError(f"PCA to {dimension} dimensions needs at least as many samples, got {len(vectors)}")
+        mean = vectors.mean(axis=0)
+        _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+        return cls(mean, vt[:dimension])
+
+    def apply(self, vectors):
+        return list(_normalize((np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T))
+
+    def to_dict(self):
+        return {
+            "dimension": self.dimension,
+            "source_dimension": self.components.shape[1],
+            "mean": _encode_array(self.mean),
+            "components": _encode_array(self.components),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        source_dimension = data["source_dimension"]
+        return cls(
+            _decode_array(data["mean"], (source_dimension,)),
+            _decode_array(data["components"], (data["dimension"], source_dimension))
+        )
+
+def configured_projection():
+    """
+    Returns the projection configured by EMB_REDUCTION for a new index, PCA projections are fitted on the corpus so
+    they're not known until the first chunks are embedded.
+    """
+    if EMB_REDUCTION not in EMB_REDUCTIONS:
+        raise ValueError(f"Unsupported embedding reduction '{EMB_REDUCTION}', supported: {', '.join(EMB_REDUCTIONS)}")
+    if EMB_REDUCTION != "none" and EMB_DIMENSION <= 0:
+        raise ValueError(f"EMB_DIMENSION must be set to reduce the embeddings with EMB_REDUCTION={EMB_REDUCTION}")
+    return TruncateProjection(EMB_DIMENSION) if EMB_REDUCTION == "truncate" else None
+
+def project(vectors, projection=None):
+    """
+    Applies the projection, if any, to raw embeddings. Projections are passed along with the embeddings rather than
+    held by the shared embedder, different indexes may reduce the embeddings differently.
+    """
+    if projection is None or not len(vectors):
+        return vectors
+    return projection.apply(vectors)
+
+def iter_token_batches(items, token_count, token_budget=EMB_BATCH_TOKENS, max_size=EMB_BATCH_SIZE):
+    """
+    Groups the items into batches whose total token_count(item) stays within token_budget, with at most max_size
+    items per batch. An item larger than the budget makes a batch of its own.
+    """
+    batch, batch_tokens = [], 0
+    for item in items:
+        tokens = token_count(item)
+        if batch and (batch_tokens + tokens > token_budget or len(batch) >= max_size):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
 class Embedding:
     def __init__(self, emb_model, emb_endpoint, max_tokens):
         self.emb_model = emb_model
         self.emb_endpoint = emb_endpoint
         self.max_tokens = int(max_tokens)
+        self.truncate_prompt_tokens = self.max_tokens - 1
 
-    def embed_documents(self, texts):
-        return self._post_embedding(texts)
+        # Throughput of the embedding requests, time is counted while at least one request is in flight
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._busy_since = 0.0
+        self.stats = {"chunks": 0, "tokens": 0, "time": 0.0}
+
+    def _request_started(self):
+        with self._stats_lock:
+            if self._in_flight == 0:
+                self._busy_since = time.time()
+            self._in_flight += 1
+
+    def _request_done(self, chunks, tokens):
+        with self._stats_lock:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self.stats["time"] += time.time() - self._busy_since
+            self.stats["chunks"] += chunks
+            self.stats["tokens"] += tokens
+
+    def throughput(self):
+        """
+        Returns the (chunks/sec, tokens/sec) of the embedding requests made so far.
+        """
+        elapsed = self.stats["time"]
+        if not elapsed:
+            return 0.0, 0.0
+        return self.stats["chunks"] / elapsed, self.stats["tokens"] / elapsed
 
-    def embed_query(self, text):
-        return self._post_embedding([text])[0]
+    def embed_documents(self, texts, projection=None):
+        return project(self._post_embedding(texts), projection)
+
+    def embed_query(self, text, projection=None):
+        return project(self._post_embedding([text]), projection)[0]
+
+    def embed_raw(self, texts):
+        """
+        Returns the embeddings of the texts as returned by the model, without the projection.
+        """
+        return self._post_embedding(texts)
 
     def _post_embedding(self, texts):
+        self._request_started()
+        chunks, tokens = 0, 0
         try:
             payload = {
                 "input": texts,
                 "model": self.emb_model,
-                "truncate_prompt_tokens": self.max_tokens-1,
+                "truncate_prompt_tokens": self.truncate_prompt_tokens,
             }
             headers = {
                 "accept": "application/json",
@@ -42,6 +196,10 @@ class Embedding:
             response.raise_for_status()
             r = response.json()
             embeddings = [data['embedding'] for data in r['data']]
+            chunks = len(embeddings)
+            tokens = (r.get("usage") or {}).get("prompt_tokens") or sum(
+                min(estimate_tokens(text), self.truncate_prompt_tokens) for text in texts
+            )
             return [np.array(embed, dtype=np.float32) for embed in embeddings]
         except requests.exceptions.RequestException as e:
             error_details = str(e)
@@ -52,6 +210,8 @@ class Embedding:
         except Exception as e:
             logger.error(f"Error calling embedding API: {e}")
             raise e
+        finally:
+            self._request_done(chunks, tokens)
 
 def get_embedder(emb_model, emb_endpoint, max_tokens) -> Embedding:
     """
@@ -0,0 +1,191 @@
+from glob import glob
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from common.emb_utils import project
+from common.misc_utils import get_logger
+
+logger = get_logger("embedding_cache")
+
+# Directory in the index's cache dir holding the embeddings, kept when the index is reset
+EMBEDDING_CACHE_DIR = "embeddings"
+EMBEDDING_CACHE_DB = "embeddings.db"
+
+# Max number of host parameters per sqlite statement is 999 in older sqlite versions
+_SQLITE_BATCH_SIZE = 300
+
+_embedding_cache_instance = None
+
+class EmbeddingCache:
+    """
+    Persistent embeddings keyed by (embedding model, truncate setting, sha256 of the text).
+    Vectors are appended to a float32 matrix file per dimension and read back memory-mapped, an sqlite index maps
+    the keys to their row in the matrix.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._matrices = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, EMBEDDING_CACHE_DB), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (emb_model TEXT NOT NULL, truncate INTEGER NOT NULL, "
+            "content_hash TEXT NOT NULL, dim INTEGER NOT NULL, row INTEGER NOT NULL, "
+            "PRIMARY KEY (emb_model, truncate, content_hash))"
+        )
+        self._conn.commit()
+        self._repair()
+
+    def _repair(self):
+        # A crash while appending leaves a partial row at the end of a matrix, it's cut off and the keys pointing past
+        # the rows left are dropped
+        for matrix_path in glob(os.path.join(self.cache_dir, "vectors_*.f32")):
+            match = re.fullmatch(r"vectors_(\d+)\.f32", os.path.basename(matrix_path))
+            if not match:
+                continue
+            dim = int(match.group(1))
+            rows = self._truncate_matrix(matrix_path, dim)
+            deleted = self._conn.execute("DELETE FROM embeddings WHERE dim = ? AND row >= ?", (dim, rows)).rowcount
+            if deleted:
+                logger.warning(f"Dropped {deleted} embeddings missing from {matrix_path}")
+        self._conn.commit()
+
+    @staticmethod
+    def _truncate_matrix(matrix_path, dim):
+        """
+        Truncates the matrix file to a whole number of rows, returns the number of rows.
+        """
+        row_size = dim * 4
+        size = os.path.getsize(matrix_path)
+        rows = size // row_size
+        if size != rows * row_size:
+            logger.warning(f"Truncating partial row at the end of {matrix_path}")
+            with open(matrix_path, "r+b") as f:
+                f.truncate(rows * row_size)
+        return rows
+
+    @staticmethod
+    def _hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _matrix_path(self, dim):
+        return os.path.join(self.cache_dir, f"vectors_{dim}.f32")
+
+    def _matrix(self, dim, min_rows):
+        # The matrix file only grows, it's mapped again once rows beyond the current mapping are needed. Only whole
+        # rows are mapped, a partial row being appended is ignored
+        matrix = self._matrices.get(dim)
+        if matrix is None or len(matrix) < min_rows:
+            matrix_path = self._matrix_path(dim)
+            rows = os.path.getsize(matrix_path) // (dim * 4)
+            matrix = np.memmap(matrix_path, dtype=np.float32, mode="r", shape=(rows, dim))
+            self._matrices[dim] = matrix
+        return matrix
+
+    def get_many(self, emb_model, truncate, texts):
+        """
+        Returns {text: vector} for the texts present in the cache.
+        """
+        hashes = {self._hash(text): text for text in dict.fromkeys(texts)}
+        vectors = {}
+        with self._lock:
+            hash_list = list(hashes)
+            for i in range(0, len(hash_list), _SQLITE_BATCH_SIZE):
+                batch = hash_list[i:i + _SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, dim, row FROM embeddings WHERE emb_model = ? AND truncate = ? "
+                    f"AND content_hash IN ({placeholders})", [emb_model, truncate, *batch]
+                ).fetchall()
+                for content_hash, dim, row in rows:
+                    try:
+                        vectors[hashes[content_hash]] = np.array(self._matrix(dim, row + 1)[row])
+                    except (OSError, ValueError, IndexError) as e:
+                        # Unreadable vectors are embedded again
+                        logger.warning(f"Failed to read cached embedding of dimension {dim}: {e}")
+            self.lookups += len(hashes)
+            self.hits += len(vectors)
+        return vectors
+
+    def put_many(self, emb_model, truncate, texts, vectors):
+        """
+        Appends the vectors of the texts to the cache.
+        """
+        if not texts:
+            return
+        with self._lock:
+            by_dim = {}
+            for text, vector in zip(texts, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                by_dim.setdefault(len(vector), {})[self._hash(text)] = vector
+
+            for dim, dim_vectors in by_dim.items():
+                matrix_path = self._matrix_path(dim)
+                first_row = 0
+                if os.path.exists(matrix_path):
+                    first_row = self._truncate_matrix(matrix_path, dim)
+                    # The mapping might cover a partial row that was just cut off
+                    self._matrices.pop(dim, None)
+                with open(matrix_path, "ab") as f:
+                    f.write(np.stack(list(dim_vectors.values())).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Vectors are indexed only once written, a crash in between leaves unreferenced rows at most
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (emb_model, truncate, content_hash, dim, row) VALUES (?, ?, ?, ?, ?)",
+                    [(emb_model, truncate, content_hash, dim, first_row + i) for i, content_hash in enumerate(dim_vectors)]
+                )
+            self._conn.commit()
+
+    def hit_rate(self):
+        return (self.hits / self.lookups * 100) if self.lookups else 0.0
+
+    def close(self):
+        with self._lock:
+            self._matrices.clear()
+            self._conn.close()
+
+def embed_with_cache(embedder, texts, embedding_cache=None, projection=None):
+    """
+    Embeds the texts, only the texts missing in the embedding cache are sent to the embedding server.
+    The cache holds the raw embeddings, the projection is applied to the returned embeddings if given.
+    """
+    if embedding_cache is None:
+        vectors = embedder.embed_raw(texts)
+    else:
+        cached = embedding_cache.get_many(embedder.emb_model, embedder.truncate_prompt_tokens, texts)
+        missing = [text for text in dict.fromkeys(texts) if text not in cached]
+        if missing:
+            missing_vectors = embedder.embed_raw(missing)
+            embedding_cache.put_many(embedder.emb_model, embedder.truncate_prompt_tokens, missing, missing_vectors)
+            cached.update(zip(missing, missing_vectors))
+        vectors = [cached[text] for text in texts]
+    return project(vectors, projection)
+
+def get_embedding_cache(cache_dir=None):
+    """
+    Returns the embedding cache of the given index cache directory, or the current one if cache_dir is not passed.
+    """
+    global _embedding_cache_instance
+    if cache_dir is None:
+        return _embedding_cache_instance
+
+    embedding_dir = os.path.join(cache_dir, EMBEDDING_CACHE_DIR)
+    if _embedding_cache_instance is None or _embedding_cache_instance.cache_dir != embedding_dir:
+        if _embedding_cache_instance is not None:
+            _embedding_cache_instance.close()
+        try:
+            _embedding_cache_instance = EmbeddingCache(embedding_dir)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Embedding cache disabled, failed to open '{embedding_dir}': {e}")
+            _embedding_cache_instance = None
+    return _embedding_cache_instance
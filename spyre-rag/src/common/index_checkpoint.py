@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import threading
+
+from common.misc_utils import get_logger
+
+logger = get_logger("index_checkpoint")
+
+INDEX_CHECKPOINT_DB = "index_checkpoint.db"
+
+_index_checkpoint_instance = None
+
+class IndexCheckpoint:
+    """
+    Chunks committed to the index, recorded after every bulk request so that an interrupted or partially failed
+    indexing resumes with the chunks that are missing, without embedding the others again.
+    Chunks are identified by their document id, content hash & index in the document, the same as their chunk id.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, INDEX_CHECKPOINT_DB), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (doc_id TEXT NOT NULL, content_hash TEXT NOT NULL, chunk_index INTEGER NOT NULL, "
+            "PRIMARY KEY (doc_id, content_hash, chunk_index))"
+        )
+        self._conn.commit()
+
+    def commit(self, chunks):
+        """
+        Records the chunks, dicts with doc_id, content_hash & chunk_index, as indexed.
+        """
+        rows = [
+            (chunk["doc_id"], chunk["content_hash"], chunk["chunk_index"]) for chunk in chunks
+            if chunk.get("doc_id") and chunk.get("content_hash") and chunk.get("chunk_index") is not None
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO chunks (doc_id, content_hash, chunk_index) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def committed(self, doc_id, content_hash):
+        """
+        Returns the indexes of the chunks of the document version committed to the index.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_index FROM chunks WHERE doc_id = ? AND content_hash = ?", (doc_id, content_hash)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def discard(self, doc_id, keep_content_hash=None):
+        """
+        Forgets the chunks of the document, except the ones of keep_content_hash.
+        """
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM chunks WHERE doc_id = ? AND content_hash != ?", (doc_id, keep_content_hash or "")
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def get_index_checkpoint(cache_dir=None):
+    """
+    Returns the index checkpoint of the given index cache directory, or the current one if cache_dir is not passed.
+    """
+    global _index_checkpoint_instance
+    if cache_dir is None:
+        return _index_checkpoint_instance
+
+    if _index_checkpoint_instance is None or _index_checkpoint_instance.cache_dir != cache_dir:
+        if _index_checkpoint_instance is not None:
+            _index_checkpoint_instance.close()
+        _index_checkpoint_instance = IndexCheckpoint(cache_dir)
+    return _index_checkpoint_instance
@@ -1,4 +1,6 @@
 import logging
+import os
+import threading
 import requests
 from requests.adapters import HTTPAdapter
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -20,8 +22,20 @@ settings = get_settings()
 
 SESSION = None
 
+# Number of concurrent /tokenize requests made per batch
+TOKENIZE_MAX_WORKERS = 8
+# Max number of /tokenize requests in flight across every batch. Documents & chapters are chunked concurrently, so the
+# batches alone could hold the whole session pool, the limiter is capped to half the pool to leave connections for the
+# table summarization requests sharing the session
+TOKENIZE_MAX_CONCURRENCY = int(os.getenv("TOKENIZE_MAX_CONCURRENCY", "16"))
+_tokenize_limiter = threading.BoundedSemaphore(TOKENIZE_MAX_CONCURRENCY)
+
+# Token budget reserved while packing the context, for the separator between chunks and the special tokens of the question
+CONTEXT_SEPARATOR_TOKENS = 1
+QUESTION_SPECIAL_TOKENS = 2
+
 def create_llm_session(pool_maxsize, pool_connections: int = 2, pool_block: bool = True):
-    global SESSION
+    global SESSION, _tokenize_limiter
 
     # SESSION object will be used by instruct and embedding endpoints. Hence keeping pool_connections = 2
     # Need to use SESSION object for following reasons:
@@ -39,6 +53,7 @@ def create_llm_session(pool_maxsize, pool_connections: int = 2, pool_block: bool
         session.mount("https://", adapter)
 
         SESSION = session
+        _tokenize_limiter = threading.BoundedSemaphore(max(1, min(TOKENIZE_MAX_CONCURRENCY, pool_maxsize // 2)))
 
 def summarize_and_classify_single_table(prompt, gen_model, llm_endpoint):
     payload = {
@@ -118,16 +133,45 @@ def query_vllm_models(llm_endpoint):
         return {"error": str(e)}, 0.
     return resp_json
 
+def pack_context(question, documents, llm_endpoint):
+    """
+    Fills the input token budget with whole documents in rank order, only the last document that doesn't fit is trimmed.
+    Uses the token counts stored with the documents at ingestion, so the tokenizer is called only when they are missing
+    or the budget is too tight to decide without it.
+    """
+    from common.tokenizer_utils import get_llm_tokenizer
+    tokenizer = get_llm_tokenizer(llm_endpoint)
+
+    budget = settings.max_input_length - settings.prompt_template_token_count
+    doc_token_counts = [doc.get("token_count") for doc in documents]
+
+    # A token spans at least one byte, so the utf-8 length of the question (plus special tokens) bounds its token count
+    question_token_count = len(question.encode("utf-8")) + QUESTION_SPECIAL_TOKENS
+    if None in doc_token_counts or question_token_count + sum(doc_token_counts) + len(documents) * CONTEXT_SEPARATOR_TOKENS > budget:
+        question_token_count = tokenizer.count(question)
+
+    remaining_tokens = budget - question_token_count
+    contexts = []
+    for doc, token_count in zip(documents, doc_token_counts):
+        content = doc.get("page_content")
+        if token_count is None:
+            token_count = tokenizer.count(content)
+        if token_count <= remaining_tokens:
+            contexts.append(content)
+            remaining_tokens -= token_count + CONTEXT_SEPARATOR_TOKENS
+            continue
+        if remaining_tokens > 0:
+            contexts.append(tokenizer.truncate(content, remaining_tokens))
+        break
+
+    return "\n\n".join(contexts)
+
 def query_vllm_payload(question, documents, llm_endpoint, llm_model, stop_words, max_new_tokens, temperature,
                 stream):
-    context = "\n\n".join([doc.get("page_content") for doc in documents])
+    logger.debug(f'Original Context: {"\n\n".join([doc.get("page_content") for doc in documents])}')
 
-    logger.debug(f'Original Context: {context}')
-
-    # dynamic chunk truncation: truncates the context, if doesn't fit in the sequence length
-    question_token_count = len(tokenize_with_llm(question, llm_endpoint))
-    reamining_tokens = settings.max_input_length - (settings.prompt_template_token_count + question_token_count)
-    context = detokenize_with_llm(tokenize_with_llm(context, llm_endpoint)[:reamining_tokens], llm_endpoint)
+    # dynamic chunk truncation: packs the context by whole chunks, trimming only the chunk that doesn't fit in the sequence length
+    context = pack_context(question, documents, llm_endpoint)
     logger.debug(f"Truncated Context: {context}")
 
     prompt = settings.prompts.query_vllm_stream.format(context=context, question=question)
@@ -240,7 +284,8 @@ def tokenize_with_llm(prompt, emb_endpoint):
         "prompt": prompt
     }
     try:
-        response = SESSION.post(f"{emb_endpoint}/tokenize", json=payload)
+        with _tokenize_limiter:
+            response = SESSION.post(f"{emb_endpoint}/tokenize", json=payload)
         response.raise_for_status()
         result = response.json()
         tokens = result.get("tokens", [])
@@ -274,3 +319,24 @@ def detokenize_with_llm(tokens, emb_endpoint):
     except Exception as e:
         logger.error(f"Error decoding tokens: {e}")
         raise e
+
+def tokenize_batch_with_llm(prompts, emb_endpoint, max_workers=TOKENIZE_MAX_WORKERS):
+    """
+    Tokenizes a batch of prompts with concurrent requests to the tokenize endpoint, the requests in flight across all
+    the batches are bounded by TOKENIZE_MAX_CONCURRENCY.
+    Duplicate prompts are sent only once, tokens are returned in the same order as the prompts.
+    """
+    unique_prompts = list(dict.fromkeys(prompts))
+    if not unique_prompts:
+        return []
+
+    tokens_by_prompt = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_prompts))) as executor:
+        futures = {
+            executor.submit(tokenize_with_llm, prompt, emb_endpoint): prompt
+            for prompt in unique_prompts
+        }
+        for future in as_completed(futures):
+            tokens_by_prompt[futures[future]] = future.result()
+
+    return [tokens_by_prompt[prompt] for prompt in prompts]
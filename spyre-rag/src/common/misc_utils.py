@@ -1,4 +1,6 @@
+import gzip
 import hashlib
+import json
 import logging
 import os
 from pathlib import Path
@@ -6,9 +8,19 @@ from pathlib import Path
 LOG_LEVEL = logging.INFO
 
 LOCAL_CACHE_DIR = "/var/cache"
-chunk_suffix = "_clean_chunk.json"
-text_suffix = "_clean_text.json"
-table_suffix = "_tables.json"
+
+# Format of the intermediate artifacts persisted in the cache dir. "jsonl.gz" is compact and streamed back item by item,
+# "json" keeps the pretty-printed JSON files for debugging
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT", "jsonl.gz")
+# Artifacts are rewritten on every change of the document, favouring speed over ratio
+ARTIFACT_COMPRESS_LEVEL = 1
+
+_artifact_ext = ".json" if ARTIFACT_FORMAT == "json" else ".jsonl.gz"
+converted_suffix = ".json" if ARTIFACT_FORMAT == "json" else ".json.gz"
+chunk_suffix = f"_clean_chunk{_artifact_ext}"
+text_suffix = f"_clean_text{_artifact_ext}"
+table_suffix = f"_tables{_artifact_ext}"
+probe_suffix = ".probe.json"
 
 def set_log_level(level):
     global LOG_LEVEL
@@ -41,16 +53,116 @@ def get_txt_tab_filenames(file_paths, out_path):
     return original_filenames, input_txt_files, input_tab_files
 
 
+def iter_json_array(path, read_size=1 << 20):
+    """
+    Streams the elements of a JSON array file one at a time without loading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+        started = False
+        while True:
+            # Skip the whitespaces, reading the next block once the buffer is consumed
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos >= len(buffer):
+                if eof:
+                    raise ValueError(f"Unexpected end of JSON array in '{path}'")
+                more = f.read(read_size)
+                eof = not more
+                buffer, pos = more, 0
+                continue
+
+            ch = buffer[pos]
+            if not started:
+                if ch != "[":
+                    raise ValueError(f"Expected JSON array in '{path}'")
+                started = True
+                pos += 1
+                continue
+            if ch == "]":
+                return
+            if ch == ",":
+                pos += 1
+                continue
+
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+                # An element ending at the buffer boundary might continue in the next block
+                incomplete = end == len(buffer) and not eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                incomplete = True
+            if incomplete:
+                more = f.read(read_size)
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield obj
+            pos = end
+
+def write_artifact(path, items):
+    """
+    Writes the items of an iterable as an artifact in ARTIFACT_FORMAT, returns the number of items written.
+    The file is written to a temporary path and moved in place once complete.
+    """
+    tmp_path = f"{path}.tmp"
+    count = 0
+    if ARTIFACT_FORMAT == "json":
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("[")
+            for item in items:
+                f.write(",\n" if count else "\n")
+                f.write(json.dumps(item, indent=2))
+                count += 1
+            f.write("\n]")
+    else:
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=ARTIFACT_COMPRESS_LEVEL) as f:
+            for item in items:
+                f.write(json.dumps(item, separators=(",", ":")))
+                f.write("\n")
+                count += 1
+    os.replace(tmp_path, path)
+    return count
+
+def iter_artifact(path):
+    """
+    Streams the items of an artifact written by write_artifact, the format is picked from the file suffix.
+    """
+    if str(path).endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(64).lstrip()
+    if head.startswith("{"):
+        # Tables used to be persisted as an object keyed by the table index
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f).values()
+        return
+    yield from iter_json_array(path)
+
+def count_artifact_items(path):
+    return sum(1 for _ in iter_artifact(path))
+
 def get_model_endpoints():
     emb_model_dict = {
         'emb_endpoint': os.getenv("EMB_ENDPOINT"),
         'emb_model':    os.getenv("EMB_MODEL"),
         'max_tokens':   int(os.getenv("EMB_MAX_TOKENS", "512")),
+        'tokenizer_path': os.getenv("EMB_TOKENIZER_PATH", ""),
     }
 
     llm_model_dict = {
         'llm_endpoint': os.getenv("LLM_ENDPOINT", ""),
         'llm_model':    os.getenv("LLM_MODEL", ""),
+        'tokenizer_path': os.getenv("LLM_TOKENIZER_PATH", ""),
     }
 
     reranker_model_dict = {
@@ -68,10 +180,17 @@ def setup_cache_dir(dir):
 def generate_file_checksum(file):
     sha256 = hashlib.sha256()
     with open(file, 'rb') as f:
-        for chunk in iter(lambda: f.read(128 * sha256.block_size), b''):
+        for chunk in iter(lambda: f.read(1 << 20), b''):
             sha256.update(chunk)
     return sha256.hexdigest()
 
+def generate_doc_id(filename):
+    """
+    Stable id of a document in the vector store, derived from its canonical path so that the same file ingested through
+    relative, absolute or symlinked paths gets the same id.
+    """
+    return hashlib.md5(os.path.realpath(filename).encode("utf-8")).hexdigest()
+
 def verify_checksum(file, checksum_file):
     file_sha256 = generate_file_checksum(file)
     f = open(checksum_file, "r")
@@ -1,36 +1,170 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from glob import glob
+from itertools import chain, islice
+import json
 import os
+import time
 import shutil
 import numpy as np
 import hashlib
 from tqdm import tqdm
-from opensearchpy import OpenSearch, helpers
-
-from common.misc_utils import LOCAL_CACHE_DIR, get_logger
+from opensearchpy import NotFoundError, OpenSearch, helpers
+
+from common.emb_utils import (
+    EMB_BATCH_SIZE, EMB_BATCH_TOKENS, EMB_CONCURRENCY, EMB_DIMENSION, EMB_PCA_SAMPLE_SIZE, EMB_REDUCTION,
+    PcaProjection, TruncateProjection, configured_projection, estimate_tokens, iter_token_batches
+)
+from common.embedding_cache import EMBEDDING_CACHE_DIR, embed_with_cache
+from common.misc_utils import LOCAL_CACHE_DIR, get_logger, generate_doc_id, setup_cache_dir
 from common.vector_db import VectorStore
 
 logger = get_logger("OpenSearch")
 
-def generate_chunk_id(filename: str, page_content: str, index: int) -> int:
+# Page size of the aggregation listing the documents in the index
+DOCUMENT_AGG_PAGE_SIZE = 1000
+
+# Seconds the cached _meta of the index is trusted before checking that the index wasn't re-created or swapped behind
+# its alias meanwhile, e.g. by clean-db & ingest or migrate-db while the retrieval backend is running
+INDEX_META_CHECK_INTERVAL = 5
+
+# Encoding of the vectors in the knn index: float32, fp16 (faiss scalar quantization) or byte (lucene int8 vectors
+# scaled by a factor calibrated on the first embeddings indexed)
+VECTOR_ENCODINGS = ("float32", "fp16", "byte")
+VECTOR_ENCODING = os.getenv("VECTOR_ENCODING", "float32").lower()
+# Percentile of the absolute embedding values mapped to 127 by the byte encoding, the few values above are clipped
+BYTE_CALIBRATION_PERCENTILE = 99.9
+
+# Mapping of a new index: "default" indexes every field, "lean" only indexes the fields that are searched or filtered
+# on, keeps 'source' (table HTML, image paths) in _source only and the embeddings out of _source
+MAPPING_PROFILES = ("default", "lean")
+OPENSEARCH_MAPPING_PROFILE = os.getenv("OPENSEARCH_MAPPING_PROFILE", "default").lower()
+# Time allowed to copy the chunks of an index into one with another mapping profile
+REINDEX_TIMEOUT = 3600
+
+# Bulk ingest mode disables the refresh & replicas of the index while it's loaded, they're restored afterwards
+OPENSEARCH_BULK_INGEST = os.getenv("OPENSEARCH_BULK_INGEST", "true").lower() != "false"
+# Number of bulk requests in flight at once, each holding up to OPENSEARCH_BULK_MAX_BYTES of documents
+OPENSEARCH_BULK_THREADS = int(os.getenv("OPENSEARCH_BULK_THREADS", "4"))
+OPENSEARCH_BULK_MAX_BYTES = int(os.getenv("OPENSEARCH_BULK_MAX_BYTES", str(10 * 1024 * 1024)))
+# Documents rejected by an overloaded cluster (429) or failing on a transient error are retried with an exponential backoff
+OPENSEARCH_BULK_MAX_RETRIES = int(os.getenv("OPENSEARCH_BULK_MAX_RETRIES", "8"))
+BULK_INITIAL_BACKOFF = 1
+BULK_MAX_BACKOFF = 60
+# Number of segments the index is force merged to once loaded in bulk ingest mode, 0 skips the force merge
+OPENSEARCH_FORCE_MERGE_SEGMENTS = int(os.getenv("OPENSEARCH_FORCE_MERGE_SEGMENTS", "0"))
+FORCE_MERGE_TIMEOUT = 3600
+# Index settings to restore after a bulk ingest, kept in the cache dir so that an interrupted ingest restores them
+BULK_SETTINGS_FILE = "bulk_ingest_settings.json"
+
+# PCA projection of the embeddings of an index, stored in a side index so that the retrieval applies it to the queries
+PROJECTION_INDEX_SUFFIX = "_projection"
+PROJECTION_DOC_ID = "projection"
+
+def generate_chunk_id(doc_id: str, content_hash: str, index: int) -> int:
     """
-    Generate a unique, deterministic chunk ID based on filename, content, and index.
+    Generate a unique, deterministic chunk ID based on the document id, its content hash, and the chunk's index in the document.
     """
-    base = f"{filename}-{index}-{page_content}"
+    base = f"{doc_id}-{content_hash}-{index}"
     hash_digest = hashlib.md5(base.encode("utf-8")).hexdigest()
     chunk_int = int(hash_digest[:16], 16)    # Convert first 64 bits to int
     chunk_id = chunk_int % (2**63)           # Fit into signed 64-bit range
     return np.int64(chunk_id)
 
+def calibrate_byte_scale(vectors):
+    """
+    Returns the factor scaling the vectors to the int8 range, from the BYTE_CALIBRATION_PERCENTILE of their absolute values.
+    """
+    bound = float(np.percentile(np.abs(np.asarray(vectors, dtype=np.float32)), BYTE_CALIBRATION_PERCENTILE))
+    return 127.0 / bound if bound > 0 else 127.0
+
+def encode_vector(vector, encoding, scale=None):
+    """
+    Converts an embedding to the values stored in a knn_vector field of the given encoding.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    if encoding == "byte":
+        return np.clip(np.rint(vector * scale), -128, 127).astype(np.int8).tolist()
+    if encoding == "fp16":
+        # Inner product on normalized vectors ranks like the cosine similarity
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float16).tolist()
+    return vector.tolist()
+
+def knn_vector_mapping(dim, encoding, scale=None):
+    """
+    Returns the knn_vector mapping of the embedding field and the _meta of the index for the given encoding.
+    """
+    parameters = {"ef_construction": 128, "m": 24}
+    if encoding == "fp16":
+        parameters["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+        method = {"name": "hnsw", "space_type": "innerproduct", "engine": "faiss", "parameters": parameters}
+    else:
+        # HNSW is standard for high performance
+        method = {"name": "hnsw", "space_type": "cosinesimil", "engine": "lucene", "parameters": parameters}
+
+    mapping = {"type": "knn_vector", "dimension": dim, "method": method}
+    if encoding == "byte":
+        mapping["data_type"] = "byte"
+    meta = {"vector_encoding": encoding}
+    if scale is not None:
+        meta["vector_scale"] = scale
+    return mapping, meta
+
+def index_mappings(embedding_mapping, meta, profile):
+    """
+    Returns the mappings of an index of chunks for the mapping profile, given the knn_vector mapping of the embeddings.
+    """
+    properties = {
+        "chunk_id": {"type": "long"},
+        "embedding": embedding_mapping,
+        "page_content": {"type": "text", "analyzer": "standard"},
+        "filename": {"type": "keyword"},
+        "doc_id": {"type": "keyword"},
+        "content_hash": {"type": "keyword"},
+        "type": {"type": "keyword"},
+        "source": {"type": "keyword"},
+        "language": {"type": "keyword"},
+        "token_count": {"type": "integer"}
+    }
+    mappings = {"_meta": {**meta, "mapping_profile": profile}, "properties": properties}
+    if profile == "lean":
+        # chunk_id & filename are only returned & aggregated, page_content is only matched, never phrase searched
+        properties["chunk_id"]["index"] = False
+        properties["filename"]["index"] = False
+        properties["page_content"]["index_options"] = "freqs"
+        properties["source"] = {"type": "keyword", "index": False, "doc_values": False}
+        # Vectors are searched in the knn index, never read back from _source
+        mappings["_source"] = {"excludes": ["embedding"]}
+    return mappings
+
 class OpensearchNotReadyError(Exception):
     pass
 
 class OpensearchVectorStore(VectorStore):
-    def __init__(self):
+    def __init__(self, index_name=None, vector_encoding=None):
         self.host = os.getenv("OPENSEARCH_HOST")
         self.port = os.getenv("OPENSEARCH_PORT")
         self.db_prefix = os.getenv("OPENSEARCH_DB_PREFIX", "rag").lower()
         i_name = os.getenv("OPENSEARCH_INDEX_NAME", "default")
-        self.index_name = self._generate_index_name(i_name.lower())
+        self.index_name = index_name or self._generate_index_name(i_name.lower())
+        # Encoding of the vectors of a new index, an existing index keeps the encoding it was created with
+        self.vector_encoding = (vector_encoding or VECTOR_ENCODING).lower()
+        if self.vector_encoding not in VECTOR_ENCODINGS:
+            raise ValueError(f"Unsupported vector encoding '{self.vector_encoding}', supported: {', '.join(VECTOR_ENCODINGS)}")
+        self.mapping_profile = OPENSEARCH_MAPPING_PROFILE
+        if self.mapping_profile not in MAPPING_PROFILES:
+            raise ValueError(f"Unsupported mapping profile '{self.mapping_profile}', supported: {', '.join(MAPPING_PROFILES)}")
+        self._index_meta = None
+        # uuid of the index the cached details were read from
+        self._index_uuid = None
+        self._index_checked_at = 0.0
+        # uuid of the index whose mapping was brought up to date by _setup_index
+        self._setup_index_uuid = None
+        # Projection of the embeddings of the index, resolved from its _meta or fitted when the index is created
+        self._projection = configured_projection()
+        self._projection_loaded = False
 
         self.client = OpenSearch(
             hosts=[{'host': self.host, 'port': self.port}],
@@ -40,6 +174,8 @@ class OpensearchVectorStore(VectorStore):
             verify_certs=False,
             ssl_show_warn=False
         )
+        self._bulk_ingest = False
+        self._bulk_settings_applied = False
         self._create_pipeline()
 
     def _generate_index_name(self, name):
@@ -68,11 +204,157 @@ class OpensearchVectorStore(VectorStore):
         except Exception as e:
             logger.error(f"Failed to create hybrid search pipeline: {e}")
 
-    def _setup_index(self, dim):
-        if self.client.indices.exists(index=self.index_name):
+    def _get_index_uuid(self):
+        """
+        Returns the uuid of the indices behind the index name, None if it doesn't exist.
+        """
+        try:
+            response = self.client.indices.get_settings(index=self.index_name, name="index.uuid")
+        except NotFoundError:
+            return None
+        return ",".join(sorted(settings["settings"]["index"]["uuid"] for settings in response.values()))
+
+    def _invalidate_index_cache(self):
+        self._index_meta = None
+        # The projection is recorded with the index, a re-created index might be reduced another way
+        self._projection = configured_projection()
+        self._projection_loaded = False
+
+    def _check_index_identity(self):
+        # Cached details of the index are dropped once it's deleted, re-created or swapped behind its alias
+        now = time.monotonic()
+        if now - self._index_checked_at < INDEX_META_CHECK_INTERVAL:
+            return
+        self._index_checked_at = now
+        index_uuid = self._get_index_uuid()
+        if index_uuid != self._index_uuid:
+            if self._index_uuid is not None:
+                logger.info(f"Index {self.index_name} was re-created, reloading its mapping")
+                self._invalidate_index_cache()
+            self._index_uuid = index_uuid
+
+    def _get_index_meta(self):
+        """
+        Returns the _meta of the index mapping, None if the index doesn't exist.
+        """
+        self._check_index_identity()
+        if self._index_meta is None:
+            if not self.client.indices.exists(index=self.index_name):
+                return None
+            response = self.client.indices.get_mapping(index=self.index_name)
+            # Indices created before the encoding, reduction & profile were configurable hold float32 vectors of the model
+            self._index_meta = {"vector_encoding": "float32", "emb_reduction": "none", "mapping_profile": "default"}
+            self._index_meta.update(next(iter(response.values()))["mappings"].get("_meta") or {})
+            if self._index_meta["vector_encoding"] != self.vector_encoding:
+                logger.warning(
+                    f"Index {self.index_name} holds {self._index_meta['vector_encoding']} vectors, "
+                    f"VECTOR_ENCODING={self.vector_encoding} only applies once the index is re-created"
+                )
+            if self._index_meta["emb_reduction"] != EMB_REDUCTION:
+                logger.warning(
+                    f"Index {self.index_name} holds embeddings with {self._index_meta['emb_reduction']} reduction, "
+                    f"EMB_REDUCTION={EMB_REDUCTION} only applies once the index is re-created"
+                )
+            if self._index_meta["mapping_profile"] != self.mapping_profile:
+                logger.warning(
+                    f"Index {self.index_name} has the {self._index_meta['mapping_profile']} mapping profile, "
+                    f"OPENSEARCH_MAPPING_PROFILE={self.mapping_profile} only applies once the index is migrated or re-created"
+                )
+        return self._index_meta
+
+    def _get_index_encoding(self):
+        """
+        Returns the (encoding, scale) of the vectors in the index, read from the _meta of its mapping.
+        """
+        meta = self._get_index_meta()
+        if meta is None:
+            return self.vector_encoding, None
+        return meta["vector_encoding"], meta.get("vector_scale")
+
+    def _projection_index(self):
+        return f"{self.index_name}{PROJECTION_INDEX_SUFFIX}"
+
+    def get_projection(self):
+        """
+        Returns the projection reducing the embeddings of the index, None if they keep the dimension of the model.
+        An existing index keeps the reduction recorded in its _meta, a new one gets the reduction configured by
+        EMB_REDUCTION once its first chunks are inserted.
+        """
+        meta = self._get_index_meta()
+        if self._projection_loaded:
+            return self._projection
+        if meta is None:
+            return self._projection
+        if meta["emb_reduction"] == "truncate":
+            self._projection = TruncateProjection(meta["emb_dimension"])
+        elif meta["emb_reduction"] == "pca":
+            response = self.client.get(index=self._projection_index(), id=PROJECTION_DOC_ID)
+            self._projection = PcaProjection.from_dict(response["_source"])
+        else:
+            self._projection = None
+        self._projection_loaded = True
+        return self._projection
+
+    def _fit_projection(self, embedder, items, embedding_cache=None):
+        """
+        Fits the PCA projection of a new index on the embeddings of its first EMB_PCA_SAMPLE_SIZE chunks and stores it
+        in the projection index. Returns the items to insert, the sampled ones included.
+        """
+        sample = list(islice(items, EMB_PCA_SAMPLE_SIZE))
+        texts = [chunk.get("page_content") for chunk, _ in sample]
+        vectors = []
+        for batch in iter_token_batches(texts, estimate_tokens):
+            vectors.extend(embed_with_cache(embedder, batch, embedding_cache))
+        try:
+            projection = PcaProjection.fit(vectors, EMB_DIMENSION)
+        except ValueError as e:
+            logger.warning(f"Embeddings of {self.index_name} are not reduced: {e}")
+            projection = None
+
+        if projection is not None:
+            projection_index = self._projection_index()
+            if not self.client.indices.exists(index=projection_index):
+                # Nothing of the projection is searched, it's only read back by id
+                self.client.indices.create(index=projection_index, body={"mappings": {"dynamic": False}})
+            self.client.index(
+                index=projection_index, id=PROJECTION_DOC_ID, body={"emb_model": embedder.emb_model, **projection.to_dict()},
+                refresh=True
+            )
+            logger.info(f"PCA projection of the embeddings to {EMB_DIMENSION} dimensions fitted on {len(vectors)} chunks")
+        self._projection = projection
+        self._projection_loaded = True
+        return chain(sample, items)
+
+    def _encode_vector(self, vector):
+        encoding, scale = self._get_index_encoding()
+        return encode_vector(vector, encoding, scale)
+
+    def _setup_index(self, dim, sample=None):
+        """
+        Creates the index if it doesn't exist, sample embeddings calibrate the scale of the byte encoding.
+        """
+        if self._get_index_meta() is not None:
+            # Done once per index, the uuid changes when the index is re-created or swapped behind its alias
+            if self._setup_index_uuid == self._index_uuid:
+                return
             logger.info(f"Index {self.index_name} already present in vectorstore")
+            # Indices created before documents were versioned lack these fields
+            self.client.indices.put_mapping(
+                index=self.index_name,
+                body={"properties": {"doc_id": {"type": "keyword"}, "content_hash": {"type": "keyword"}}}
+            )
+            self._setup_index_uuid = self._index_uuid
             return
 
+        scale = None
+        if self.vector_encoding == "byte":
+            scale = calibrate_byte_scale(sample) if sample is not None else 127.0
+        embedding_mapping, meta = knn_vector_mapping(dim, self.vector_encoding, scale)
+        # Reduction of the embeddings, the same projection is applied to the queries
+        projection = self._projection if self._projection_loaded else None
+        meta["emb_reduction"] = projection.name if projection is not None else "none"
+        meta["emb_dimension"] = dim
+
         # index body: setting and mappings
         index_body = {
             "settings": {
@@ -81,104 +363,303 @@ class OpensearchVectorStore(VectorStore):
                     "knn.algo_param.ef_search": 100
                 }
             },
-            "mappings": {
-                "properties": {
-                    "chunk_id": {"type": "long"},
-                    "embedding": {
-                        "type": "knn_vector",
-                        "dimension": dim,
-                        "method": {
-                            "name": "hnsw",    # HNSW is standard for high performance
-                            "space_type": "cosinesimil",
-                            "engine": "lucene",
-                            "parameters": {
-                                "ef_construction": 128,
-                                "m": 24
-                            }
-                        }
-                    },
-                     "page_content": {
-                        "type": "text", 
-                        "analyzer": "standard"
-                    },
-                    "filename": {"type": "keyword"},
-                    "type": {"type": "keyword"},
-                    "source": {"type": "keyword"},
-                    "language": {"type": "keyword"}
-                }
-            }
+            "mappings": index_mappings(embedding_mapping, meta, self.mapping_profile)
         }
         # Create the Index
         self.client.indices.create(index=self.index_name, body=index_body)
+        self._index_meta = index_body["mappings"]["_meta"]
+        self._index_uuid = self._get_index_uuid()
+        self._index_checked_at = time.monotonic()
+        self._setup_index_uuid = self._index_uuid
+        logger.info(
+            f"Index {self.index_name} created with {self.vector_encoding} vectors of dimension {dim}, "
+            f"{meta['emb_reduction']} reduction, {self.mapping_profile} mapping profile"
+        )
+        if self._bulk_ingest:
+            self._apply_bulk_settings()
+
+    def _bulk_settings_path(self):
+        return os.path.join(setup_cache_dir(self.index_name), BULK_SETTINGS_FILE)
+
+    def _apply_bulk_settings(self):
+        settings_path = self._bulk_settings_path()
+        if not os.path.exists(settings_path):
+            response = self.client.indices.get_settings(index=self.index_name)
+            index_settings = next(iter(response.values()))["settings"]["index"]
+            # Settings not set explicitly are restored to their defaults with a null value
+            saved = {key: index_settings.get(key) for key in ("refresh_interval", "number_of_replicas")}
+            with open(settings_path, "w") as f:
+                json.dump(saved, f)
+        self.client.indices.put_settings(
+            index=self.index_name, body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+        )
+        self._bulk_settings_applied = True
+        logger.debug(f"Refresh & replicas of {self.index_name} disabled for bulk ingest")
+
+    def _restore_bulk_settings(self):
+        settings_path = self._bulk_settings_path()
+        try:
+            with open(settings_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {"refresh_interval": None, "number_of_replicas": None}
+        try:
+            self.client.indices.put_settings(index=self.index_name, body={"index": saved})
+            self.client.indices.refresh(index=self.index_name)
+            if OPENSEARCH_FORCE_MERGE_SEGMENTS:
+                logger.info(f"Force merging {self.index_name} to {OPENSEARCH_FORCE_MERGE_SEGMENTS} segment(s)")
+                self.client.indices.forcemerge(
+                    index=self.index_name, max_num_segments=OPENSEARCH_FORCE_MERGE_SEGMENTS, request_timeout=FORCE_MERGE_TIMEOUT
+                )
+        except Exception as e:
+            logger.error(f"Failed to restore the settings of {self.index_name} after bulk ingest, they're restored on the next ingest: {e}")
+            return
+        os.remove(settings_path)
+        self._bulk_settings_applied = False
+        logger.debug(f"Settings of {self.index_name} restored after bulk ingest")
 
-    def insert_chunks(self, chunks, vectors=None, embedder=None, batch_size=10):
+    @contextmanager
+    def bulk_ingest(self):
+        """
+        Loads the index with refresh & replicas disabled if OPENSEARCH_BULK_INGEST is set. Settings are restored, the
+        index refreshed and force merged if OPENSEARCH_FORCE_MERGE_SEGMENTS is set, once the load is done.
+        """
+        if not OPENSEARCH_BULK_INGEST:
+            yield
+            return
+        self._bulk_ingest = True
+        try:
+            if self.client.indices.exists(index=self.index_name):
+                self._apply_bulk_settings()
+            yield
+        finally:
+            self._bulk_ingest = False
+            if self._bulk_settings_applied:
+                self._restore_bulk_settings()
+
+    def _bulk(self, actions):
+        """
+        Bulk indexes the actions in requests of up to OPENSEARCH_BULK_MAX_BYTES. Items rejected with 429 are retried by
+        streaming_bulk, items failing on a transient error (5xx, connection) are retried alone with an exponential backoff.
+        Returns the ids of the documents indexed and the failed items.
+        """
+        remaining = {action["_id"]: action for action in actions}
+        failed = {}
+        for attempt in range(OPENSEARCH_BULK_MAX_RETRIES + 1):
+            if attempt:
+                logger.warning(f"Retrying {len(remaining)} chunk(s) that failed to be indexed, attempt {attempt}")
+                time.sleep(min(BULK_MAX_BACKOFF, BULK_INITIAL_BACKOFF * 2 ** (attempt - 1)))
+            retry = {}
+            for _, item in helpers.streaming_bulk(
+                self.client, list(remaining.values()), chunk_size=max(len(remaining), 1),
+                max_chunk_bytes=OPENSEARCH_BULK_MAX_BYTES, raise_on_error=False, raise_on_exception=False,
+                max_retries=OPENSEARCH_BULK_MAX_RETRIES, initial_backoff=BULK_INITIAL_BACKOFF,
+                max_backoff=BULK_MAX_BACKOFF, yield_ok=False
+            ):
+                info = next(iter(item.values()))
+                _id = str(info.get("_id"))
+                status = info.get("status")
+                # Connection errors have no status code
+                transient = status == "N/A" or (isinstance(status, int) and status >= 500)
+                if _id in remaining and transient and attempt < OPENSEARCH_BULK_MAX_RETRIES:
+                    retry[_id] = remaining[_id]
+                else:
+                    failed[_id] = item
+            remaining = retry
+            if not remaining:
+                break
+        return [action["_id"] for action in actions if action["_id"] not in failed], list(failed.values())
+
+    def insert_chunks(self, chunks, vectors=None, embedder=None, batch_size=EMB_BATCH_SIZE, embedding_cache=None,
+                      token_budget=EMB_BATCH_TOKENS, concurrency=EMB_CONCURRENCY, checkpoint=None, on_failed_chunks=None):
         """
         Supports 2 modes of insertion
         1. Pure embedding: pass 'chunks' and 'vectors'
-        2. Text chunks: pass 'chunks' and 'embedder' (class instance)
+        2. Text chunks: pass 'chunks' and 'embedder' (class instance), vectors found in 'embedding_cache' aren't re-embedded,
+           they're reduced by the projection of the index
+        chunks & vectors can be any iterables, they're consumed batch by batch. Returns the number of chunks inserted.
+        Chunks indexed by every bulk request are committed to 'checkpoint', chunks failing to be indexed are logged,
+        passed to 'on_failed_chunks' and skipped, they're indexed again by the next ingestion.
+
+        Batches hold up to 'token_budget' tokens and 'batch_size' chunks, 'concurrency' batches are embedded at once
+        while the previous batches are bulk indexed by OPENSEARCH_BULK_THREADS threads.
         """
-
-        if not chunks:
-            logger.debug("Nothing to chunk!")
-            return
-
-        # Handle Pre-computed Vectors if provided
-        if vectors is not None:
-            final_embeddings = vectors
-            # Initialize index using pre-computed vector dimension
-            self._setup_index(len(final_embeddings[0]))
-
-        logger.debug(f"Inserting {len(chunks)} chunks into OpenSearch...")
-
-        # Iterate through chunks in batches and insert in bulk
-        for i in tqdm(range(0, len(chunks), batch_size)):
-            batch = chunks[i:i + batch_size]
-            page_contents = [doc.get("page_content") for doc in batch]
-
-            # Generate embeddings only for this specific batch
+        items = zip(chunks, vectors) if vectors is not None else ((chunk, None) for chunk in chunks)
+        projection = None
+        if vectors is None and embedder is not None:
+            # Chunks are embedded with the projection of the index, fitted first if the index is new & reduced by PCA
+            if EMB_REDUCTION == "pca" and self._get_index_meta() is None:
+                items = self._fit_projection(embedder, items, embedding_cache)
+            projection = self.get_projection()
+            self._projection_loaded = True
+        max_chunk_tokens = embedder.truncate_prompt_tokens if embedder is not None else token_budget
+
+        def _chunk_tokens(item):
+            # LLM token count of the chunk stands in for its embedding token count
+            chunk = item[0]
+            return min(chunk.get("token_count") or estimate_tokens(chunk.get("page_content")), max_chunk_tokens)
+
+        def _embed(batch):
             if vectors is None and embedder is not None:
-                current_batch_embeddings = embedder.embed_documents(page_contents)
-
-                # Initialize index on the first batch if not already done
-                if i == 0:
-                    dim = len(current_batch_embeddings[0])
-                    self._setup_index(dim)
-            else:
-                # Use the relevant slice from pre-computed vectors
-                current_batch_embeddings = final_embeddings[i:i + batch_size]
-
-            # 3. Transform batch to OpenSearch document format
-            actions = []
-            for j, (doc, emb) in enumerate(zip(batch, current_batch_embeddings)):
-                fn = doc.get("filename", "")
-                pc = doc.get("page_content", "")
-
-                # Generate chunk ID
-                cid = generate_chunk_id(fn, pc, i + j)
-
-                actions.append({
-                    "_index": self.index_name,
-                    "_id": str(cid),
-                    "_source": {
-                        "chunk_id": cid,
-                        "embedding": emb.tolist() if isinstance(emb, np.ndarray) else emb,
-                        "page_content": pc,
-                        "filename": fn,
-                        "type": doc.get("type", ""),
-                        "source": doc.get("source", ""),
-                        "language": doc.get("language", "")
-                    }
-                })
-
-            # Bulk insert the current batch
-            success, failed = helpers.bulk(self.client, actions, stats_only=True)
+                return embed_with_cache(
+                    embedder, [chunk.get("page_content") for chunk, _ in batch], embedding_cache, projection
+                )
+            return [vector for _, vector in batch]
+
+        logger.debug("Inserting chunks into OpenSearch...")
+
+        inserted = 0
+        indexed_offset = 0
+        progress = tqdm(desc="Indexing chunks", unit="chunk")
+        # (offset of the batch, batch, embedding future) and (bulk future, offset, size) in submission order
+        pending = deque()
+        bulk_futures = deque()
+        embed_executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        bulk_executor = ThreadPoolExecutor(max_workers=max(1, OPENSEARCH_BULK_THREADS))
+
+        def _wait_bulk():
+            # Waits for the oldest bulk request and commits its indexed chunks
+            nonlocal inserted
+            future, offset, batch, actions = bulk_futures.popleft()
+            indexed_ids, failed = future.result()
+            inserted += len(indexed_ids)
+            indexed_ids = set(indexed_ids)
+            if checkpoint is not None:
+                checkpoint.commit([chunk for (chunk, _), action in zip(batch, actions) if action["_id"] in indexed_ids])
             if failed:
-                logger.error(f"Failed to insert {failed} chunks in batch starting at {i}")
-                return
-            logger.debug(f"Successfully indexed {success} chunks. Failed: {failed}")
+                logger.error(f"Failed to insert {len(failed)} chunks in batch starting at {offset}: {failed[0]}")
+                if on_failed_chunks is not None:
+                    on_failed_chunks([chunk for (chunk, _), action in zip(batch, actions) if action["_id"] not in indexed_ids])
+            logger.debug(f"Successfully indexed {len(indexed_ids)} chunks. Failed: {len(failed)}")
+            progress.update(len(batch))
+
+        def _index_oldest():
+            offset, batch, embed_future = pending.popleft()
+            actions = self._chunk_actions(batch, embed_future.result(), offset)
+            if len(bulk_futures) >= OPENSEARCH_BULK_THREADS:
+                _wait_bulk()
+            bulk_futures.append((bulk_executor.submit(self._bulk, actions), offset, batch, actions))
 
-        logger.debug(f"Inserted the {len(chunks)} into index.")
+        try:
+            for batch in iter_token_batches(items, _chunk_tokens, token_budget, batch_size):
+                pending.append((indexed_offset, batch, embed_executor.submit(_embed, batch)))
+                indexed_offset += len(batch)
+                # The oldest batch is indexed once embedded, while the next ones keep embedding
+                while len(pending) >= concurrency or (pending and pending[0][2].done()):
+                    _index_oldest()
+            while pending:
+                _index_oldest()
+            while bulk_futures:
+                _wait_bulk()
+        finally:
+            embed_executor.shutdown(cancel_futures=True)
+            bulk_executor.shutdown(cancel_futures=True)
+            progress.close()
+
+        if not inserted:
+            logger.debug("Nothing to chunk!")
+        logger.debug(f"Inserted the {inserted} into index.")
+        return inserted
+
+    def _chunk_actions(self, batch, embeddings, offset):
+        """
+        Transforms a batch of (chunk, vector) items and their embeddings to OpenSearch bulk actions.
+        """
+        # Initialize index on the first batch
+        if offset == 0:
+            self._setup_index(len(embeddings[0]), sample=embeddings)
+
+        actions = []
+        for j, ((doc, _), emb) in enumerate(zip(batch, embeddings)):
+            fn = doc.get("filename", "")
+            pc = doc.get("page_content", "")
+            doc_id = doc.get("doc_id") or generate_doc_id(fn)
+            content_hash = doc.get("content_hash", "")
+
+            # Generate chunk ID
+            cid = generate_chunk_id(doc_id, content_hash, doc.get("chunk_index", offset + j))
+
+            actions.append({
+                "_index": self.index_name,
+                "_id": str(cid),
+                "_source": {
+                    "chunk_id": cid,
+                    "embedding": self._encode_vector(emb),
+                    "page_content": pc,
+                    "filename": fn,
+                    "doc_id": doc_id,
+                    "content_hash": content_hash,
+                    "type": doc.get("type", ""),
+                    "source": doc.get("source", ""),
+                    "language": doc.get("language", ""),
+                    "token_count": doc.get("token_count")
+                }
+            })
+        return actions
 
+    def get_indexed_documents(self):
+        """
+        Returns {doc_id: {"filename": str, "hashes": {content_hash: chunk_count}}} of the documents in the index.
+        Chunks indexed before documents were versioned are reported under the doc_id of their filename with a None hash.
+        """
+        documents = {}
+        if not self.client.indices.exists(index=self.index_name):
+            return documents
+        # Chunks of an interrupted bulk ingest might not be visible yet
+        self.client.indices.refresh(index=self.index_name)
+
+        composite = {
+            "size": DOCUMENT_AGG_PAGE_SIZE,
+            "sources": [
+                {"doc_id": {"terms": {"field": "doc_id", "missing_bucket": True}}},
+                {"content_hash": {"terms": {"field": "content_hash", "missing_bucket": True}}},
+                {"filename": {"terms": {"field": "filename"}}}
+            ]
+        }
+        while True:
+            response = self.client.search(
+                index=self.index_name, body={"size": 0, "aggs": {"documents": {"composite": composite}}}
+            )
+            agg = response["aggregations"]["documents"]
+            for bucket in agg["buckets"]:
+                key = bucket["key"]
+                doc_id = key["doc_id"] or generate_doc_id(key["filename"])
+                document = documents.setdefault(doc_id, {"filename": key["filename"], "hashes": {}})
+                document["hashes"][key["content_hash"]] = document["hashes"].get(key["content_hash"], 0) + bucket["doc_count"]
+            if not agg["buckets"] or "after_key" not in agg:
+                break
+            composite["after"] = agg["after_key"]
+        return documents
+
+    def delete_documents(self, documents, keep_content_hashes=None):
+        """
+        Deletes all the chunks of the documents, one delete-by-query per document. The index is refreshed once all the
+        documents are deleted, or left to the end of the load in bulk ingest mode.
+        documents: {doc_id: filename}, chunks indexed before documents were versioned are matched by their filename.
+        keep_content_hashes: {doc_id: content_hash} of the document versions whose chunks are kept.
+        """
+        keep_content_hashes = keep_content_hashes or {}
+        deleted = 0
+        # filename isn't searchable in lean indices, all their chunks have a doc_id
+        match_filename = (self._get_index_meta() or {}).get("mapping_profile") != "lean"
+        for doc_id, filename in documents.items():
+            should = [{"term": {"doc_id": doc_id}}]
+            if match_filename:
+                should.append({"term": {"filename": filename}})
+            query = {"bool": {"should": should, "minimum_should_match": 1}}
+            if keep_content_hashes.get(doc_id):
+                query["bool"]["must_not"] = [{"term": {"content_hash": keep_content_hashes[doc_id]}}]
+            response = self.client.delete_by_query(
+                index=self.index_name,
+                body={"query": query},
+                conflicts="proceed",
+                refresh=False
+            )
+            deleted += response.get("deleted", 0)
+        if deleted and not self._bulk_ingest:
+            self.client.indices.refresh(index=self.index_name)
+        logger.debug(f"Deleted {deleted} chunks of {len(documents)} document(s)")
+        return deleted
 
     def search(self, query, vector=None, embedder=None, top_k=5, mode="hybrid", language='en'):
         """
@@ -191,9 +672,12 @@ class OpensearchVectorStore(VectorStore):
         if vector is not None:
             query_vector = vector
         elif embedder is not None:
-            query_vector = embedder.embed_query(query)
+            # Queries are reduced like the embeddings of the index
+            query_vector = embedder.embed_query(query, self.get_projection())
         else:
             raise ValueError("Provide 'vector' or 'embedder' to perform search.")
+        # Query is encoded the same way as the indexed vectors
+        query_vector = self._encode_vector(query_vector)
 
         limit = top_k * 3
         params = {}
@@ -202,11 +686,11 @@ class OpensearchVectorStore(VectorStore):
             # 1. Define the k-NN search body
             search_body = {
                 "size": limit,
-                "_source": ["chunk_id", "page_content", "filename", "type", "source", "language"],
+                "_source": ["chunk_id", "page_content", "filename", "type", "source", "language", "token_count"],
                 "query": {
                     "knn": {
                         "embedding": {
-                            "vector": query_vector.tolist() if isinstance(query_vector, np.ndarray) else query_vector,
+                            "vector": query_vector,
                             "k": limit,
                             # Efficient pre-filtering
                             "filter": {
@@ -221,7 +705,7 @@ class OpensearchVectorStore(VectorStore):
             # Standard full-text match for sparse/keyword logic
             search_body = {
                 "size": limit,
-                "_source": ["chunk_id", "page_content", "filename", "type", "source", "language"],
+                "_source": ["chunk_id", "page_content", "filename", "type", "source", "language", "token_count"],
                 "query": {
                     "bool": {
                         "must": [
@@ -237,7 +721,7 @@ class OpensearchVectorStore(VectorStore):
             # OpenSearch Hybrid Query combines Dense (k-NN) and Sparse (Match)
             search_body = {
                 "size": top_k, # Final number of results after fusion
-                "_source": ["chunk_id", "page_content", "filename", "type", "source", "language"],
+                "_source": ["chunk_id", "page_content", "filename", "type", "source", "language", "token_count"],
                 "query": {
                     "hybrid": {
                         "queries": [
@@ -245,7 +729,7 @@ class OpensearchVectorStore(VectorStore):
                             {
                                 "knn": {
                                     "embedding": {
-                                        "vector": query_vector.tolist() if isinstance(query_vector, np.ndarray) else query_vector,
+                                        "vector": query_vector,
                                         "k": limit,
                                         "filter": {"term": {"language": language}} if language else None
                                     }
@@ -275,25 +759,140 @@ class OpensearchVectorStore(VectorStore):
 
         return results
 
+    def iter_chunks(self):
+        """
+        Streams the chunks in the index, without their embeddings.
+        """
+        if not self.client.indices.exists(index=self.index_name):
+            return
+        query = {"query": {"match_all": {}}, "_source": {"excludes": ["embedding"]}}
+        for hit in helpers.scan(self.client, index=self.index_name, query=query, size=DOCUMENT_AGG_PAGE_SIZE):
+            yield hit["_source"]
+
+    def index_size(self):
+        """
+        Returns the size of the primary shards of the index in bytes.
+        """
+        stats = self.client.indices.stats(index=self.index_name, metric="store")
+        return stats["_all"]["primaries"]["store"]["size_in_bytes"]
+
     def check_db_populated(self, emb_model, emb_endpoint, max_tokens):
         if not self.client.indices.exists(index=self.index_name):
             return False
         return True
 
-    def reset_index(self):
+    def _concrete_indices(self):
+        """
+        Returns the indices holding the chunks, the index itself unless it was migrated behind an alias of its name.
+        """
+        if self.client.indices.exists_alias(name=self.index_name):
+            return list(self.client.indices.get_alias(name=self.index_name))
         if self.client.indices.exists(index=self.index_name):
-            self.client.indices.delete(index=self.index_name)
+            return [self.index_name]
+        return []
+
+    def migrate_index(self, mapping_profile=None):
+        """
+        Moves the chunks of the index into a new index with the mapping of the profile, OPENSEARCH_MAPPING_PROFILE by
+        default. The new index replaces the old one behind an alias named after the index, the old one is deleted.
+        Documents shouldn't be ingested during the migration, chunks indexed meanwhile would be lost.
+        Returns the name of the new index, None if there was nothing to migrate.
+        """
+        mapping_profile = (mapping_profile or self.mapping_profile).lower()
+        if mapping_profile not in MAPPING_PROFILES:
+            raise ValueError(f"Unsupported mapping profile '{mapping_profile}', supported: {', '.join(MAPPING_PROFILES)}")
+        sources = self._concrete_indices()
+        if not sources:
+            logger.info(f"Index {self.index_name} does not exist, nothing to migrate")
+            return None
+        meta = self._get_index_meta()
+        if meta["mapping_profile"] == mapping_profile:
+            logger.info(f"Index {self.index_name} already has the {mapping_profile} mapping profile")
+            return None
+
+        response = self.client.indices.get_mapping(index=self.index_name)
+        mappings = next(iter(response.values()))["mappings"]
+        if "embedding" in (mappings.get("_source") or {}).get("excludes", []):
+            raise ValueError(
+                f"Embeddings of {self.index_name} aren't kept in _source, they can't be reindexed: clean the DB and ingest the documents again"
+            )
+
+        target = f"{self.index_name}_{mapping_profile}"
+        if self.client.indices.exists(index=target):
+            # Left over by an interrupted migration
+            self.client.indices.delete(index=target)
+        response = self.client.indices.get_settings(index=sources[0])
+        index_settings = next(iter(response.values()))["settings"]["index"]
+        self.client.indices.create(index=target, body={
+            "settings": {
+                "index": {
+                    "knn": True,
+                    "knn.algo_param.ef_search": 100,
+                    # Restored once the chunks are copied
+                    "refresh_interval": "-1",
+                    "number_of_replicas": 0
+                }
+            },
+            "mappings": index_mappings(mappings["properties"]["embedding"], meta, mapping_profile)
+        })
+
+        logger.info(f"Reindexing {self.index_name} into {target} with the {mapping_profile} mapping profile")
+        response = self.client.reindex(
+            body={"source": {"index": sources}, "dest": {"index": target}}, slices="auto", wait_for_completion=True,
+            request_timeout=REINDEX_TIMEOUT
+        )
+        if response.get("failures"):
+            self.client.indices.delete(index=target)
+            raise RuntimeError(f"Failed to reindex {self.index_name} into {target}: {response['failures'][0]}")
+        self.client.indices.put_settings(index=target, body={"index": {
+            "refresh_interval": index_settings.get("refresh_interval"),
+            "number_of_replicas": index_settings.get("number_of_replicas")
+        }})
+        self.client.indices.refresh(index=target)
+        if OPENSEARCH_FORCE_MERGE_SEGMENTS:
+            self.client.indices.forcemerge(
+                index=target, max_num_segments=OPENSEARCH_FORCE_MERGE_SEGMENTS, request_timeout=FORCE_MERGE_TIMEOUT
+            )
+
+        # The old indices are swapped for the new one atomically, searches never miss the index
+        actions = [{"add": {"index": target, "alias": self.index_name}}]
+        actions.extend({"remove_index": {"index": source}} for source in sources)
+        self.client.indices.update_aliases(body={"actions": actions})
+        self._invalidate_index_cache()
+        self._index_uuid = None
+        logger.info(f"Index {self.index_name} migrated to {target}, {response.get('total', 0)} chunks reindexed")
+        return target
+
+    def reset_index(self):
+        self._invalidate_index_cache()
+        self._index_uuid = None
+        if self.client.indices.exists(index=self._projection_index()):
+            self.client.indices.delete(index=self._projection_index())
+        indices = self._concrete_indices()
+        if indices:
+            # Deleting a migrated index removes its alias as well
+            for index in indices:
+                self.client.indices.delete(index=index)
             logger.info(f"Collection {self.index_name} deleted.")
         else:
             logger.info(f"Collection {self.index_name} does not exist!")
 
-        # Clear local cache
+        # Clear local cache, the embeddings are kept as they only depend on the chunk texts & the embedding model
         files_to_remove = glob(os.path.join(LOCAL_CACHE_DIR, self.index_name+"*"))
         if files_to_remove:
             for file_path in files_to_remove:
                 try:
                     if os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
+                        for entry in os.listdir(file_path):
+                            if entry == EMBEDDING_CACHE_DIR:
+                                continue
+                            entry_path = os.path.join(file_path, entry)
+                            if os.path.isdir(entry_path):
+                                shutil.rmtree(entry_path)
+                            else:
+                                os.remove(entry_path)
+                        if not os.listdir(file_path):
+                            os.rmdir(file_path)
                         continue
                     os.remove(file_path)
                 except OSError as e:
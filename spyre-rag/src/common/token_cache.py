@@ -0,0 +1,125 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+from common.misc_utils import get_logger
+
+logger = get_logger("token_cache")
+
+TOKEN_CACHE_DB = "token_counts.db"
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "500000"))
+
+# Max number of host parameters per sqlite statement is 999 in older sqlite versions
+_SQLITE_BATCH_SIZE = 500
+
+_token_cache_instance = None
+
+class TokenCountCache:
+    """
+    Persistent token count memo keyed by sha256 of (tokenizer id, text), evicts least recently used entries
+    once the cache grows beyond max_entries.
+    """
+    def __init__(self, db_path, max_entries=TOKEN_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_counts (key TEXT PRIMARY KEY, count INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS token_counts_last_used ON token_counts (last_used)")
+        self._conn.commit()
+        self._size, last_used = self._conn.execute("SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM token_counts").fetchone()
+        self._clock = last_used
+
+    @staticmethod
+    def _key(tokenizer_id, text):
+        return hashlib.sha256(f"{tokenizer_id}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, tokenizer_id, texts):
+        """
+        Returns {text: token_count} for the texts present in the cache.
+        """
+        keys = {self._key(tokenizer_id, text): text for text in dict.fromkeys(texts)}
+        counts = {}
+        with self._lock:
+            self._clock += 1
+            key_list = list(keys)
+            for i in range(0, len(key_list), _SQLITE_BATCH_SIZE):
+                batch = key_list[i:i + _SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, count FROM token_counts WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                if rows:
+                    found = [key for key, _ in rows]
+                    self._conn.execute(
+                        f"UPDATE token_counts SET last_used = ? WHERE key IN ({','.join('?' * len(found))})",
+                        [self._clock, *found]
+                    )
+                for key, count in rows:
+                    counts[keys[key]] = count
+            self._conn.commit()
+            self.lookups += len(keys)
+            self.hits += len(counts)
+        return counts
+
+    def put_many(self, tokenizer_id, counts):
+        """
+        Stores the {text: token_count} pairs and evicts the least recently used entries above max_entries.
+        """
+        if not counts:
+            return
+        with self._lock:
+            self._clock += 1
+            rows = [(self._key(tokenizer_id, text), count, self._clock) for text, count in counts.items()]
+            cursor = self._conn.executemany(
+                "INSERT OR REPLACE INTO token_counts (key, count, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._size += cursor.rowcount if cursor.rowcount > 0 else 0
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Evict down to 90% of the capacity so that eviction doesn't run on every insert
+        self._size = self._conn.execute("SELECT COUNT(*) FROM token_counts").fetchone()[0]
+        excess = self._size - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM token_counts WHERE key IN (SELECT key FROM token_counts ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._size -= excess
+        logger.debug(f"Evicted {excess} entries from token count cache '{self.db_path}'")
+
+    def hit_rate(self):
+        return (self.hits / self.lookups * 100) if self.lookups else 0.0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def get_token_cache(cache_dir=None):
+    """
+    Returns the token count cache of the given cache directory, or the current one if cache_dir is not passed.
+    """
+    global _token_cache_instance
+    if cache_dir is None:
+        return _token_cache_instance
+
+    db_path = os.path.join(cache_dir, TOKEN_CACHE_DB)
+    if _token_cache_instance is None or _token_cache_instance.db_path != db_path:
+        if _token_cache_instance is not None:
+            _token_cache_instance.close()
+        try:
+            _token_cache_instance = TokenCountCache(db_path)
+        except sqlite3.Error as e:
+            logger.warning(f"Token count cache disabled, failed to open '{db_path}': {e}")
+            _token_cache_instance = None
+    return _token_cache_instance
@@ -0,0 +1,117 @@
+import os
+from abc import ABC, abstractmethod
+
+import common.llm_utils as llm_utils
+from common.misc_utils import get_logger, get_model_endpoints
+
+logger = get_logger("tokenizer")
+
+_tokenizer_instances = {}
+
+class Tokenizer(ABC):
+    """
+    Counts, truncates and detokenizes text for a model.
+    """
+    is_remote = False
+    # Identifies the model whose vocabulary is used, token counts are cached against it
+    model_id = ""
+
+    @abstractmethod
+    def encode(self, text):
+        pass
+
+    def encode_batch(self, texts):
+        return [self.encode(text) for text in texts]
+
+    @abstractmethod
+    def decode(self, tokens):
+        pass
+
+    def count(self, text):
+        return len(self.encode(text))
+
+    def count_batch(self, texts):
+        return [len(tokens) for tokens in self.encode_batch(texts)]
+
+    def truncate(self, text, max_tokens):
+        tokens = self.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.decode(tokens[:max(max_tokens, 0)])
+
+class LocalTokenizer(Tokenizer):
+    """
+    In-process tokenizer loaded from a HuggingFace tokenizer.json file.
+    """
+    def __init__(self, tokenizer_path):
+        from tokenizers import Tokenizer as HFTokenizer
+
+        self.tokenizer_path = tokenizer_path
+        self._tokenizer = HFTokenizer.from_file(tokenizer_path)
+
+    def encode(self, text):
+        return self._tokenizer.encode(text).ids
+
+    def encode_batch(self, texts):
+        if not texts:
+            return []
+        return [encoding.ids for encoding in self._tokenizer.encode_batch(list(texts))]
+
+    def decode(self, tokens):
+        return self._tokenizer.decode(tokens)
+
+class RemoteTokenizer(Tokenizer):
+    """
+    Tokenizer backed by the tokenize/detokenize endpoints of a vLLM server.
+    """
+    is_remote = True
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def encode(self, text):
+        return llm_utils.tokenize_with_llm(text, self.endpoint)
+
+    def encode_batch(self, texts):
+        return llm_utils.tokenize_batch_with_llm(texts, self.endpoint)
+
+    def decode(self, tokens):
+        return llm_utils.detokenize_with_llm(tokens, self.endpoint)
+
+def _resolve_tokenizer_file(tokenizer_path):
+    if not tokenizer_path:
+        return None
+    if os.path.isdir(tokenizer_path):
+        tokenizer_path = os.path.join(tokenizer_path, "tokenizer.json")
+    if not os.path.isfile(tokenizer_path):
+        logger.warning(f"Tokenizer file '{tokenizer_path}' not found, falling back to the remote tokenizer")
+        return None
+    return tokenizer_path
+
+def get_tokenizer(endpoint, tokenizer_path=None, model_id=None) -> Tokenizer:
+    """
+    Returns the local tokenizer if tokenizer_path points to a tokenizer.json (or a directory holding it),
+    otherwise the remote tokenizer of the given endpoint.
+    """
+    key = (endpoint, tokenizer_path, model_id)
+    if key not in _tokenizer_instances:
+        tokenizer_file = _resolve_tokenizer_file(tokenizer_path)
+        tokenizer = None
+        if tokenizer_file:
+            try:
+                tokenizer = LocalTokenizer(tokenizer_file)
+                logger.debug(f"Loaded local tokenizer from '{tokenizer_file}'")
+            except Exception as e:
+                logger.warning(f"Failed to load tokenizer from '{tokenizer_file}', falling back to the remote tokenizer: {e}")
+        tokenizer = tokenizer or RemoteTokenizer(endpoint)
+        tokenizer.model_id = model_id or tokenizer_file or endpoint
+        _tokenizer_instances[key] = tokenizer
+    return _tokenizer_instances[key]
+
+def get_emb_tokenizer(emb_endpoint) -> Tokenizer:
+    emb_model_dict, _, _ = get_model_endpoints()
+    return get_tokenizer(emb_endpoint, emb_model_dict["tokenizer_path"], emb_model_dict["emb_model"])
+
+def get_llm_tokenizer(llm_endpoint) -> Tokenizer:
+    _, llm_model_dict, _ = get_model_endpoints()
+    return get_tokenizer(llm_endpoint, llm_model_dict["tokenizer_path"], llm_model_dict["llm_model"])
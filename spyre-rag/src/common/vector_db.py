@@ -1,14 +1,19 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import Callable, Iterable, List, Dict, Any, Optional
 
 class VectorStore(ABC):
     @abstractmethod
     def insert_chunks(
         self,
-        chunks: List[Dict],
-        vectors: Optional[List[List[float]]] = None,
+        chunks: Iterable[Dict],
+        vectors: Optional[Iterable[List[float]]] = None,
         embedding: Optional[Any] = None,
-        batch_size: int = 10
+        batch_size: int = 256,
+        embedding_cache: Optional[Any] = None,
+        token_budget: int = 16384,
+        concurrency: int = 4,
+        checkpoint: Optional[Any] = None,
+        on_failed_chunks: Optional[Callable[[List[Dict]], None]] = None
     ):
         """
         Inserts document chunks and their corresponding embeddings into the vector database.
@@ -18,11 +23,21 @@ class VectorStore(ABC):
         2. If 'vectors' is None but an 'embedding' instance is provided, it uses that
            instance to generate embeddings from the 'page_content' within the chunks.
 
+        Chunks are consumed batch by batch, so they can be streamed from a generator or a queue.
+
         Args:
-            chunks: A list of dictionaries containing text content and metadata.
-            vectors: A list of pre-computed vector arrays.
+            chunks: An iterable of dictionaries containing text content and metadata.
+            vectors: An iterable of pre-computed vector arrays, in the order of the chunks.
             embedding: An instance of the Embedding class to generate vectors.
-            batch_size: Number of documents to process in a single bulk operation.
+            batch_size: Max number of documents to embed and process in a single bulk operation.
+            embedding_cache: An EmbeddingCache instance, cached vectors are used instead of re-embedding the chunks.
+            token_budget: Max number of tokens of the documents embedded in a single request.
+            concurrency: Number of embedding requests in flight at once, overlapping with the bulk operations.
+            checkpoint: An IndexCheckpoint instance, the chunks are committed to it as soon as they're indexed.
+            on_failed_chunks: Called with the chunks that failed to be indexed, once their retries are exhausted.
+
+        Returns:
+            The number of chunks inserted.
         """
         pass
 
@@ -55,6 +70,41 @@ class VectorStore(ABC):
         """
         pass
 
+    @abstractmethod
+    def get_indexed_documents(self) -> Dict[str, Dict]:
+        """
+        Lists the documents present in the vector database.
+
+        Returns:
+            Dict[str, Dict]: {doc_id: {"filename": str, "hashes": {content_hash: chunk_count}}}, a document
+            with more than one content hash or an unexpected chunk count is stale or partially indexed.
+        """
+        pass
+
+    @abstractmethod
+    def delete_documents(self, documents: Dict[str, str], keep_content_hashes: Optional[Dict[str, str]] = None) -> int:
+        """
+        Deletes all the chunks of the given documents from the vector database.
+
+        Args:
+            documents: {doc_id: filename} of the documents to delete.
+            keep_content_hashes: {doc_id: content_hash} of the document versions whose chunks are kept.
+
+        Returns:
+            int: Number of chunks deleted.
+        """
+        pass
+
+    @abstractmethod
+    def bulk_ingest(self):
+        """
+        Context manager wrapping a large load of chunks into the vector database.
+
+        Implementations may relax the durability & visibility settings of the index for the
+        duration of the load (e.g. refreshes, replicas) and must restore them on exit.
+        """
+        pass
+
     @abstractmethod
     def reset_index(self):
         """
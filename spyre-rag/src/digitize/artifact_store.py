@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from common.misc_utils import (
+    get_logger, generate_file_checksum, converted_suffix, text_suffix, table_suffix, chunk_suffix, probe_suffix
+)
+
+logger = get_logger("artifact_store")
+
+MANIFEST_DB = "manifest.db"
+ARTIFACTS_DIR = "artifacts"
+# Artifacts of a document are named after this stem inside the document's directory
+ARTIFACT_NAME = "document"
+
+# Stages of the ingestion recorded in the manifest once their artifact is persisted
+STAGE_PROBE = "probe"
+STAGE_CONVERT = "convert"
+STAGE_TEXT = "text"
+STAGE_TABLES = "tables"
+STAGE_CHUNK = "chunk"
+
+# Suffix of the artifact written by every stage, it depends on ARTIFACT_FORMAT. The manifest records the suffix a stage
+# was completed with, a stage completed in another format is redone
+STAGE_SUFFIXES = {
+    STAGE_PROBE: probe_suffix,
+    STAGE_CONVERT: converted_suffix,
+    STAGE_TEXT: text_suffix,
+    STAGE_TABLES: table_suffix,
+    STAGE_CHUNK: chunk_suffix,
+}
+
+# Number of files hashed concurrently, hashlib releases the GIL while hashing
+HASH_WORKER_SIZE = 8
+
+# Max number of host parameters per sqlite statement is 999 in older sqlite versions
+_SQLITE_BATCH_SIZE = 500
+
+_artifact_store_instance = None
+
+def artifact_path(artifact_dir, suffix):
+    return Path(artifact_dir) / f"{ARTIFACT_NAME}{suffix}"
+
+class ArtifactStore:
+    """
+    Ingestion artifacts keyed by the content hash of the source file, with a manifest of the completed stages of
+    every document. Identical files share their artifacts regardless of their names or locations.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.db_path = os.path.join(cache_dir, MANIFEST_DB)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stages (content_hash TEXT NOT NULL, stage TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (content_hash, stage))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(stages)")}
+        if "suffix" not in columns:
+            # Stages recorded before the suffix was tracked have a null suffix
+            self._conn.execute("ALTER TABLE stages ADD COLUMN suffix TEXT")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, content_hash TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _artifact_dir(self, content_hash):
+        return os.path.join(self.cache_dir, ARTIFACTS_DIR, content_hash[:2], content_hash)
+
+    def artifact_dir(self, content_hash):
+        """
+        Returns the directory holding the artifacts of the document, sharded by the hash prefix.
+        """
+        artifact_dir = self._artifact_dir(content_hash)
+        os.makedirs(artifact_dir, exist_ok=True)
+        return artifact_dir
+
+    def _stage_current(self, content_hash, stage, suffix):
+        expected = STAGE_SUFFIXES.get(stage)
+        if suffix is None:
+            # Stage recorded before the suffix was tracked, valid if its artifact exists in the current format
+            return expected is None or artifact_path(self._artifact_dir(content_hash), expected).exists()
+        return suffix == expected
+
+    def get_stages(self, content_hashes):
+        """
+        Returns {content_hash: set of completed stages} for the given documents, stages whose artifact was written in
+        another ARTIFACT_FORMAT aren't complete.
+        """
+        stages = {content_hash: set() for content_hash in content_hashes}
+        hash_list = list(stages)
+        with self._lock:
+            for i in range(0, len(hash_list), _SQLITE_BATCH_SIZE):
+                batch = hash_list[i:i + _SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, stage, suffix FROM stages WHERE content_hash IN ({placeholders})", batch
+                ).fetchall()
+                for content_hash, stage, suffix in rows:
+                    if self._stage_current(content_hash, stage, suffix):
+                        stages[content_hash].add(stage)
+        return stages
+
+    def content_hashes(self, paths):
+        """
+        Returns {path: content hash} of the files. Files whose size, mtime & inode are unchanged since they were last
+        hashed reuse the recorded hash, the rest are hashed concurrently, once each.
+        """
+        file_stats = {}
+        for path in dict.fromkeys(paths):
+            stat = os.stat(path)
+            file_stats[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+        known = {}
+        path_list = [os.path.abspath(path) for path in file_stats]
+        with self._lock:
+            for i in range(0, len(path_list), _SQLITE_BATCH_SIZE):
+                batch = path_list[i:i + _SQLITE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT path, size, mtime_ns, inode, content_hash FROM files WHERE path IN ({placeholders})", batch
+                ).fetchall()
+                for abs_path, size, mtime_ns, inode, content_hash in rows:
+                    known[abs_path] = ((size, mtime_ns, inode), content_hash)
+
+        hashes = {}
+        changed = []
+        for path, file_stat in file_stats.items():
+            record = known.get(os.path.abspath(path))
+            if record and record[0] == file_stat:
+                hashes[path] = record[1]
+            else:
+                changed.append(path)
+
+        if changed:
+            logger.debug(f"Hashing {len(changed)} new or changed file(s), {len(hashes)} unchanged")
+            with ThreadPoolExecutor(max_workers=HASH_WORKER_SIZE) as executor:
+                hashes.update(zip(changed, executor.map(generate_file_checksum, changed)))
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, content_hash) VALUES (?, ?, ?, ?, ?)",
+                    [(os.path.abspath(path), *file_stats[path], hashes[path]) for path in changed]
+                )
+                self._conn.commit()
+        return hashes
+
+    def mark_done(self, content_hash, *stages):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO stages (content_hash, stage, updated_at, suffix) VALUES (?, ?, ?, ?)",
+                [(content_hash, stage, now, STAGE_SUFFIXES.get(stage)) for stage in stages]
+            )
+            self._conn.commit()
+
+    def invalidate(self, content_hash, *stages):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM stages WHERE content_hash = ? AND stage = ?", [(content_hash, stage) for stage in stages]
+            )
+            self._conn.commit()
+        logger.debug(f"Invalidated stages {', '.join(stages)} of '{content_hash}'")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def get_artifact_store(cache_dir=None):
+    """
+    Returns the artifact store of the given cache directory, or the current one if cache_dir is not passed.
+    """
+    global _artifact_store_instance
+    if cache_dir is None:
+        return _artifact_store_instance
+
+    if _artifact_store_instance is None or _artifact_store_instance.cache_dir != cache_dir:
+        if _artifact_store_instance is not None:
+            _artifact_store_instance.close()
+        _artifact_store_instance = ArtifactStore(cache_dir)
+    return _artifact_store_instance
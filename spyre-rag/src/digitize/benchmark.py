@@ -0,0 +1,147 @@
+import csv
+import time
+
+import numpy as np
+
+from common.emb_utils import EMB_PCA_SAMPLE_SIZE, PcaProjection, TruncateProjection, get_embedder, iter_token_batches, estimate_tokens
+from common.embedding_cache import get_embedding_cache, embed_with_cache
+from common.misc_utils import get_logger, get_model_endpoints, setup_cache_dir
+from common.opensearch import OpensearchVectorStore, VECTOR_ENCODINGS, FORCE_MERGE_TIMEOUT
+
+logger = get_logger("benchmark")
+
+# Column holding the questions in the golden datasets, golden1.csv & golden2.csv differ
+QUESTION_COLUMNS = ("Question", "golden_question")
+
+# Benchmark indices are named after the index being benchmarked with this suffix and the variant
+BENCHMARK_INDEX_SUFFIX = "_bench"
+
+# float32 vectors are the reference for the recall of the other encodings
+BASELINE_ENCODING = "float32"
+
+# Reductions of the embeddings benchmarked at each of the requested dimensions, with float32 vectors
+REDUCTIONS = ("truncate", "pca")
+
+def load_golden_questions(paths):
+    questions = []
+    for path in paths:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            column = next((c for c in QUESTION_COLUMNS if c in (reader.fieldnames or [])), None)
+            if column is None:
+                raise ValueError(f"No question column in '{path}', expected one of {', '.join(QUESTION_COLUMNS)}")
+            questions.extend(row[column].strip() for row in reader if row[column].strip())
+    return questions
+
+def embed_texts(embedder, texts, embedding_cache=None):
+    vectors = []
+    for batch in iter_token_batches(texts, estimate_tokens):
+        vectors.extend(embed_with_cache(embedder, batch, embedding_cache))
+    return np.asarray(vectors, dtype=np.float32)
+
+def search_latencies(store, questions, query_vectors, top_k):
+    """
+    Runs a dense search per question, returns the latencies in seconds and the chunk ids of the top_k hits.
+    """
+    # First query pays for loading the graph in memory
+    store.search(questions[0], vector=query_vectors[0], top_k=top_k, mode="dense")
+    latencies, results = [], []
+    for question, vector in zip(questions, query_vectors):
+        t0 = time.perf_counter()
+        hits = store.search(question, vector=vector, top_k=top_k, mode="dense")
+        latencies.append(time.perf_counter() - t0)
+        results.append([hit["chunk_id"] for hit in hits[:top_k]])
+    return latencies, results
+
+def recall_at_k(results, baseline):
+    recalls = [len(set(result) & set(expected)) / len(expected) for result, expected in zip(results, baseline) if expected]
+    return float(np.mean(recalls)) if recalls else 0.0
+
+def reduce_vectors(reduction, dimension, vectors, query_vectors):
+    """
+    Reduces the chunk & query vectors to the dimension, the PCA projection is fitted on the chunks like on ingestion.
+    """
+    if reduction == "pca":
+        projection = PcaProjection.fit(vectors[:EMB_PCA_SAMPLE_SIZE], dimension)
+    else:
+        projection = TruncateProjection(dimension)
+    return np.asarray(projection.apply(vectors)), np.asarray(projection.apply(query_vectors))
+
+def benchmark_variant(store, chunks, vectors, questions, query_vectors, top_k):
+    """
+    Loads the chunks into a fresh index of the store, returns its size in bytes, the search latencies & results.
+    The index is deleted afterwards.
+    """
+    store.reset_index()
+    try:
+        with store.bulk_ingest():
+            store.insert_chunks(chunks, vectors=vectors)
+        # Sizes are compared once merged, they'd otherwise depend on the segments left by the bulk load
+        store.client.indices.forcemerge(index=store.index_name, max_num_segments=1, request_timeout=FORCE_MERGE_TIMEOUT)
+        index_size = store.index_size()
+        latencies, results = search_latencies(store, questions, query_vectors, top_k)
+    finally:
+        store.reset_index()
+    return index_size, latencies, results
+
+def run_benchmark(golden_paths, top_k=5, encodings=VECTOR_ENCODINGS, dimensions=(), reductions=REDUCTIONS):
+    """
+    Copies the chunks of the index into a temporary index per vector encoding, and per reduction & dimension of the
+    embeddings, and reports the index size, the dense search latency and the recall@k against full dimension float32
+    vectors for the questions of the golden datasets.
+    """
+    source = OpensearchVectorStore()
+    emb_model_dict, _, _ = get_model_endpoints()
+    embedder = get_embedder(emb_model_dict['emb_model'], emb_model_dict['emb_endpoint'], emb_model_dict['max_tokens'])
+
+    chunks = list(source.iter_chunks())
+    if not chunks:
+        logger.info(f"Index {source.index_name} is empty, ingest documents before running the benchmark")
+        return []
+    questions = load_golden_questions(golden_paths)
+    if not questions:
+        logger.info("No questions found in the golden datasets")
+        return []
+
+    encodings = [BASELINE_ENCODING] + [encoding for encoding in encodings if encoding != BASELINE_ENCODING]
+    logger.info(f"Benchmarking {', '.join(encodings)} vectors on {len(chunks)} chunks and {len(questions)} questions")
+
+    # Chunks are embedded again rather than read back, the index might hold reduced or quantized vectors
+    vectors = embed_texts(embedder, [chunk["page_content"] for chunk in chunks], get_embedding_cache(setup_cache_dir(source.index_name)))
+    query_vectors = embed_texts(embedder, questions)
+
+    full_dimension = vectors.shape[1]
+    variants = [(encoding, "none", full_dimension) for encoding in encodings]
+    for dimension in sorted(set(dimensions), reverse=True):
+        if not 0 < dimension < full_dimension:
+            logger.warning(f"Skipping dimension {dimension}, the embeddings have {full_dimension} dimensions")
+            continue
+        variants.extend((BASELINE_ENCODING, reduction, dimension) for reduction in reductions)
+
+    rows = []
+    baseline = None
+    for encoding, reduction, dimension in variants:
+        if reduction == "none":
+            variant_name, variant_vectors, variant_query_vectors = encoding, vectors, query_vectors
+        else:
+            variant_name = f"{reduction}{dimension}"
+            try:
+                variant_vectors, variant_query_vectors = reduce_vectors(reduction, dimension, vectors, query_vectors)
+            except ValueError as e:
+                logger.warning(f"Skipping {reduction} reduction to {dimension} dimensions: {e}")
+                continue
+        store = OpensearchVectorStore(index_name=f"{source.index_name}{BENCHMARK_INDEX_SUFFIX}_{variant_name}", vector_encoding=encoding)
+        index_size, latencies, results = benchmark_variant(store, chunks, variant_vectors, questions, variant_query_vectors, top_k)
+        if baseline is None:
+            baseline = results
+        rows.append({
+            "encoding": encoding,
+            "reduction": reduction,
+            "dimension": dimension,
+            "index_size": index_size,
+            "p50_latency": float(np.percentile(latencies, 50)),
+            "p95_latency": float(np.percentile(latencies, 95)),
+            "recall": recall_at_k(results, baseline),
+        })
+        logger.info(f"Benchmarked {encoding} vectors of dimension {dimension}, {reduction} reduction")
+    return rows
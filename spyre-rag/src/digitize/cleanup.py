@@ -6,4 +6,9 @@ logger = get_logger("cleanup")
 def reset_db():
     vector_store = db.get_vector_store()
     vector_store.reset_index()
-    logger.info(f"✅ DB Cleaned successfully!")
+    logger.info("✅ DB Cleaned successfully!")
+
+def migrate_db(mapping_profile=None):
+    vector_store = db.get_vector_store()
+    if vector_store.migrate_index(mapping_profile):
+        logger.info("✅ DB migrated successfully!")
@@ -15,6 +15,16 @@ ingest_parser.add_argument("--path", type=str, default="/var/docs", help="Path t
 
 command_parser.add_parser("clean-db", help="Clean the DB", description="Clean the Milvus DB\n", formatter_class=argparse.RawTextHelpFormatter, parents=[common_parser])
 
+migrate_parser = command_parser.add_parser("migrate-db", help="Migrate the DB to another mapping profile", description="Reindex the ingested chunks into an index with the given mapping profile, which replaces the current index behind an alias\n", formatter_class=argparse.RawTextHelpFormatter, parents=[common_parser])
+migrate_parser.add_argument("--profile", type=str, default=None, choices=["default", "lean"], help="Mapping profile of the new index, OPENSEARCH_MAPPING_PROFILE by default")
+
+benchmark_parser = command_parser.add_parser("benchmark", help="Benchmark the vector encodings", description="Copy the ingested chunks into an index per vector encoding and embedding dimension and report the index size, search latency and recall@k against float32 vectors\n", formatter_class=argparse.RawTextHelpFormatter, parents=[common_parser])
+benchmark_parser.add_argument("--golden", type=str, nargs="+", required=True, help="Golden dataset CSVs whose questions are searched, e.g. test/golden/golden1.csv")
+benchmark_parser.add_argument("--top-k", type=int, default=5, help="Number of chunks retrieved per question")
+benchmark_parser.add_argument("--encodings", type=str, nargs="+", default=["float32", "fp16", "byte"], choices=["float32", "fp16", "byte"], help="Vector encodings to benchmark, float32 is always included as the reference")
+benchmark_parser.add_argument("--dimensions", type=int, nargs="+", default=[], help="Reduced embedding dimensions to benchmark with float32 vectors, e.g. 512 256 128")
+benchmark_parser.add_argument("--reductions", type=str, nargs="+", default=["truncate", "pca"], choices=["truncate", "pca"], help="Reductions of the embeddings benchmarked at each of the --dimensions")
+
 # Setting log level, 1st priority is to the flag received via cli, 2nd priority to the LOG_LEVEL env var.
 log_level = logging.INFO
 
@@ -29,10 +39,23 @@ if command_args.debug:
 set_log_level(log_level)
 
 from digitize.ingest import ingest
-from digitize.cleanup import reset_db
+from digitize.cleanup import reset_db, migrate_db
 
 logger = get_logger("Ingest")
 
+def deduplicated_tokenizations(pdf_stats):
+    tokenize_stats = pdf_stats.get("tokenize_stats") or {}
+    return tokenize_stats.get("sentences", 0) - tokenize_stats.get("tokenized", 0)
+
+def print_benchmark(rows, top_k):
+    header_format = f"| {"Encoding":<{10}} | {"Reduction":<{10}} | {"Dimension":^{10}} | {"Index Size (MB)":^{15}} | {"p50 Latency (ms)":^{16}} | {"p95 Latency (ms)":^{16}} | {f"Recall@{top_k}":^{10}} |"
+    print("-" * len(header_format))
+    print(header_format)
+    print("-" * len(header_format))
+    for row in rows:
+        print(f"| {row["encoding"]:<{10}} | {row["reduction"]:<{10}} | {row["dimension"]:^{10}} | {row["index_size"] / 1024 ** 2:^{15}.2f} | {row["p50_latency"] * 1000:^{16}.2f} | {row["p95_latency"] * 1000:^{16}.2f} | {row["recall"]:^{10}.3f} |")
+    print("-" * len(header_format))
+
 def main():
     if command_args.command == "ingest":
         converted_pdf_stats = ingest(command_args.path)
@@ -49,7 +72,7 @@ def main():
         total_time = 0
         header_format = f"| {"PDF":<{max_file_len}} | {"Total Pages":^{15}} | {"Total Tables":^{15}} |"
         if logger.isEnabledFor(logging.DEBUG):
-            header_format += f" {"Conversion":^{15}} | {"Processing Text":^{15}} | {"Processing Tables":^{17}} | {"Chunking":^{15}} |"
+            header_format += f" {"Conversion":^{15}} | {"Processing Text":^{15}} | {"Processing Tables":^{17}} | {"Chunking":^{15}} | {"Tokenizations Deduped":^{22}} |"
         header_format += f" {"Total Time (s)":>{15}} |"
 
         print("-" * len(header_format))
@@ -62,16 +85,31 @@ def main():
             if converted_pdf_stats[file]["page_count"] > 0:
                 stats_to_print = f"| {file:<{max_file_len}} | {converted_pdf_stats[file].get("page_count", 0):^{15}} | {converted_pdf_stats[file].get("table_count", 0):^{15}} |"
                 if logger.isEnabledFor(logging.DEBUG):
-                    stats_to_print += f" {timings.get("conversion", 0.0):^{15}.2f} | {timings.get("process_text", 0.0):^{15}.2f} | {timings.get("process_tables", 0.0):^{17}.2f} | {timings.get("chunking", 0.0):^{15}.2f} |"
+                    stats_to_print += f" {timings.get("conversion", 0.0):^{15}.2f} | {timings.get("process_text", 0.0):^{15}.2f} | {timings.get("process_tables", 0.0):^{17}.2f} | {timings.get("chunking", 0.0):^{15}.2f} | {deduplicated_tokenizations(converted_pdf_stats[file]):^{22}} |"
                 stats_to_print += f" {pdf_total_time:>{15}.2f} |"
                 print(stats_to_print)
         print("-" * len(header_format))
         footer = f"| {"Total":<{max_file_len}} | {total_pages:^{15}} | {total_tables:^{15}} |"
         print(footer)
         print("-" * len(footer))
+        model_load_time = sum(converted_pdf_stats[file].get("model_load_time", 0.0) for file in converted_pdf_stats)
+        if model_load_time:
+            print(f"Model load time (s): {model_load_time:.2f}")
 
     elif command_args.command == "clean-db":
         reset_db()
 
+    elif command_args.command == "migrate-db":
+        migrate_db(command_args.profile)
+
+    elif command_args.command == "benchmark":
+        from digitize.benchmark import run_benchmark
+        rows = run_benchmark(
+            command_args.golden, top_k=command_args.top_k, encodings=command_args.encodings,
+            dimensions=command_args.dimensions, reductions=command_args.reductions
+        )
+        if rows:
+            print_benchmark(rows, command_args.top_k)
+
 if __name__ == "__main__":
     main()
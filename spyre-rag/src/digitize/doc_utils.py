@@ -1,3 +1,4 @@
+import gzip
 import json
 import time
 import logging
@@ -7,25 +8,40 @@ from tqdm import tqdm
 os.environ['GRPC_VERBOSITY'] = 'ERROR' 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
+from collections import defaultdict, deque
+from itertools import islice
 from pathlib import Path
-from docling.datamodel.document import DoclingDocument, TextItem
-from concurrent.futures import as_completed, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from sentence_splitter import SentenceSplitter
 
-from common.llm_utils import create_llm_session, summarize_and_classify_tables, tokenize_with_llm
-from common.misc_utils import get_logger, generate_file_checksum, text_suffix, table_suffix
-from common.misc_utils import get_logger, generate_file_checksum, text_suffix, table_suffix, chunk_suffix
-from digitize.pdf_utils import get_toc, get_matching_header_lvl, load_pdf_pages, find_text_font_size, get_pdf_page_count, convert_doc
+from common.llm_utils import create_llm_session, summarize_and_classify_tables
+from common.token_cache import get_token_cache
+from common.tokenizer_utils import get_emb_tokenizer, get_llm_tokenizer
+from common.misc_utils import (
+    get_logger, generate_doc_id, iter_artifact, write_artifact, count_artifact_items,
+    ARTIFACT_FORMAT, ARTIFACT_COMPRESS_LEVEL, converted_suffix, text_suffix, table_suffix, chunk_suffix, probe_suffix
+)
+from digitize.scheduler import get_scheduler, estimate_cost, estimate_conversion_memory
+from digitize.artifact_store import (
+    get_artifact_store, artifact_path, STAGE_PROBE, STAGE_CONVERT, STAGE_TEXT, STAGE_TABLES, STAGE_CHUNK, STAGE_SUFFIXES
+)
+from digitize.pdf_utils import probe_pdf, TocIndex, load_pdf_pages, find_text_font_sizes, convert_doc, get_page_ranges, pop_model_load_time
 
 logging.getLogger('docling').setLevel(logging.CRITICAL)
 
 logger = get_logger("doc_utils")
 
-WORKER_SIZE = 4
-HEAVY_PDF_CONVERT_WORKER_SIZE = 2
-
 HEAVY_PDF_PAGE_THRESHOLD = 500
 
+# Heavy PDFs are converted in shards of these many pages across the converter pool
+PDF_SHARD_PAGE_SIZE = 250
+
+# Number of chapters of a heavy PDF chunked concurrently
+CHUNK_PARTITION_WORKER_SIZE = 4
+
+# Number of chunks whose LLM token counts are requested at once while streaming the chunks of a document
+TOKEN_COUNT_BATCH_SIZE = 64
+
 is_debug = logger.isEnabledFor(logging.DEBUG) 
 tqdm_wrapper = None
 if is_debug:
@@ -41,29 +57,40 @@ POOL_SIZE = 32
 
 create_llm_session(pool_maxsize=POOL_SIZE)
 
-def process_text(converted_doc, pdf_path, out_path):
-    page_count = 0
+def process_text(converted_doc, pdf_path, out_path, probe):
     process_time = 0.0
 
-    # Initialize TocHeaders to get the Table of Contents (TOC)
+    # Table of Contents (TOC) & page count come from the probe of the pdf
     t0 = time.time()
-    toc_headers = None
-    try:
-        toc_headers, page_count = get_toc(pdf_path)
-    except Exception as e:
-        logger.debug(f"No TOC found or failed to load TOC: {e}")
-
-    # Load pdf pages one time when TOC headers not found for retrieving the font size of header texts
-    pdf_pages = None
-    if not toc_headers:
-        pdf_pages = load_pdf_pages(pdf_path)
-        page_count = len(pdf_pages)
+    toc_headers = probe["toc"]
+    page_count = probe["page_count"]
 
     # --- Text Extraction ---
     if not converted_doc.texts:
         logger.debug(f"No text content found in '{pdf_path}'")
-        out_path.write_text(json.dumps([], indent=2), encoding="utf-8")
-        return page_count, process_time
+        write_artifact(out_path, [])
+        return page_count, process_time, []
+
+    # TOC level of the section headers is matched once for all the distinct header texts of the document
+    toc_header_levels = {}
+    if toc_headers:
+        header_texts = list(dict.fromkeys(text_obj.text for text_obj in converted_doc.texts if text_obj.label == "section_header"))
+        toc_header_levels = dict(zip(header_texts, TocIndex(toc_headers).match_levels(header_texts)))
+
+    # Font size of the header texts is retrieved from the pdf pages when TOC headers not found,
+    # only the pages holding section headers are parsed, matching all the headers of a page in one batch
+    header_font_matches = {}
+    if not toc_headers:
+        headers_by_page = defaultdict(dict)
+        for text_obj in converted_doc.texts:
+            if text_obj.label == "section_header":
+                for prov in text_obj.prov:
+                    headers_by_page[prov.page_no][text_obj.text] = None
+        with load_pdf_pages(pdf_path, probe["text_pages"]) as pdf_pages:
+            for page_no, headers in sorted(headers_by_page.items()):
+                headers = list(headers)
+                for header, matches in zip(headers, find_text_font_sizes(pdf_pages, headers, page_no - 1)):
+                    header_font_matches[(page_no, header)] = matches
 
     structured_output = []
     last_header_level = 0
@@ -80,7 +107,7 @@ def process_text(converted_doc, pdf_path, out_path):
                 page_no = prov.page_no
 
                 if toc_headers:
-                    header_prefix = get_matching_header_lvl(toc_headers, text_obj.text)
+                    header_prefix = "#" * toc_header_levels.get(text_obj.text, 0)
                     if header_prefix:
                         # If TOC matches, use the level from TOC
                         structured_output.append({
@@ -100,7 +127,7 @@ def process_text(converted_doc, pdf_path, out_path):
                             "font_size": None,  # Font size isn't necessary if TOC matches
                         })
                 else:
-                    matches = find_text_font_size(pdf_pages, text_obj.text, page_no - 1)
+                    matches = header_font_matches.get((page_no, text_obj.text), [])
                     if len(matches):
                         font_size = 0
                         count = 0
@@ -124,19 +151,18 @@ def process_text(converted_doc, pdf_path, out_path):
             })
 
     process_time = time.time() - t0
-    out_path.write_text(json.dumps(structured_output, indent=2), encoding="utf-8")
-        
-    return page_count, process_time
+    write_artifact(out_path, structured_output)
+
+    return page_count, process_time, structured_output
 
 def process_table(converted_doc, pdf_path, out_path, gen_model, gen_endpoint):
     table_count = 0
     process_time = 0.0
-    filtered_table_dicts = {}
     t0 = time.time()
     # --- Table Extraction ---
     if not converted_doc.tables:
         logger.debug(f"No tables found in '{pdf_path}'")
-        out_path.write_text(json.dumps({}, indent=2), encoding="utf-8")
+        write_artifact(out_path, [])
         return table_count, process_time
     
     table_dict = {}
@@ -149,241 +175,391 @@ def process_table(converted_doc, pdf_path, out_path, gen_model, gen_endpoint):
     table_captions_list = [table_dict[key]["caption"] for key in sorted(table_dict)]
 
     table_summaries, decisions = summarize_and_classify_tables(table_htmls, gen_model, gen_endpoint, pdf_path)
-    filtered_table_dicts = {
-        idx: {
+    filtered_table_dicts = [
+        {
             'html': html,
             'caption': caption,
             'summary': summary
         }
-        for idx, (keep, html, caption, summary) in enumerate(zip(decisions, table_htmls, table_captions_list, table_summaries)) if keep
-    }
-    table_count = len(filtered_table_dicts)
-    out_path.write_text(json.dumps(filtered_table_dicts, indent=2), encoding="utf-8")
+        for keep, html, caption, summary in zip(decisions, table_htmls, table_captions_list, table_summaries) if keep
+    ]
+    table_count = write_artifact(out_path, filtered_table_dicts)
     process_time = time.time() - t0
 
     return table_count, process_time
 
-def process_converted_document(converted_json_path, pdf_path, out_path, conversion_stats, gen_model, gen_endpoint, emb_endpoint, max_tokens):    
-    stem = Path(pdf_path).stem
-    processed_text_json_path = (Path(out_path) / f"{stem}{text_suffix}")
-    processed_table_json_path = (Path(out_path) / f"{stem}{table_suffix}")
-
-    if conversion_stats["text_processed"] and conversion_stats["table_processed"]:
-        logger.debug(f"Text & Table of {pdf_path} is processed already!")
-        page_count = get_pdf_page_count(pdf_path)
-        table_count = processed_table_json_path.exists() and len(json.load(processed_table_json_path.open())) or 0
-        return pdf_path, processed_text_json_path, processed_table_json_path, page_count, table_count, {}
+def save_converted_doc(converted_doc, path):
+    """
+    Persists the converted document in ARTIFACT_FORMAT, the file is moved in place once complete.
+    """
+    tmp_path = f"{path}.tmp"
+    if ARTIFACT_FORMAT == "json":
+        converted_doc.save_as_json(Path(tmp_path))
+    else:
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=ARTIFACT_COMPRESS_LEVEL) as f:
+            json.dump(converted_doc.export_to_dict(), f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def load_converted_doc(path):
+    from docling_core.types.doc import DoclingDocument
+
+    if str(path).endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return DoclingDocument.model_validate(json.load(f))
+    return DoclingDocument.load_from_json(Path(path))
+
+def process_converted_document(converted_json_path, pdf_path, artifact_dir, conversion_stats, gen_model, gen_endpoint, emb_endpoint, max_tokens, converted_doc=None):
+    """
+    Processes the text & tables of the converted document, converted_doc is passed when it was just converted,
+    otherwise it's loaded from converted_json_path. Text blocks are returned to be chunked without reading them back.
+    """
+    processed_text_json_path = artifact_path(artifact_dir, text_suffix)
+    processed_table_json_path = artifact_path(artifact_dir, table_suffix)
 
     try:
-        timings = {}
-        converted_doc = None
-        page_count = 0
+        page_count = conversion_stats["probe"]["page_count"]
         table_count = 0
+        if conversion_stats["table_processed"]:
+            # Cached tables still count in the chunks of the document, even when only the text is processed again
+            table_count = conversion_stats.get("table_count")
+            if table_count is None:
+                table_count = count_artifact_items(processed_table_json_path)
 
-        logger.debug("Loading from converted json")
+        if conversion_stats["text_processed"] and conversion_stats["table_processed"]:
+            logger.debug(f"Text & Table of {pdf_path} is processed already!")
+            return pdf_path, processed_text_json_path, processed_table_json_path, page_count, table_count, {}, None
 
-        converted_doc = DoclingDocument.load_from_json(Path(converted_json_path))
+        timings = {}
+        text_blocks = None
+
+        if converted_doc is None:
+            logger.debug("Loading from converted json")
+            converted_doc = load_converted_doc(converted_json_path)
         if not converted_doc:
             raise Exception(f"failed to load converted json into Docling Document")
 
         if not conversion_stats["text_processed"]:
-            page_count, process_time = process_text(converted_doc, pdf_path, processed_text_json_path)
+            page_count, process_time, text_blocks = process_text(converted_doc, pdf_path, processed_text_json_path, conversion_stats["probe"])
             timings["process_text"] = process_time
 
         if not conversion_stats["table_processed"]:
             table_count, process_time = process_table(converted_doc, pdf_path, processed_table_json_path, gen_model, gen_endpoint)
             timings["process_tables"] = process_time
 
-        return pdf_path, processed_text_json_path, processed_table_json_path, page_count, table_count, timings
+        return pdf_path, processed_text_json_path, processed_table_json_path, page_count, table_count, timings, text_blocks
     except Exception as e:
         logger.error(f"Error processing converted document for PDF: {pdf_path}. Details: {e}", exc_info=True)
 
-        return None, None, None, None, None, None
+        return None, None, None, None, None, None, None
 
-def convert_document(pdf_path, conversion_stats, out_path):
+def convert_document(pdf_path, conversion_stats, artifact_dir):
     try:
         logger.info(f"Processing '{pdf_path}'")
-        converted_json = (Path(out_path) / f"{Path(pdf_path).stem}.json")
+        converted_json = artifact_path(artifact_dir, converted_suffix)
         converted_json_f = str(converted_json)
         if not conversion_stats["convert"]:
-            return pdf_path, converted_json_f, 0.0
+            return pdf_path, converted_json_f, 0.0, 0.0, None
 
         logger.debug(f"Converting '{pdf_path}'")
         t0 = time.time()
 
+        # Converted document is persisted for re-runs and also handed over to processing as is
         converted_doc = convert_doc(pdf_path).document
-        converted_doc.save_as_json(str(converted_json_f))
+        save_converted_doc(converted_doc, converted_json_f)
 
+        # Models are loaded by the worker initializer, conversion time only covers the document itself
         conversion_time = time.time() - t0
         logger.debug(f"'{pdf_path}' converted")
-        return pdf_path, converted_json_f, conversion_time
+        return pdf_path, converted_json_f, conversion_time, pop_model_load_time(), converted_doc
     except Exception as e:
         logger.error(f"Error converting '{pdf_path}': {e}")
-    return None, None, None
+    return None, None, None, None, None
 
-def process_documents(input_paths, out_path, llm_model, llm_endpoint, emb_endpoint, max_tokens):
-    # Skip files that already exist by matching the cached checksum of the pdf
-    # if there is no difference in checksum and processed text & table json also exist, would skip for convert and process list
-    # if checksum is matching but either processed text or table json not exist, process the file, but don't convert
-    # else add the file to convert and process list(filtered_input_paths) 
-    filtered_input_paths = {}
-    converted_paths = []
-
-    for path in input_paths:
-        stem = Path(path).stem
-        checksum_path = Path(out_path) / f"{stem}.checksum"
-        filtered_input_paths[path] = {}
-        filtered_input_paths[path]["text_processed"] = False
-        filtered_input_paths[path]["table_processed"] = False
-        filtered_input_paths[path]["chunked"] = False
-
-        if not checksum_path.exists():
-            filtered_input_paths[path]["convert"] = True
-        else:
-            cached_checksum = checksum_path.read_text().strip()
-            new_checksum = generate_file_checksum(path)
-
-            if cached_checksum != new_checksum:
-                filtered_input_paths[path]["convert"] = True
-            else:
-                filtered_input_paths[path]["convert"] = not (Path(out_path) / f"{stem}.json").exists()
-                filtered_input_paths[path]["text_processed"] = (Path(out_path) / f"{stem}{text_suffix}").exists()
-                filtered_input_paths[path]["table_processed"] = (Path(out_path) / f"{stem}{table_suffix}").exists()
-                filtered_input_paths[path]["chunked"] = (Path(out_path) / f"{stem}{chunk_suffix}").exists()
-
-    for path in filtered_input_paths:
-        if filtered_input_paths[path]["convert"]:
-            checksum = generate_file_checksum(path)
-            (Path(out_path) / f"{Path(path).stem}.checksum").write_text(checksum, encoding='utf-8')
-
-    light_files = {}
-    heavy_files = {}
-
-    for path, meta in filtered_input_paths.items():
-        pg_count = get_pdf_page_count(path)
-        if pg_count >= HEAVY_PDF_PAGE_THRESHOLD:
-            heavy_files[path] = meta
-        else:
-            light_files[path] = meta
-
-    logger.debug(f"Light files: {len(light_files)}, Heavy files: {len(heavy_files)}")
-
-    def _run_batch(batch_paths, convert_worker, max_worker):
-        batch_stats = {}
-        batch_chunk_paths = []
-        batch_table_paths = []
-        
-        if not batch_paths:
-            return batch_stats, batch_chunk_paths, batch_table_paths
-
-        with ProcessPoolExecutor(max_workers=convert_worker) as converter_executor, \
-             ThreadPoolExecutor(max_workers=max_worker) as processor_executor, \
-             ThreadPoolExecutor(max_workers=max_worker) as chunker_executor:
-
-            # A. Submit Conversions
-            conversion_futures = [
-                converter_executor.submit(convert_document, path, batch_paths[path], out_path)
-                for path in batch_paths
-            ]
-            
-            process_futures = []
-            chunk_futures = []
-
-            # B. Handle Conversions -> Submit Processing
-            for conversion_future in as_completed(conversion_futures):
-                try:
-                    path, converted_json, conversion_time = conversion_future.result()
-                except Exception as e:
-                    logger.error(f"Error from conversion: {e}")
-                    continue
-                
-                if not converted_json:
-                    continue
-                
-                converted_paths.append(path)
-                batch_stats[path] = {"timings": {"conversion": conversion_time}}
-
-                process_future = processor_executor.submit(
-                    process_converted_document, converted_json, path, out_path, batch_paths[path], 
-                    llm_model, llm_endpoint, emb_endpoint, max_tokens
-                )
-                process_futures.append(process_future)
-
-            # C. Handle Processing -> Submit Chunking
-            for process_future in as_completed(process_futures):
-                try:
-                    path, processed_text_json_path, processed_table_json_path, page_count, table_count, timings = process_future.result()
-                except Exception as e:
-                    logger.error(f"Error from processing: {e}")
-                    continue
-
-                if not processed_table_json_path:
-                    continue
-
-                batch_stats[path]["timings"].update(timings)
-                batch_stats[path]["page_count"] = page_count
-                batch_stats[path]["table_count"] = table_count
-                batch_table_paths.append(processed_table_json_path)
-
-                chunk_future = chunker_executor.submit(
-                    chunk_single_file, processed_text_json_path, path, out_path, batch_paths[path], emb_endpoint, max_tokens
-                )
-                chunk_futures.append(chunk_future)
-
-            # D. Handle Chunking
-            for chunk_future in as_completed(chunk_futures):
-                try:
-                    processed_chunk_json_path, path, chunking_time = chunk_future.result()
-                    batch_stats[path]["timings"]["chunking"] = chunking_time
-                except Exception as e:
-                    logger.error(f"Error from chunking: {e}")
-                    continue
-
-                if processed_chunk_json_path:
-                    batch_chunk_paths.append(processed_chunk_json_path)
-                    logger.info(f"Completed '{path}'")
+def convert_document_shard(pdf_path, page_range):
+    logger.debug(f"Converting pages {page_range[0]}-{page_range[1]} of '{pdf_path}'")
+    return page_range, convert_doc(pdf_path, page_range=page_range).document, pop_model_load_time()
 
-        return batch_stats, batch_chunk_paths, batch_table_paths
+def merge_converted_shards(pdf_path, shards, artifact_dir, conversion_time):
+    """
+    Merges the documents converted from consecutive page ranges into one document, page numbers & provenance are
+    kept as in the original PDF.
+    shards: list of (page_range, document) tuples ordered by page range.
+    """
+    from docling_core.types.doc import DoclingDocument, PageItem, Size
 
+    t0 = time.time()
+    converted_json = artifact_path(artifact_dir, converted_suffix)
+    converted_json_f = str(converted_json)
+
+    # concatenate offsets the pages of a shard by the last page of the previous one minus its own first page, shards
+    # keep the page numbers of the original PDF, so both ends of every range must be present for the offset to be 0
+    placeholder_pages = set()
+    for (start, end), shard_doc in shards:
+        misplaced = [page_no for page_no in shard_doc.pages if not start <= page_no <= end]
+        if misplaced:
+            raise ValueError(f"Shard of pages {start}-{end} of '{pdf_path}' holds pages {misplaced} out of its range")
+        for page_no in {start, end} - shard_doc.pages.keys():
+            shard_doc.pages[page_no] = PageItem(page_no=page_no, size=Size(width=0, height=0))
+            placeholder_pages.add(page_no)
+
+    converted_doc = DoclingDocument.concatenate([shard_doc for _, shard_doc in shards])
+    for page_no in placeholder_pages:
+        converted_doc.pages.pop(page_no, None)
+    converted_doc.name = shards[0][1].name
+    converted_doc.origin = shards[0][1].origin
+
+    save_converted_doc(converted_doc, converted_json_f)
+
+    logger.debug(f"'{pdf_path}' converted from {len(shards)} shards")
+    return pdf_path, converted_json_f, conversion_time + time.time() - t0, converted_doc
+
+def count_cached_tables(artifact_dir):
+    """
+    Returns the number of tables in the processed tables artifact of the document, None if it can't be read.
+    """
     try:
-        # Light files can be processed in parallel with worker_size
-        worker_size = min(WORKER_SIZE, len(light_files))
-        l_stats, l_chunks, l_tables = _run_batch(
-            light_files,
-            convert_worker=worker_size,
-            max_worker=worker_size,
-        )
+        return count_artifact_items(artifact_path(artifact_dir, table_suffix))
+    except Exception as e:
+        logger.debug(f"Failed to count the cached tables in '{artifact_dir}': {e}")
+        return None
 
-        worker_size = min(WORKER_SIZE, len(heavy_files))
-        convert_worker_size = min(HEAVY_PDF_CONVERT_WORKER_SIZE, len(heavy_files))
-        h_stats, h_chunks, h_tables = _run_batch(
-            heavy_files,
-            convert_worker=convert_worker_size, # Heavy files conversion should happen with less workers compared to light files conversion
-            max_worker=worker_size, # Other processing steps can be parallelized with more workers as they are not CPU intensive
+def load_pdf_probe(pdf_path, artifact_dir, refresh=False):
+    """
+    Returns the probe of the pdf cached with its artifacts, the pdf is probed again if refresh is set or it's not cached.
+    """
+    probe_path = artifact_path(artifact_dir, probe_suffix)
+    if not refresh:
+        try:
+            return json.loads(probe_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.debug(f"Failed to load cached probe of '{pdf_path}': {e}")
+
+    probe = probe_pdf(pdf_path)
+    probe_path.write_text(json.dumps(probe), encoding="utf-8")
+    return probe
+
+def process_documents(input_paths, out_path, llm_model, llm_endpoint, emb_endpoint, max_tokens, on_document):
+    """
+    Converts, processes & chunks the documents, on_document(doc_path, doc_id, content_hash, chunk_count, chunks) is
+    called from the pipeline thread as soon as a document is chunked, chunks being a lazy iterator over its chunk
+    documents. Returns the stats of the documents, or None if the pipeline failed.
+    """
+    # Token counts are cached in the index's cache dir and reused across documents and re-runs
+    get_token_cache(out_path)
+    artifact_store = get_artifact_store(out_path)
+
+    # Artifacts are keyed by the content hash of the pdf, files with identical content are processed once under the
+    # first of their paths and the others reuse its artifacts
+    # Stages already completed for the content as per the manifest are skipped:
+    # if text & tables are processed and chunked as well, the file is only loaded from its artifacts
+    # if the document is converted but not processed or chunked, process the file, but don't convert
+    # else add the file to convert and process list(filtered_input_paths)
+    paths_by_hash = {}
+    for path, content_hash in artifact_store.content_hashes(input_paths).items():
+        paths_by_hash.setdefault(content_hash, []).append(path)
+    completed_stages = artifact_store.get_stages(paths_by_hash)
+
+    filtered_input_paths = {}
+    for content_hash, paths in paths_by_hash.items():
+        stages = completed_stages[content_hash]
+        meta = {
+            "content_hash": content_hash,
+            "artifact_dir": artifact_store.artifact_dir(content_hash),
+            "duplicates": paths[1:],
+            "convert": STAGE_CONVERT not in stages,
+            "text_processed": STAGE_TEXT in stages,
+            "table_processed": STAGE_TABLES in stages,
+            "chunked": STAGE_CHUNK in stages,
+        }
+        filtered_input_paths[paths[0]] = meta
+        if meta["duplicates"]:
+            logger.debug(f"'{paths[0]}' has the same content as {', '.join(repr(p) for p in meta['duplicates'])}")
+
+        # PDF is parsed once for the page count & outline, the probe is reused by every later stage and re-run
+        meta["probe"] = load_pdf_probe(paths[0], meta["artifact_dir"], refresh=STAGE_PROBE not in stages)
+        if STAGE_PROBE not in stages:
+            artifact_store.mark_done(content_hash, STAGE_PROBE)
+        meta["page_count"] = meta["probe"]["page_count"]
+        # Tables are only known once processed, the count is reused when the processing is skipped
+        meta["table_count"] = count_cached_tables(meta["artifact_dir"]) if meta["table_processed"] else None
+        meta["cost"] = estimate_cost(meta["page_count"], meta["probe"]["file_size"], meta["table_count"] or 0)
+
+    scheduler = get_scheduler()
+
+    # Costliest documents are converted first, so that they don't end up as the long tail of the run
+    # Heavy PDFs are split into page ranges, converted in parallel and merged back once all of their shards are done
+    pending_conversions = []
+    shard_states = {}
+    for path, meta in sorted(filtered_input_paths.items(), key=lambda item: item[1]["cost"], reverse=True):
+        if not meta["convert"]:
+            continue
+        if meta["page_count"] >= HEAVY_PDF_PAGE_THRESHOLD:
+            page_ranges = get_page_ranges(meta["page_count"], PDF_SHARD_PAGE_SIZE)
+            shard_states[path] = {"docs": {}, "pending": len(page_ranges), "start": None, "failed": False, "model_load_time": 0.0}
+            pending_conversions.extend(
+                ((path, page_range), estimate_conversion_memory(page_range[1] - page_range[0] + 1))
+                for page_range in page_ranges
+            )
+        else:
+            pending_conversions.append(((path, None), estimate_conversion_memory(meta["page_count"])))
+    logger.debug(f"Documents to convert: {len(pending_conversions)}, cached: {len(filtered_input_paths) - len(pending_conversions)}")
+
+    converted_pdf_stats = {}
+    # future -> (stage, path, reserved conversion memory)
+    futures = {}
+    merged_model_load_times = {}
+
+    def _submit_processing(path, converted_json, conversion_time, model_load_time=0.0, converted_doc=None):
+        # Model load time is reported apart from the conversion, it's paid once per converter process, not per document
+        converted_pdf_stats[path] = {"timings": {"conversion": conversion_time}, "model_load_time": model_load_time}
+        process_future = scheduler.processor_executor.submit(
+            process_converted_document, converted_json, path, filtered_input_paths[path]["artifact_dir"], filtered_input_paths[path],
+            llm_model, llm_endpoint, emb_endpoint, max_tokens, converted_doc
         )
+        futures[process_future] = ("process", path, 0)
+
+    def _stage_failed(path):
+        # Artifacts recorded in the manifest might have been removed from the cache dir, redo their stages on the next run
+        meta = filtered_input_paths[path]
+        converted_pdf_stats.pop(path, None)
+        missing_stages = [
+            stage for stage in (STAGE_CONVERT, STAGE_TEXT, STAGE_TABLES, STAGE_CHUNK)
+            if not artifact_path(meta["artifact_dir"], STAGE_SUFFIXES[stage]).exists()
+        ]
+        if missing_stages:
+            artifact_store.invalidate(meta["content_hash"], *missing_stages)
+
+    try:
+        # Cached conversions go straight to processing
+        for path, meta in filtered_input_paths.items():
+            if not meta["convert"]:
+                _submit_processing(path, str(artifact_path(meta["artifact_dir"], converted_suffix)), 0.0)
+
+        while pending_conversions or futures:
+            # A. Submit the conversions that fit in the converter pool & memory budget
+            for (path, page_range), memory in scheduler.next_conversions(pending_conversions):
+                if page_range:
+                    shard_states[path]["start"] = shard_states[path]["start"] or time.time()
+                    conversion_future = scheduler.submit_conversion(convert_document_shard, path, page_range)
+                    futures[conversion_future] = ("convert_shard", path, memory)
+                else:
+                    conversion_future = scheduler.submit_conversion(
+                        convert_document, path, filtered_input_paths[path], filtered_input_paths[path]["artifact_dir"]
+                    )
+                    futures[conversion_future] = ("convert", path, memory)
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, path, memory = futures.pop(future)
+                meta = filtered_input_paths[path]
+
+                # A.1 Handle Shard Conversions -> Submit Merge once all shards of the PDF are converted
+                if stage == "convert_shard":
+                    scheduler.conversion_done(memory)
+                    state = shard_states[path]
+                    state["pending"] -= 1
+                    try:
+                        page_range, shard_doc, model_load_time = future.result()
+                        state["docs"][page_range] = shard_doc
+                        state["model_load_time"] += model_load_time
+                    except Exception as e:
+                        logger.error(f"Error from conversion of '{path}' shard: {e}")
+                        if not state["failed"]:
+                            # Drop the remaining shards of the PDF, it can't be merged anymore
+                            state["failed"] = True
+                            remaining = [job for job in pending_conversions if job[0][0] == path]
+                            pending_conversions[:] = [job for job in pending_conversions if job[0][0] != path]
+                            state["pending"] -= len(remaining)
+
+                    if state["pending"] == 0:
+                        shard_states.pop(path)
+                        if not state["failed"]:
+                            merge_future = scheduler.processor_executor.submit(
+                                merge_converted_shards, path, sorted(state["docs"].items()),
+                                meta["artifact_dir"], time.time() - state["start"]
+                            )
+                            futures[merge_future] = ("merge", path, 0)
+                            merged_model_load_times[path] = state["model_load_time"]
+
+                # B. Handle Conversions -> Submit Processing
+                elif stage in ("convert", "merge"):
+                    try:
+                        if stage == "convert":
+                            scheduler.conversion_done(memory)
+                            _, converted_json, conversion_time, model_load_time, converted_doc = future.result()
+                        else:
+                            model_load_time = merged_model_load_times.pop(path, 0.0)
+                            _, converted_json, conversion_time, converted_doc = future.result()
+                    except Exception as e:
+                        logger.error(f"Error from conversion: {e}")
+                        continue
+
+                    if converted_json:
+                        artifact_store.mark_done(meta["content_hash"], STAGE_CONVERT)
+                        _submit_processing(
+                            path, converted_json, conversion_time, model_load_time + scheduler.pop_preload_time(), converted_doc
+                        )
+
+                # C. Handle Processing -> Submit Chunking
+                elif stage == "process":
+                    try:
+                        _, processed_text_json_path, processed_table_json_path, page_count, table_count, timings, text_blocks = future.result()
+                    except Exception as e:
+                        logger.error(f"Error from processing: {e}")
+                        processed_table_json_path = None
+
+                    if not processed_table_json_path:
+                        _stage_failed(path)
+                        continue
+
+                    artifact_store.mark_done(meta["content_hash"], STAGE_TEXT, STAGE_TABLES)
+                    converted_pdf_stats[path]["timings"].update(timings)
+                    converted_pdf_stats[path]["page_count"] = page_count
+                    converted_pdf_stats[path]["table_count"] = table_count
+
+                    chunk_future = scheduler.chunker_executor.submit(
+                        chunk_single_file, processed_text_json_path, path, meta["artifact_dir"], meta, emb_endpoint, max_tokens,
+                        text_blocks
+                    )
+                    futures[chunk_future] = ("chunk", path, 0)
+
+                # D. Handle Chunking
+                else:
+                    try:
+                        processed_chunk_json_path, _, chunking_time, tokenize_stats, text_chunk_count = future.result()
+                    except Exception as e:
+                        logger.error(f"Error from chunking: {e}")
+                        processed_chunk_json_path = None
+
+                    if not processed_chunk_json_path:
+                        _stage_failed(path)
+                        continue
+
+                    artifact_store.mark_done(meta["content_hash"], STAGE_CHUNK)
+                    converted_pdf_stats[path]["timings"]["chunking"] = chunking_time
+                    converted_pdf_stats[path]["tokenize_stats"] = tokenize_stats
+                    logger.info(f"Completed '{path}'")
 
-        # Combine stats from both batches
-        converted_pdf_stats = {**l_stats, **h_stats}
-        all_chunk_json_paths = l_chunks + h_chunks
-        all_table_json_paths = l_tables + h_tables
-
-        combined_chunks = []
-        succeeded_files = {**l_stats, **h_stats}.keys()
-        
-        for path in succeeded_files:
-            stem = Path(path).stem
-            c_path = Path(out_path) / f"{stem}{chunk_suffix}"
-            t_path = Path(out_path) / f"{stem}{table_suffix}"
-            
-            if c_path in all_chunk_json_paths and t_path in all_table_json_paths:
-                filtered_chunks = create_chunk_documents(c_path, t_path, path)
-                combined_chunks.extend(filtered_chunks)
-
-        return combined_chunks, converted_pdf_stats
+                    # Hand the chunks over to be indexed while the remaining documents are still in the pipeline,
+                    # duplicates are served from the artifacts of the first file, nothing was processed for them
+                    table_path = artifact_path(meta["artifact_dir"], table_suffix)
+                    chunk_count = text_chunk_count + converted_pdf_stats[path]["table_count"]
+                    for doc_path in [path] + meta["duplicates"]:
+                        if doc_path != path:
+                            converted_pdf_stats[doc_path] = {
+                                "timings": {}, "page_count": converted_pdf_stats[path]["page_count"],
+                                "table_count": converted_pdf_stats[path]["table_count"]
+                            }
+                        on_document(
+                            doc_path, generate_doc_id(doc_path), meta["content_hash"], chunk_count,
+                            iter_document_chunks(processed_chunk_json_path, table_path, doc_path, meta["content_hash"], llm_endpoint)
+                        )
+
+        return converted_pdf_stats
 
     except Exception as e:
         logger.error(f"Pipeline Error: {e}")
-        return None, None
+        return None
 
 def collect_header_font_sizes(elements):
     """
@@ -418,19 +594,49 @@ def get_header_level(text, font_size, sorted_font_sizes):
     return level, text
 
 
-def count_tokens(text, emb_endpoint):
-    token_len = len(tokenize_with_llm(text, emb_endpoint))
-    return token_len
+def count_tokens_batch(texts, emb_endpoint, tokenize_stats=None):
+    return count_tokens_cached(get_emb_tokenizer(emb_endpoint), texts, tokenize_stats)
 
-def split_text_into_token_chunks(text, emb_endpoint, max_tokens=512, overlap=50):
+def count_tokens_cached(tokenizer, texts, tokenize_stats=None):
+    token_cache = get_token_cache()
+
+    # Only the texts missing in the token count cache are sent to the tokenizer
+    counts = token_cache.get_many(tokenizer.model_id, texts) if token_cache else {}
+    missing = [text for text in dict.fromkeys(texts) if text not in counts]
+    if missing:
+        missing_counts = dict(zip(missing, tokenizer.count_batch(missing)))
+        if token_cache:
+            token_cache.put_many(tokenizer.model_id, missing_counts)
+        counts.update(missing_counts)
+
+    if tokenize_stats is not None:
+        tokenize_stats["tokenized"] = tokenize_stats.get("tokenized", 0) + len(missing)
+
+    return [counts[text] for text in texts]
+
+def add_chunk_token_counts(chunks, llm_endpoint):
+    """
+    Stores the LLM token count of every chunk, used to pack the context at query time without tokenizing it.
+    """
+    try:
+        token_counts = count_tokens_cached(get_llm_tokenizer(llm_endpoint), [chunk["page_content"] for chunk in chunks])
+    except Exception as e:
+        logger.warning(f"Failed to count tokens of the chunks, context will be tokenized at query time: {e}")
+        return
+    for chunk, token_count in zip(chunks, token_counts):
+        chunk["token_count"] = token_count
+
+def split_text_into_token_chunks(text, emb_endpoint, max_tokens=512, overlap=50, tokenize_stats=None):
     sentences = SentenceSplitter(language='en').split(text)
+    # Token counts of the section are looked up once, duplicate & cached sentences aren't tokenized again
+    token_lens = count_tokens_batch(sentences, emb_endpoint, tokenize_stats)
     chunks = []
     current_chunk = []
     current_token_count = 0
+    last_token_len = 0
+    overlap_count = 0
 
-    for sentence in sentences:
-        token_len = count_tokens(sentence, emb_endpoint)
-
+    for sentence, token_len in zip(sentences, token_lens):
         if current_token_count + token_len > max_tokens:
             # save current chunk
             chunk_text = " ".join(current_chunk)
@@ -439,203 +645,276 @@ def split_text_into_token_chunks(text, emb_endpoint, max_tokens=512, overlap=50)
             if overlap > 0 and len(current_chunk) > 0:
                 overlap_text = current_chunk[-1]
                 current_chunk = [overlap_text]
-                current_token_count = count_tokens(overlap_text, emb_endpoint)
+                current_token_count = last_token_len
+                overlap_count += 1
             else:
                 current_chunk = []
                 current_token_count = 0
 
         current_chunk.append(sentence)
         current_token_count += token_len
+        last_token_len = token_len
 
     # flush last
     if current_chunk:
         chunk_text = " ".join(current_chunk)
         chunks.append(chunk_text)
 
+    if tokenize_stats is not None:
+        # Per sentence tokenization counted every sentence and again every overlap sentence
+        tokenize_stats["sentences"] = tokenize_stats.get("sentences", 0) + len(sentences) + overlap_count
+
     return chunks
 
 
-def flush_chunk(current_chunk, chunks, emb_endpoint, max_tokens):
-    content = current_chunk["content"].strip()
-    if not content:
-        return
+def flush_chunk(current_chunk, emb_endpoint, max_tokens, tokenize_stats=None):
+    """
+    Splits the accumulated section content into token chunks and resets current_chunk, returns the token chunks.
+    """
+    content = "".join(current_chunk["content"]).strip()
+    chunks = []
+    if content:
+        # Split content into token chunks
+        token_chunks = split_text_into_token_chunks(content, emb_endpoint, max_tokens=max_tokens, tokenize_stats=tokenize_stats)
+
+        page_range = sorted(set(current_chunk["page_range"]))
+        for i, part in enumerate(token_chunks):
+            chunk = {
+                "chapter_title": current_chunk["chapter_title"],
+                "section_title": current_chunk["section_title"],
+                "subsection_title": current_chunk["subsection_title"],
+                "subsubsection_title": current_chunk["subsubsection_title"],
+                "content": part,
+                "page_range": page_range.copy(),
+                "source_nodes": current_chunk["source_nodes"].copy()
+            }
+            if len(token_chunks) > 1:
+                chunk["part_id"] = i + 1
+            chunks.append(chunk)
 
-    # Split content into token chunks
-    token_chunks = split_text_into_token_chunks(content, emb_endpoint, max_tokens=max_tokens)
-
-    for i, part in enumerate(token_chunks):
-        chunk = {
-            "chapter_title": current_chunk["chapter_title"],
-            "section_title": current_chunk["section_title"],
-            "subsection_title": current_chunk["subsection_title"],
-            "subsubsection_title": current_chunk["subsubsection_title"],
-            "content": part,
-            "page_range": sorted(set(current_chunk["page_range"])),
-            "source_nodes": current_chunk["source_nodes"].copy()
-        }
-        if len(token_chunks) > 1:
-            chunk["part_id"] = i + 1
-        chunks.append(chunk)
-
-    # Reset current_chunk after flushing
-    current_chunk["chapter_title"] = ""
-    current_chunk["section_title"] = ""
-    current_chunk["subsection_title"] = ""
-    current_chunk["subsubsection_title"] = ""
-    current_chunk["content"] = ""
+        current_chunk["chapter_title"] = ""
+        current_chunk["section_title"] = ""
+        current_chunk["subsection_title"] = ""
+        current_chunk["subsubsection_title"] = ""
+
+    # Reset current_chunk after flushing, pages & nodes of empty blocks mustn't leak into the next section
+    current_chunk["content"] = []
     current_chunk["page_range"] = []
     current_chunk["source_nodes"] = []
 
+    return chunks
+
+def iter_chunks(blocks, font_size_levels, emb_endpoint, max_tokens, tokenize_stats=None):
+    """
+    Yields the RAG chunks of the text blocks section by section, section content is buffered as a list of parts.
+    blocks: iterable of (index, block) pairs, index is used to reference the source node of the block.
+    """
+    current_chunk = {
+        "chapter_title": None,
+        "section_title": None,
+        "subsection_title": None,
+        "subsubsection_title": None,
+        "content": [],
+        "page_range": [],
+        "source_nodes": []
+    }
+
+    current_chapter = None
+    current_section = None
+    current_subsection = None
+    current_subsubsection = None
+
+    for idx, block in blocks:
+        label = block.get("label")
+        text = block.get("text", "").strip()
+        try:
+            page_no = block.get("prov", {})[0].get("page_no")
+        except:
+            page_no = 0
+        ref = f"#texts/{idx}"
+
+        if label == "section_header":
+            level, full_title = get_header_level(text, block.get("font_size"), font_size_levels)
+            if level == 1:
+                current_chapter = full_title
+                current_section = None
+                current_subsection = None
+                current_subsubsection = None
+            elif level == 2:
+                current_section = full_title
+                current_subsection = None
+                current_subsubsection = None
+            elif level == 3:
+                current_subsection = full_title
+                current_subsubsection = None
+            else:
+                current_subsubsection = full_title
+
+            # Flush current chunk and update
+            yield from flush_chunk(current_chunk, emb_endpoint, max_tokens, tokenize_stats)
+            current_chunk["chapter_title"] = current_chapter
+            current_chunk["section_title"] = current_section
+            current_chunk["subsection_title"] = current_subsection
+            current_chunk["subsubsection_title"] = current_subsubsection
+
+        elif label in {"text", "list_item", "code", "formula"}:
+            if current_chunk["chapter_title"] is None:
+                current_chunk["chapter_title"] = current_chapter
+            if current_chunk["section_title"] is None:
+                current_chunk["section_title"] = current_section
+            if current_chunk["subsection_title"] is None:
+                current_chunk["subsection_title"] = current_subsection
+            if current_chunk["subsubsection_title"] is None:
+                current_chunk["subsubsection_title"] = current_subsubsection
+
+            if label == 'code':
+                current_chunk["content"].append(f"```\n{text}\n``` ")
+            elif label == 'formula':
+                current_chunk["content"].append(f"${text}$ ")
+            else:
+                current_chunk["content"].append(f"{text} ")
+            if page_no is not None:
+                current_chunk["page_range"].append(page_no)
+            current_chunk["source_nodes"].append(ref)
+        else:
+            logger.debug(f'Skipping adding "{label}".')
+
+    # Flush any remaining content
+    yield from flush_chunk(current_chunk, emb_endpoint, max_tokens, tokenize_stats)
 
-def chunk_single_file(input_path, pdf_path, out_path, conversion_stats, emb_endpoint, max_tokens=512):
+
+def iter_chapter_partitions(blocks, font_size_levels):
+    """
+    Groups the (index, block) pairs into partitions, a new partition starts at every level 1 section header.
+    Chunking state is reset at level 1 headers, hence the partitions can be chunked independently.
+    """
+    partition = []
+    for idx, block in blocks:
+        if partition and block.get("label") == "section_header":
+            level, _ = get_header_level(block.get("text", "").strip(), block.get("font_size"), font_size_levels)
+            if level == 1:
+                yield partition
+                partition = []
+        partition.append((idx, block))
+    if partition:
+        yield partition
+
+def iter_chunks_parallel(blocks, font_size_levels, emb_endpoint, max_tokens, tokenize_stats=None, max_workers=CHUNK_PARTITION_WORKER_SIZE):
+    """
+    Chunks the chapters of a document concurrently and yields the chunks in document order.
+    Number of chapters held in memory is bounded to twice the worker count.
+    """
+    def _chunk_partition(partition, partition_stats):
+        return list(iter_chunks(partition, font_size_levels, emb_endpoint, max_tokens, partition_stats))
+
+    def _collect(future, partition_stats):
+        chunks = future.result()
+        if tokenize_stats is not None:
+            for key, value in partition_stats.items():
+                tokenize_stats[key] = tokenize_stats.get(key, 0) + value
+        return chunks
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for partition in iter_chapter_partitions(blocks, font_size_levels):
+            partition_stats = {}
+            pending.append((executor.submit(_chunk_partition, partition, partition_stats), partition_stats))
+            if len(pending) >= max_workers * 2:
+                yield from _collect(*pending.popleft())
+        while pending:
+            yield from _collect(*pending.popleft())
+
+def chunk_single_file(input_path, pdf_path, artifact_dir, conversion_stats, emb_endpoint, max_tokens=512, text_blocks=None):
+    """
+    Chunks the text blocks of the document, text_blocks is passed when they were just processed,
+    otherwise they are streamed from input_path.
+    """
     t0 = time.time()
-    stem = Path(pdf_path).stem
-    processed_chunk_json_path = (Path(out_path) / f"{stem}{chunk_suffix}")
+    processed_chunk_json_path = artifact_path(artifact_dir, chunk_suffix)
+
+    tokenize_stats = {"sentences": 0, "tokenized": 0}
 
     if conversion_stats["chunked"]:
         logger.debug(f"{pdf_path} already chunked!")
-        return processed_chunk_json_path, pdf_path, 0.0
+        try:
+            chunk_count = count_artifact_items(processed_chunk_json_path)
+        except (OSError, EOFError, ValueError) as e:
+            logger.error(f"Error reading the chunks of '{pdf_path}': {e}")
+            return None, None, None, None, None
+        return processed_chunk_json_path, pdf_path, 0.0, tokenize_stats, chunk_count
 
     try:
-        if not Path(processed_chunk_json_path).exists():
-            with open(input_path, "r") as f:
-                data = json.load(f)
-            
-            font_size_levels = collect_header_font_sizes(data)
-
-            chunks = []
-            current_chunk = {
-                "chapter_title": None,
-                "section_title": None,
-                "subsection_title": None,
-                "subsubsection_title": None,
-                "content": "",
-                "page_range": [],
-                "source_nodes": []
-            }
-
-            current_chapter = None
-            current_section = None
-            current_subsection = None
-            current_subsubsection = None
-
-            for idx, block in enumerate(tqdm_wrapper(data, desc=f"Chunking {input_path}")):
-                label = block.get("label")
-                text = block.get("text", "").strip()
-                try:
-                    page_no = block.get("prov", {})[0].get("page_no")
-                except:
-                    page_no = 0
-                ref = f"#texts/{idx}"
-
-                if label == "section_header":
-                    level, full_title = get_header_level(text, block.get("font_size"), font_size_levels)
-                    if level == 1:
-                        current_chapter = full_title
-                        current_section = None
-                        current_subsection = None
-                        current_subsubsection = None
-                    elif level == 2:
-                        current_section = full_title
-                        current_subsection = None
-                        current_subsubsection = None
-                    elif level == 3:
-                        current_subsection = full_title
-                        current_subsubsection = None
-                    else:
-                        current_subsubsection = full_title
-
-                    # Flush current chunk and update
-                    flush_chunk(current_chunk, chunks, emb_endpoint, max_tokens)
-                    current_chunk["chapter_title"] = current_chapter
-                    current_chunk["section_title"] = current_section
-                    current_chunk["subsection_title"] = current_subsection
-                    current_chunk["subsubsection_title"] = current_subsubsection
-
-                elif label in {"text", "list_item", "code", "formula"}:
-                    if current_chunk["chapter_title"] is None:
-                        current_chunk["chapter_title"] = current_chapter
-                    if current_chunk["section_title"] is None:
-                        current_chunk["section_title"] = current_section
-                    if current_chunk["subsection_title"] is None:
-                        current_chunk["subsection_title"] = current_subsection
-                    if current_chunk["subsubsection_title"] is None:
-                        current_chunk["subsubsection_title"] = current_subsubsection
-
-                    if label == 'code':
-                        current_chunk["content"] += f"```\n{text}\n``` "
-                    elif label == 'formula':
-                        current_chunk["content"] += f"${text}$ "
-                    else:
-                        current_chunk["content"] += f"{text} "
-                    if page_no is not None:
-                        current_chunk["page_range"].append(page_no)
-                    current_chunk["source_nodes"].append(ref)
-                else:
-                    logger.debug(f'Skipping adding "{label}".')
-
-            # Flush any remaining content
-            flush_chunk(current_chunk, chunks, emb_endpoint, max_tokens)
+        # Text blocks read back from the file are streamed twice, once for the header font sizes and once for
+        # chunking, so that memory is bounded by the largest section instead of the whole document
+        read_blocks = (lambda: text_blocks) if text_blocks is not None else (lambda: iter_artifact(input_path))
+        font_size_levels = collect_header_font_sizes(read_blocks())
+
+        blocks = tqdm_wrapper(enumerate(read_blocks()), desc=f"Chunking {input_path}")
+        if conversion_stats.get("page_count", 0) >= HEAVY_PDF_PAGE_THRESHOLD:
+            # Heavy PDFs are chunked chapter by chapter in parallel
+            chunks = iter_chunks_parallel(blocks, font_size_levels, emb_endpoint, max_tokens, tokenize_stats)
+        else:
+            chunks = iter_chunks(blocks, font_size_levels, emb_endpoint, max_tokens, tokenize_stats)
 
-            # Save the processed chunks to the output file
-            with open(processed_chunk_json_path, "w") as f:
-                json.dump(chunks, f, indent=2)
+        # Save the processed chunks to the output file as they are produced
+        chunk_count = write_artifact(processed_chunk_json_path, chunks)
 
-            logger.debug(f"{len(chunks)} RAG chunks saved to {processed_chunk_json_path}")
-        else:
-            logger.debug(f"{processed_chunk_json_path} already exists.")
-        return processed_chunk_json_path, pdf_path, time.time() - t0
+        logger.debug(f"{chunk_count} RAG chunks saved to {processed_chunk_json_path}")
+        return processed_chunk_json_path, pdf_path, time.time() - t0, tokenize_stats, chunk_count
     except Exception as e:
         logger.error(f"error chunking file '{input_path}': {e}")
-    return None, None, None
+    return None, None, None, None, None
 
 def create_chunk_documents(in_txt_f, in_tab_f, orig_fn):
+    """
+    Streams the chunk documents of the text chunks followed by the ones of the tables.
+    """
     logger.debug(f"Creating combined chunk documents from '{in_txt_f}' & '{in_tab_f}'")
-    with open(in_txt_f, "r") as f:
-        txt_data = json.load(f)
-
-    with open(in_tab_f, "r") as f:
-        tab_data = json.load(f)
-
-    txt_docs = []
-    if len(txt_data):
-        for _, block in enumerate(txt_data):
-            meta_info = ''
-            if block.get('chapter_title'):
-                meta_info += f"Chapter: {block.get('chapter_title')} "
-            if block.get('section_title'):
-                meta_info += f"Section: {block.get('section_title')} "
-            if block.get('subsection_title'):
-                meta_info += f"Subsection: {block.get('subsection_title')} "
-            if block.get('subsubsection_title'):
-                meta_info += f"Subsubsection: {block.get('subsubsection_title')} "
-            txt_docs.append({
-                # "chunk_id": txt_id,
-                "page_content": f'{meta_info}\n{block.get("content")}' if meta_info != '' else block.get("content"),
-                "filename": orig_fn,
-                "type": "text",
-                "source": meta_info,
-                "language": "en"
-            })
-
-    tab_docs = []
-    if len(tab_data):
-        tab_data = list(tab_data.values())
-        for tab_id, block in enumerate(tab_data):
-            # tab_docs.append(Document(
-            #     page_content=block.get('summary'),
-            #     metadata={"filename": orig_fn, "type": "table", "source": block.get('html'), "chunk_id": tab_id}
-            # ))
-            tab_docs.append({
-                "page_content": block.get("summary"),
-                "filename": orig_fn,
-                "type": "table",
-                "source": block.get("html"),
-                "language": "en"
-            })
+    for block in iter_artifact(in_txt_f):
+        meta_info = ''
+        if block.get('chapter_title'):
+            meta_info += f"Chapter: {block.get('chapter_title')} "
+        if block.get('section_title'):
+            meta_info += f"Section: {block.get('section_title')} "
+        if block.get('subsection_title'):
+            meta_info += f"Subsection: {block.get('subsection_title')} "
+        if block.get('subsubsection_title'):
+            meta_info += f"Subsubsection: {block.get('subsubsection_title')} "
+        yield {
+            "page_content": f'{meta_info}\n{block.get("content")}' if meta_info != '' else block.get("content"),
+            "filename": orig_fn,
+            "type": "text",
+            "source": meta_info,
+            "language": "en"
+        }
 
-    combined_docs = txt_docs + tab_docs
+    for block in iter_artifact(in_tab_f):
+        yield {
+            "page_content": block.get("summary"),
+            "filename": orig_fn,
+            "type": "table",
+            "source": block.get("html"),
+            "language": "en"
+        }
 
-    logger.debug(f"Combined chunk documents created")
+    logger.debug("Combined chunk documents created")
 
-    return combined_docs
+def iter_document_chunks(chunk_path, table_path, doc_path, content_hash, llm_endpoint):
+    """
+    Streams the chunk documents of doc_path with their LLM token counts. Chunks are versioned by the document id &
+    content hash, so that only changed documents get re-indexed.
+    """
+    doc_id = generate_doc_id(doc_path)
+    chunks = create_chunk_documents(chunk_path, table_path, doc_path)
+    chunk_index = 0
+    while True:
+        batch = list(islice(chunks, TOKEN_COUNT_BATCH_SIZE))
+        if not batch:
+            return
+        add_chunk_token_counts(batch, llm_endpoint)
+        for chunk in batch:
+            chunk["doc_id"] = doc_id
+            chunk["content_hash"] = content_hash
+            chunk["chunk_index"] = chunk_index
+            chunk_index += 1
+            yield chunk
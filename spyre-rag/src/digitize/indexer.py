@@ -0,0 +1,99 @@
+import os
+import queue
+import threading
+
+from common.misc_utils import get_logger
+
+logger = get_logger("indexer")
+
+# Max number of chunks waiting to be embedded & indexed, bounds the memory held by the indexing regardless of the
+# corpus size
+CHUNK_QUEUE_SIZE = int(os.getenv("INGEST_CHUNK_QUEUE_SIZE", "1024"))
+
+_DONE = object()
+
+class ChunkIndexer:
+    """
+    Embeds & indexes the chunks of the documents in the background while the remaining documents are still being
+    converted and chunked. A feeder thread streams the chunks of the documents, in the order they were added, into a
+    bounded queue consumed by VectorStore.insert_chunks.
+    """
+    def __init__(self, vector_store, embedder, embedding_cache=None, checkpoint=None, queue_size=CHUNK_QUEUE_SIZE):
+        self.vector_store = vector_store
+        self.embedder = embedder
+        self.embedding_cache = embedding_cache
+        self.checkpoint = checkpoint
+        # Documents whose chunks couldn't be read or indexed, their chunks indexed meanwhile stay committed to the
+        # checkpoint and the rest are indexed by the next ingestion
+        self.failed_documents = set()
+        self.indexed_chunks = 0
+        # Failure of the indexing as a whole, e.g. the embedding or OpenSearch server being unreachable
+        self.error = None
+
+        self._documents = queue.Queue()
+        self._chunks = queue.Queue(maxsize=queue_size)
+        self._feeder = threading.Thread(target=self._feed, name="chunk-feeder", daemon=True)
+        self._consumer = threading.Thread(target=self._consume, name="chunk-indexer", daemon=True)
+        self._feeder.start()
+        self._consumer.start()
+
+    def add_document(self, doc_path, chunks, stale_documents=None, keep_content_hashes=None):
+        """
+        Queues the chunks of the document to be indexed, stale_documents {doc_id: filename} are deleted from the
+        vector store before the chunks are queued, except their versions in keep_content_hashes {doc_id: content_hash}.
+        """
+        self._documents.put((doc_path, chunks, stale_documents, keep_content_hashes))
+
+    def _feed(self):
+        while True:
+            item = self._documents.get()
+            if item is _DONE:
+                self._chunks.put(_DONE)
+                return
+            doc_path, chunks, stale_documents, keep_content_hashes = item
+            if self.error is not None:
+                self.failed_documents.add(doc_path)
+                continue
+            try:
+                if stale_documents:
+                    self.vector_store.delete_documents(stale_documents, keep_content_hashes)
+                for chunk in chunks:
+                    self._chunks.put(chunk)
+            except Exception as e:
+                logger.error(f"Error queueing the chunks of '{doc_path}' for indexing: {e}")
+                self.failed_documents.add(doc_path)
+
+    def _iter_chunks(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is _DONE:
+                return
+            yield chunk
+
+    def _consume(self):
+        chunks = self._iter_chunks()
+        try:
+            self.indexed_chunks = self.vector_store.insert_chunks(
+                chunks, embedder=self.embedder, embedding_cache=self.embedding_cache, checkpoint=self.checkpoint,
+                on_failed_chunks=self._chunks_failed
+            ) or 0
+        except Exception as e:
+            logger.error(f"Error indexing the chunks: {e}")
+            self.error = e
+        # Chunks left after a failed insertion are drained, so that the feeder never blocks on a full queue
+        for _ in chunks:
+            pass
+
+    def _chunks_failed(self, chunks):
+        # Chunks are named after the path of their document
+        documents = {chunk.get("filename") for chunk in chunks}
+        logger.error(f"{len(chunks)} chunks of {len(documents)} document(s) failed to be indexed: {', '.join(sorted(documents))}")
+        self.failed_documents.update(documents)
+
+    def close(self):
+        """
+        Waits for the queued documents to be indexed.
+        """
+        self._documents.put(_DONE)
+        self._feeder.join()
+        self._consumer.join()
@@ -1,14 +1,48 @@
 from glob import glob
 import logging
+import os
 import time
 
 import common.db_utils as db
 from common.emb_utils import get_embedder
+from common.embedding_cache import get_embedding_cache
+from common.index_checkpoint import get_index_checkpoint
 from common.misc_utils import *
+from common.token_cache import get_token_cache
 from digitize.doc_utils import process_documents
+from digitize.indexer import ChunkIndexer
+from digitize.scheduler import get_scheduler
 
 logger = get_logger("ingest")
 
+def get_removed_documents(indexed_docs, directory_path, input_file_paths):
+    """
+    Returns the ids of the indexed documents from directory_path whose files don't exist anymore, or that were indexed
+    under another spelling of their path and hence duplicate the current document. Paths are compared canonicalized.
+    """
+    dir_prefix = os.path.join(os.path.realpath(directory_path), "")
+    input_files = {os.path.realpath(path) for path in input_file_paths}
+    removed = []
+    for doc_id, doc in indexed_docs.items():
+        filename = os.path.realpath(doc["filename"])
+        if not filename.startswith(dir_prefix):
+            continue
+        if filename not in input_files or doc_id != generate_doc_id(filename):
+            removed.append(doc_id)
+    return removed
+
+def resumable_chunks(checkpoint, doc_id, content_hash, indexed_chunk_count):
+    """
+    Returns the indexes of the chunks of the document version committed by a previous ingestion, the checkpoint
+    forgets the chunks of the other versions. Committed chunks are trusted as long as the index holds at least as many
+    chunks of the version, otherwise the version is indexed from scratch.
+    """
+    committed = checkpoint.committed(doc_id, content_hash)
+    if committed and len(committed) > indexed_chunk_count:
+        committed = set()
+    checkpoint.discard(doc_id, content_hash if committed else None)
+    return committed
+
 def ingest(directory_path):
 
     def ingestion_failed():
@@ -28,7 +62,8 @@ def ingest(directory_path):
         total_pdfs += 1 
 
         if is_supported_file(path,allowed_file_types):
-            input_file_paths.append(path)
+            # Documents are identified by their canonical path, whichever way the directory was passed
+            input_file_paths.append(os.path.realpath(path))
         else:
             logger.warning(
                 f"Skipping file with .pdf extension but unsupported format: {path}"
@@ -41,6 +76,9 @@ def ingest(directory_path):
 
     logger.info(f"Processing {file_cnt} document(s)")
 
+    # Converter processes are forked from the models loaded in this process, before the indexer starts its threads
+    get_scheduler()
+
     emb_model_dict, llm_model_dict, _ = get_model_endpoints()
     # Initialize/reset the database before processing any files
     vector_store = db.get_vector_store()
@@ -49,23 +87,59 @@ def ingest(directory_path):
     out_path = setup_cache_dir(index_name)
 
     start_time = time.time()
-    combined_chunks, converted_pdf_stats = process_documents(
-        input_file_paths, out_path, llm_model_dict['llm_model'], llm_model_dict['llm_endpoint'],  emb_model_dict["emb_endpoint"],
-        max_tokens=emb_model_dict['max_tokens'] - 100)
-    # converted_pdf_stats holds { file_name: {page_count: int, table_count: int, timings: {conversion: time_in_secs, process_text: time_in_secs, process_tables: time_in_secs, chunking: time_in_secs}} }
-    if converted_pdf_stats is None or combined_chunks is None:
+
+    # Only new or changed documents are embedded & indexed, stale chunks of changed or removed documents are deleted
+    indexed_docs = vector_store.get_indexed_documents()
+    unchanged_doc_ids = []
+    changed_doc_ids = []
+
+    # Chunks of every document are embedded & indexed as soon as it's chunked, while the rest are still processed
+    embedder = get_embedder(emb_model_dict['emb_model'], emb_model_dict['emb_endpoint'], emb_model_dict['max_tokens'])
+    # Chunks committed by an interrupted or partially failed ingestion are resumed from the checkpoint
+    checkpoint = get_index_checkpoint(out_path)
+    indexer = ChunkIndexer(vector_store, embedder, embedding_cache=get_embedding_cache(out_path), checkpoint=checkpoint)
+    resumed_chunks = 0
+
+    def index_document(doc_path, doc_id, content_hash, chunk_count, chunks):
+        nonlocal resumed_chunks
+        indexed_hashes = indexed_docs.get(doc_id, {}).get("hashes", {})
+        if indexed_hashes == {content_hash: chunk_count}:
+            unchanged_doc_ids.append(doc_id)
+            return
+        changed_doc_ids.append(doc_id)
+
+        committed = resumable_chunks(checkpoint, doc_id, content_hash, indexed_hashes.get(content_hash, 0))
+        keep_content_hash = content_hash if committed else None
+        if committed:
+            resumed_chunks += len(committed)
+            chunks = (chunk for chunk in chunks if chunk["chunk_index"] not in committed)
+
+        stale_docs = {doc_id: indexed_docs[doc_id]["filename"]} if doc_id in indexed_docs else None
+        indexer.add_document(doc_path, chunks, stale_docs, {doc_id: keep_content_hash} if keep_content_hash else None)
+
+    with vector_store.bulk_ingest():
+        try:
+            converted_pdf_stats = process_documents(
+                input_file_paths, out_path, llm_model_dict['llm_model'], llm_model_dict['llm_endpoint'],  emb_model_dict["emb_endpoint"],
+                max_tokens=emb_model_dict['max_tokens'] - 100, on_document=index_document)
+        finally:
+            indexer.close()
+    # converted_pdf_stats holds { file_name: {page_count: int, table_count: int, model_load_time: time_in_secs, timings: {conversion: time_in_secs, process_text: time_in_secs, process_tables: time_in_secs, chunking: time_in_secs}} }
+    if converted_pdf_stats is None or indexer.error is not None:
         ingestion_failed()
         return
+    for doc_path in indexer.failed_documents:
+        converted_pdf_stats.pop(doc_path, None)
 
-    if combined_chunks:
-        logger.info("Loading processed documents into DB")
-        embedder = get_embedder(emb_model_dict['emb_model'], emb_model_dict['emb_endpoint'], emb_model_dict['max_tokens'])
-        # Insert data into Opensearch
-        vector_store.insert_chunks(
-            combined_chunks,
-            embedder=embedder
-        )
-        logger.info("Processed documents loaded into DB")
+    removed_doc_ids = get_removed_documents(indexed_docs, directory_path, input_file_paths)
+    logger.info(
+        f"Documents indexed: {len(changed_doc_ids)} new or changed, {len(unchanged_doc_ids)} unchanged, "
+        f"{len(removed_doc_ids)} removed, {indexer.indexed_chunks} chunks ({resumed_chunks} resumed from the checkpoint)"
+    )
+    if removed_doc_ids:
+        vector_store.delete_documents({doc_id: indexed_docs[doc_id]["filename"] for doc_id in removed_doc_ids})
+        for doc_id in removed_doc_ids:
+            checkpoint.discard(doc_id)
 
     # Log time taken for the file
     end_time = time.time()  # End the timer for the current file
@@ -83,4 +157,25 @@ def ingest(directory_path):
         f"Ingestion summary: {ingested}/{total_pdfs} files ingested "
         f"({percentage:.2f}% of total PDF files)"
     )
+    model_load_time = sum(stats.get("model_load_time", 0.0) for stats in converted_pdf_stats.values())
+    if model_load_time:
+        logger.info(f"Docling models loaded in {model_load_time:.2f} seconds (not included in the conversion time)")
+    if embedder.stats["chunks"]:
+        chunks_per_sec, tokens_per_sec = embedder.throughput()
+        logger.info(
+            f"Embedding throughput: {chunks_per_sec:.2f} chunks/sec, {tokens_per_sec:.2f} tokens/sec "
+            f"({embedder.stats['chunks']} chunks, {embedder.stats['tokens']} tokens embedded in {embedder.stats['time']:.2f} seconds)"
+        )
+    embedding_cache = get_embedding_cache()
+    if embedding_cache and embedding_cache.lookups:
+        logger.info(
+            f"Embedding cache: {embedding_cache.hits}/{embedding_cache.lookups} hits "
+            f"({embedding_cache.hit_rate():.2f}% hit rate)"
+        )
+    token_cache = get_token_cache()
+    if token_cache and token_cache.lookups:
+        logger.info(
+            f"Token count cache: {token_cache.hits}/{token_cache.lookups} hits "
+            f"({token_cache.hit_rate():.2f}% hit rate)"
+        )
     return converted_pdf_stats
@@ -1,12 +1,13 @@
 import logging
+import os
+import time
 from typing import List, Dict, Any
 import pdfplumber
-from rapidfuzz import fuzz
-from collections import defaultdict, Counter
-from pdfminer.pdfdocument import PDFDocument, PDFNoOutlines
-from pdfminer.pdfparser import PDFParser, PDFSyntaxError
-from pdfminer.pdfpage import PDFPage
+import numpy as np
+from rapidfuzz import fuzz, process
+from collections import defaultdict, Counter, OrderedDict
 import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 
 from common.misc_utils import get_logger
 
@@ -16,127 +17,278 @@ logging.getLogger().setLevel(logging.ERROR)
 
 logger = get_logger("PDF")
 
-def get_pdf_page_count(file_path):
+# Number of section headers fuzzy matched against the TOC titles at once
+TOC_MATCH_BATCH_SIZE = 256
+
+# Number of pages whose line index is kept in memory while looking up the section header font sizes
+PAGE_LINE_CACHE_SIZE = 32
+
+# Docling converter of the current process, built once and reused for all the documents converted by the process
+_doc_converter = None
+_model_load_time = 0.0
+_model_load_pid = None
+
+def probe_pdf(file_path):
+    """
+    Opens the PDF once and returns its page count, outline, file size and whether each page has a text layer.
+    toc: {title: level} with levels starting at 1, text_pages: list of bool indexed by page number - 1.
+    """
+    probe = {"page_count": 0, "file_size": os.path.getsize(file_path), "toc": {}, "text_pages": []}
     try:
         pdf = pdfium.PdfDocument(file_path)
-        count = len(pdf)
-        pdf.close()
-        return count
     except Exception as e:
-        return 0
-
-def get_matching_header_lvl(toc, title, threshold=80):
-    title_l = title.lower()
-    for toc_title in toc:
-        score = fuzz.partial_ratio(title_l, toc_title.lower())
-        if score >= threshold:
-            return "#" * toc[toc_title]
-    return ""
-
-def get_toc(file):
-    toc = {}
-    page_count = 0
-    with open(file, "rb") as fp:
-        try:
-            parser = PDFParser(fp)
-            document = PDFDocument(parser)
-
-            outlines = list(document.get_outlines())
-            if not outlines:
-                logger.debug("No outlines found.")
-
-            for (level, title, _, _, _) in outlines:
-                toc[title] = level
-            page_count = len(list(PDFPage.create_pages(document)))
-
-        except PDFNoOutlines:
+        logger.debug(f"Failed to open '{file_path}': {e}")
+        return probe
+
+    try:
+        probe["page_count"] = len(pdf)
+        for item in pdf.get_toc():
+            # Outline items are PdfBookmark objects from pypdfium2 v5, named tuples before
+            title = item.get_title() if hasattr(item, "get_title") else item.title
+            if title:
+                probe["toc"][title] = item.level + 1
+        if not probe["toc"]:
             logger.debug("No outlines found.")
-        except PDFSyntaxError:
-            logger.debug("Corrupted PDF or non-PDF file.")
-        finally:
+
+        for page_index in range(probe["page_count"]):
+            page = pdf[page_index]
             try:
-                parser.close()
-            except NameError:
-                pass  # nothing to do
-    return toc, page_count
-
-def load_pdf_pages(pdf_path):
-    pdf_pages = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            pdf_pages.append(page.extract_words(extra_attrs=["size", "fontname"]))
-    return pdf_pages
-
-def find_text_font_size(
+                text_objects = page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_TEXT], max_depth=2)
+                probe["text_pages"].append(next(text_objects, None) is not None)
+            finally:
+                page.close()
+    except Exception as e:
+        logger.debug(f"Failed to probe '{file_path}': {e}")
+    finally:
+        pdf.close()
+    return probe
+
+def normalize_title(title):
+    return " ".join(title.lower().split())
+
+class TocIndex:
+    """
+    Outline titles of a PDF preprocessed once for matching the section headers of the document against them.
+    """
+    def __init__(self, toc):
+        self.titles = [toc_title.lower() for toc_title in toc]
+        self.levels = list(toc.values())
+        self.exact = {}
+        for toc_ix, toc_title in enumerate(toc):
+            self.exact.setdefault(normalize_title(toc_title), toc_ix)
+
+    def match_levels(self, titles, threshold=80):
+        """
+        Returns the TOC level of every title, 0 for titles matching none of the TOC titles.
+        Titles equal to a TOC title once normalized are looked up directly, the rest are fuzzy matched in batches and
+        take the level of the first TOC title scoring above the threshold.
+        """
+        levels = [0] * len(titles)
+        fuzzy_ixs = []
+        for title_ix, title in enumerate(titles):
+            toc_ix = self.exact.get(normalize_title(title))
+            if toc_ix is not None:
+                levels[title_ix] = self.levels[toc_ix]
+            else:
+                fuzzy_ixs.append(title_ix)
+
+        if not self.titles:
+            return levels
+
+        # Batched to bound the score matrix for documents with thousands of headers & TOC titles
+        for start in range(0, len(fuzzy_ixs), TOC_MATCH_BATCH_SIZE):
+            batch = fuzzy_ixs[start:start + TOC_MATCH_BATCH_SIZE]
+            scores = process.cdist(
+                [titles[title_ix].lower() for title_ix in batch], self.titles, scorer=fuzz.partial_ratio, score_cutoff=threshold
+            )
+            matched = scores >= threshold
+            first_match = matched.argmax(axis=1)
+            for row, title_ix in enumerate(batch):
+                if matched[row, first_match[row]]:
+                    levels[title_ix] = self.levels[first_match[row]]
+        return levels
+
+def build_line_index(words):
+    """
+    Groups the words of a page into lines based on Y-coordinate, returns the lines with their text, lowercased text,
+    most common font size & name and bbox.
+    """
+    lines_dict = defaultdict(list)
+    for word in words:
+        if not all(k in word for k in ("text", "top", "x0", "x1", "bottom", "size", "fontname")):
+            continue  # skip incomplete word entries
+        top_key = round(word["top"], 1)
+        lines_dict[top_key].append(word)
+
+    lines = []
+    for line_words in lines_dict.values():
+        sorted_line = sorted(line_words, key=lambda w: w["x0"])
+        line_text = " ".join(w["text"] for w in sorted_line)
+
+        font_sizes = [w["size"] for w in sorted_line if w["size"] is not None]
+        font_names = [w["fontname"] for w in sorted_line if w["fontname"]]
+
+        lines.append({
+            "text": line_text,
+            "text_lower": line_text.lower(),
+            # Most common font size and name as representative
+            "font_size": Counter(font_sizes).most_common(1)[0][0] if font_sizes else None,
+            "font_name": Counter(font_names).most_common(1)[0][0] if font_names else None,
+            "bbox": (
+                min(w["x0"] for w in sorted_line),
+                min(w["top"] for w in sorted_line),
+                max(w["x1"] for w in sorted_line),
+                max(w["bottom"] for w in sorted_line),
+            ),
+        })
+    return lines
+
+class PdfPageLines:
+    """
+    Line index of the pages of a PDF built lazily, words are extracted only for the pages that are looked up
+    and the line index of the most recently used pages is kept in a bounded cache.
+    """
+    def __init__(self, pdf_path, text_pages=None, cache_size=PAGE_LINE_CACHE_SIZE):
+        self._pdf = pdfplumber.open(pdf_path)
+        self.text_pages = text_pages
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._pdf.pages)
+
+    def __getitem__(self, page_index):
+        if page_index in self._cache:
+            self._cache.move_to_end(page_index)
+            return self._cache[page_index]
+
+        lines = []
+        # Pages without a text layer as per text_pages have no words to extract
+        if self.text_pages is None or page_index >= len(self.text_pages) or self.text_pages[page_index]:
+            page = self._pdf.pages[page_index]
+            lines = build_line_index(page.extract_words(extra_attrs=["size", "fontname"]))
+            # Words are not needed once indexed, release the page's parsed objects
+            page.flush_cache()
+
+        self._cache[page_index] = lines
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return lines
+
+    def close(self):
+        self._pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_pdf_pages(pdf_path, text_pages=None):
+    """
+    Returns the lazily built line index of the pages, to be closed once done.
+    """
+    return PdfPageLines(pdf_path, text_pages)
+
+def find_text_font_sizes(
     pdf_pages: List,
-    search_string: str,
+    search_strings: List[str],
     page_number: int = 0,
     fuzz_threshold: float = 80,
     exact_match_first: bool = False
-) -> List[Dict[str, Any]]:
-    """ Searches for text in a PDF page and returns font info and bbox for fuzzy-matching lines. """
-    matches = []
+) -> List[List[Dict[str, Any]]]:
+    """ Searches for texts in a PDF page and returns font info and bbox of the fuzzy-matching lines of every text. """
+    matches = [[] for _ in search_strings]
 
     try:
         if page_number >= len(pdf_pages):
             logger.debug(f"Page {page_number} does not exist in PDF.")
-            return []
+            return matches
 
-        words = pdf_pages[page_number]
+        lines = pdf_pages[page_number]
 
-        if not words:
+        if not lines or not search_strings:
             logger.debug("No words found on page.")
-            return []
-
-        # Group words into lines based on Y-coordinate
-        lines_dict = defaultdict(list)
-        for word in words:
-            if not all(k in word for k in ("text", "top", "x0", "x1", "bottom", "size", "fontname")):
-                continue  # skip incomplete word entries
-            top_key = round(word["top"], 1)
-            lines_dict[top_key].append(word)
-
-        for line_words in lines_dict.values():
-            sorted_line = sorted(line_words, key=lambda w: w["x0"])
-            line_text = " ".join(w["text"] for w in sorted_line)
-
-            # Try exact match if enabled
-            if exact_match_first and search_string.lower() == line_text.lower():
-                score = 100
-            else:
-                score = fuzz.partial_ratio(line_text.lower(), search_string.lower())
+            return matches
 
-            if score >= fuzz_threshold:
-                font_sizes = [w["size"] for w in sorted_line if w["size"] is not None]
-                font_names = [w["fontname"] for w in sorted_line if w["fontname"]]
+        # Score every line of the page against all the search strings in one pass
+        search_lower = [search_string.lower() for search_string in search_strings]
+        scores = process.cdist(
+            [line["text_lower"] for line in lines], search_lower, scorer=fuzz.partial_ratio, score_cutoff=fuzz_threshold
+        )
+        if exact_match_first:
+            for line_ix, line in enumerate(lines):
+                for search_ix, search in enumerate(search_lower):
+                    if search == line["text_lower"]:
+                        scores[line_ix, search_ix] = 100
 
-                # Most common font size and name as representative
-                font_size = Counter(font_sizes).most_common(1)[0][0] if font_sizes else None
-                font_name = Counter(font_names).most_common(1)[0][0] if font_names else None
-
-                x0 = min(w["x0"] for w in sorted_line)
-                x1 = max(w["x1"] for w in sorted_line)
-                top = min(w["top"] for w in sorted_line)
-                bottom = max(w["bottom"] for w in sorted_line)
-
-                matches.append({
-                    "matched_text": line_text,
-                    "match_score": score,
-                    "font_size": font_size,
-                    "font_name": font_name,
-                    "bbox": (x0, top, x1, bottom)
-                })
+        for line_ix, search_ix in zip(*np.nonzero(scores >= fuzz_threshold)):
+            line = lines[line_ix]
+            matches[search_ix].append({
+                "matched_text": line["text"],
+                "match_score": float(scores[line_ix, search_ix]),
+                "font_size": line["font_size"],
+                "font_name": line["font_name"],
+                "bbox": line["bbox"]
+            })
 
     except Exception as e:
         logger.error(f"Error extracting font size: {e}")
 
     return matches
 
-def convert_doc(path):
-    doc_converter = get_doc_converter()
+def init_doc_converter():
+    """
+    Builds the docling converter and loads the PDF pipeline models, once per process.
+    """
+    global _doc_converter, _model_load_time, _model_load_pid
+    if _doc_converter is None:
+        from docling.datamodel.base_models import InputFormat
+
+        t0 = time.time()
+        doc_converter = get_doc_converter()
+        doc_converter.initialize_pipeline(InputFormat.PDF)
+        _doc_converter = doc_converter
+        _model_load_time = time.time() - t0
+        _model_load_pid = os.getpid()
+        logger.debug(f"Docling models loaded in {_model_load_time:.2f}s")
+    return _doc_converter
+
+def init_converter_worker():
+    """
+    Initializer of the converter pool processes, warms up the converter before the first document arrives.
+    """
+    try:
+        init_doc_converter()
+    except Exception as e:
+        # Failing here would break the whole pool, convert_doc retries loading the models per document
+        logger.error(f"Failed to load docling models in converter process: {e}")
+
+def pop_model_load_time():
+    """
+    Returns the model load time of the current process on the first call and 0.0 afterwards, so that it's reported once.
+    Converter inherited from the parent process on fork isn't reported by the child.
+    """
+    global _model_load_time
+    if _model_load_pid != os.getpid():
+        return 0.0
+    load_time, _model_load_time = _model_load_time, 0.0
+    return load_time
+
+def convert_doc(path, page_range=None):
+    doc_converter = init_doc_converter()
+    if page_range:
+        # page_range is 1-based & inclusive, page numbers of the converted document stay as in the original PDF
+        return doc_converter.convert(path, page_range=page_range)
     doc = doc_converter.convert(path)
     return doc
 
+def get_page_ranges(page_count, shard_size):
+    """
+    Splits the pages into consecutive 1-based inclusive (start, end) ranges of at most shard_size pages.
+    """
+    return [(start, min(start + shard_size - 1, page_count)) for start in range(1, page_count + 1, shard_size)]
+
 def get_doc_converter():
     from docling.datamodel.base_models import InputFormat
     from docling.datamodel.pipeline_options import PdfPipelineOptions
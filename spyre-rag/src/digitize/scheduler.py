@@ -0,0 +1,204 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import psutil
+
+from common.misc_utils import get_logger
+from digitize.pdf_utils import init_converter_worker, init_doc_converter
+
+logger = get_logger("scheduler")
+
+MB = 1024 ** 2
+GB = 1024 ** 3
+
+# Cores used by a single docling conversion, layout & table structure models run multi-threaded
+CONVERT_CORES_PER_WORKER = 2
+# Resident memory of a converter process once the docling models are loaded
+CONVERT_BASE_MEMORY = 2 * GB
+# Additional memory held by a conversion per page of the document
+CONVERT_PAGE_MEMORY = 4 * MB
+# Fraction of the available memory the ingestion is allowed to use
+MEMORY_BUDGET_FRACTION = 0.8
+
+# Relative weights used to estimate the cost of a document, costliest documents are started first
+PAGE_COST = 1.0
+TABLE_COST = 2.0
+MB_COST = 0.5
+
+# Start method of the converter processes once the parent runs other threads, forking it could deadlock the children
+THREADED_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_scheduler_instance = None
+
+def get_cpu_count():
+    """
+    Returns the number of cores available to the process, honouring the cpu affinity and the cgroup cpu quota.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def get_available_memory():
+    """
+    Returns the memory available to the process in bytes, honouring the cgroup memory limit.
+    """
+    available = psutil.virtual_memory().available
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        with open("/sys/fs/cgroup/memory.current") as f:
+            usage = int(f.read().strip())
+        if limit != "max":
+            available = min(available, int(limit) - usage)
+    except (OSError, ValueError):
+        pass
+    return max(available, 0)
+
+def estimate_cost(page_count, file_size, table_count=0):
+    return page_count * PAGE_COST + table_count * TABLE_COST + (file_size / MB) * MB_COST
+
+def estimate_conversion_memory(page_count):
+    return page_count * CONVERT_PAGE_MEMORY
+
+class IngestScheduler:
+    """
+    Long lived worker pools of the ingestion pipeline, sized from the host's cpu count and memory.
+    Conversions are admitted costliest first, as long as there is a free converter and the memory budget allows.
+    """
+    def __init__(self, convert_workers=None, worker_size=None, memory_budget=None, preload_models=True):
+        cpu_count = get_cpu_count()
+        self.memory_budget = memory_budget or int(get_available_memory() * MEMORY_BUDGET_FRACTION)
+        self.convert_workers = convert_workers or max(
+            1, min(cpu_count // CONVERT_CORES_PER_WORKER, self.memory_budget // CONVERT_BASE_MEMORY)
+        )
+        # Processing and chunking mostly wait on the LLM and tokenizer endpoints, hence not bound to the cores
+        self.worker_size = worker_size or max(4, cpu_count)
+        # Memory left for the documents once every converter process has loaded its models
+        self.document_memory_budget = max(self.memory_budget - self.convert_workers * CONVERT_BASE_MEMORY, 0)
+
+        self._lock = threading.Lock()
+        self._running_conversions = 0
+        self._reserved_memory = 0
+
+        # Loading the models in the parent before forking lets the converter processes share the read-only model
+        # memory copy-on-write, instead of every process loading its own copy
+        self.preload_models = preload_models and "fork" in multiprocessing.get_all_start_methods()
+        self.preload_time = 0.0
+        if self.preload_models:
+            t0 = time.time()
+            try:
+                init_doc_converter()
+                self.preload_time = time.time() - t0
+            except Exception as e:
+                logger.warning(f"Failed to preload docling models, converter processes will load them: {e}")
+                self.preload_models = False
+
+        self.converter_executor = self._create_converter_executor()
+        self.processor_executor = ThreadPoolExecutor(max_workers=self.worker_size)
+        self.chunker_executor = ThreadPoolExecutor(max_workers=self.worker_size)
+
+        logger.debug(
+            f"Scheduler: {cpu_count} cores, memory budget {self.memory_budget / GB:.1f} GB, "
+            f"{self.convert_workers} converter(s), {self.worker_size} processing & chunking workers"
+        )
+
+    def _create_converter_executor(self, start_method=None):
+        """
+        Creates the converter pool, forking the parent unless a start method is given. Forking is only safe while the
+        parent runs a single thread, a forked child could inherit locks held by the other threads.
+        """
+        if start_method is None:
+            if threading.active_count() > 1:
+                logger.warning(
+                    f"{threading.active_count()} threads are running, converter processes are started with the "
+                    f"{THREADED_START_METHOD} start method instead of forking"
+                )
+                start_method = THREADED_START_METHOD
+            elif self.preload_models:
+                start_method = "fork"
+        mp_context = multiprocessing.get_context(start_method) if start_method else None
+        executor = ProcessPoolExecutor(
+            max_workers=self.convert_workers, mp_context=mp_context, initializer=init_converter_worker
+        )
+        # Start the converter processes right away, ProcessPoolExecutor starts them on the first submit otherwise
+        executor.submit(os.getpid).result()
+        return executor
+
+    def pop_preload_time(self):
+        """
+        Returns the time taken to preload the models on the first call and 0.0 afterwards, so that it's reported once.
+        """
+        preload_time, self.preload_time = self.preload_time, 0.0
+        return preload_time
+
+    def next_conversions(self, pending):
+        """
+        Removes and returns the jobs that fit in the free converters and the memory budget.
+        pending: list of (job, memory) tuples ordered by decreasing cost; smaller jobs backfill the budget left by larger ones.
+        """
+        admitted = []
+        with self._lock:
+            for item in list(pending):
+                if self._running_conversions >= self.convert_workers:
+                    break
+                job, memory = item
+                # A job larger than the whole budget still runs once nothing else is converting
+                if self._running_conversions and self._reserved_memory + memory > self.document_memory_budget:
+                    continue
+                pending.remove(item)
+                self._running_conversions += 1
+                self._reserved_memory += memory
+                admitted.append((job, memory))
+        return admitted
+
+    def conversion_done(self, memory):
+        with self._lock:
+            self._running_conversions -= 1
+            self._reserved_memory -= memory
+
+    def submit_conversion(self, fn, *args):
+        try:
+            return self.converter_executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A converter process died (e.g. OOM killed), replace the pool so the remaining documents can proceed.
+            # Threads are running by now, the new processes are started from a clean interpreter rather than forked
+            # and load the models in init_converter_worker
+            logger.warning(f"Converter pool is broken, recreating it with the {THREADED_START_METHOD} start method")
+            self.converter_executor.shutdown(wait=False, cancel_futures=True)
+            self.converter_executor = self._create_converter_executor(THREADED_START_METHOD)
+            return self.converter_executor.submit(fn, *args)
+
+    def shutdown(self):
+        self.converter_executor.shutdown()
+        self.processor_executor.shutdown()
+        self.chunker_executor.shutdown()
+
+def get_scheduler() -> IngestScheduler:
+    """
+    Returns the scheduler shared by all ingestion runs of the process.
+    INGEST_CONVERT_WORKERS, INGEST_WORKER_SIZE and INGEST_MEMORY_BUDGET_GB override the automatic sizing,
+    DOCLING_PRELOAD_MODELS=false disables loading the models in the parent before forking the converter processes.
+    """
+    global _scheduler_instance
+    if _scheduler_instance is None:
+        memory_budget_gb = float(os.getenv("INGEST_MEMORY_BUDGET_GB", "0"))
+        _scheduler_instance = IngestScheduler(
+            convert_workers=int(os.getenv("INGEST_CONVERT_WORKERS", "0")),
+            worker_size=int(os.getenv("INGEST_WORKER_SIZE", "0")),
+            memory_budget=int(memory_budget_gb * GB),
+            preload_models=os.getenv("DOCLING_PRELOAD_MODELS", "true").lower() != "false",
+        )
+    return _scheduler_instance
@@ -61,7 +61,8 @@ def retrieve_documents(query, emb_model, emb_endpoint, max_tokens, vectorstore,
             "filename": hit.get("filename", ""),
             "type": hit.get("type", ""),
             "source": hit.get("source", ""),
-            "chunk_id": hit.get("chunk_id", "")
+            "chunk_id": hit.get("chunk_id", ""),
+            "token_count": hit.get("token_count")
         }
         retrieved_documents.append(doc)
 
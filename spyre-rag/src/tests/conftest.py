@@ -0,0 +1,68 @@
+import pytest
+
+
+def build_pdf(pages, outline=()):
+    """
+    Returns the bytes of a PDF whose pages hold the given lines of text, (text, font size, y) tuples, and whose
+    outline holds the (title, children) items.
+    """
+    objects = {}
+    page_ids = [4 + 2 * page_ix for page_ix in range(len(pages))]
+    next_id = 4 + 2 * len(pages)
+
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    for page_id, lines in zip(page_ids, pages):
+        content = b"".join(
+            b"BT /F1 %d Tf 72 %d Td (%s) Tj ET\n" % (size, y, text.encode("latin-1")) for text, size, y in lines
+        )
+        objects[page_id] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+            b"/Contents %d 0 R >>" % (page_id + 1)
+        )
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % i for i in page_ids), len(pages))
+
+    def add_items(items, parent_id):
+        nonlocal next_id
+        ids = list(range(next_id, next_id + len(items)))
+        next_id += len(items)
+        for ix, (item_id, (title, children)) in enumerate(zip(ids, items)):
+            entries = b"/Title (%s) /Parent %d 0 R /Dest [%d 0 R /Fit]" % (title.encode("latin-1"), parent_id, page_ids[0])
+            if ix > 0:
+                entries += b" /Prev %d 0 R" % ids[ix - 1]
+            if ix < len(ids) - 1:
+                entries += b" /Next %d 0 R" % ids[ix + 1]
+            if children:
+                child_ids = add_items(children, item_id)
+                entries += b" /First %d 0 R /Last %d 0 R /Count %d" % (child_ids[0], child_ids[-1], len(child_ids))
+            objects[item_id] = b"<< %s >>" % entries
+        return ids
+
+    catalog = b"<< /Type /Catalog /Pages 2 0 R"
+    if outline:
+        outline_id = next_id
+        next_id += 1
+        item_ids = add_items(list(outline), outline_id)
+        objects[outline_id] = b"<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>" % (item_ids[0], item_ids[-1], len(item_ids))
+        catalog += b" /Outlines %d 0 R" % outline_id
+    objects[1] = catalog + b" >>"
+
+    pdf = b"%PDF-1.4\n"
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(pdf)
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (obj_id, objects[obj_id])
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offsets[obj_id] for obj_id in sorted(objects))
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    def _make(pages, outline=(), name="doc.pdf"):
+        path = tmp_path / name
+        path.write_bytes(build_pdf(pages, outline))
+        return str(path)
+    return _make
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+import digitize.artifact_store as artifact_store
+from common.misc_utils import generate_file_checksum
+from digitize.artifact_store import ArtifactStore, STAGE_CONVERT, STAGE_PROBE, STAGE_TEXT
+
+
+@pytest.fixture
+def store(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    store = ArtifactStore(str(cache_dir))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def hashed_paths(monkeypatch):
+    paths = []
+    monkeypatch.setattr(artifact_store, "generate_file_checksum", lambda path: paths.append(path) or generate_file_checksum(path))
+    return paths
+
+
+def test_stages_are_recorded_per_document(store):
+    store.mark_done("hash-a", STAGE_PROBE, STAGE_CONVERT)
+    store.mark_done("hash-b", STAGE_PROBE)
+    assert store.get_stages(["hash-a", "hash-b", "hash-c"]) == {
+        "hash-a": {STAGE_PROBE, STAGE_CONVERT}, "hash-b": {STAGE_PROBE}, "hash-c": set()
+    }
+
+    store.invalidate("hash-a", STAGE_CONVERT)
+    assert store.get_stages(["hash-a"]) == {"hash-a": {STAGE_PROBE}}
+
+
+def test_stages_done_in_another_format_are_redone(monkeypatch, store):
+    store.mark_done("hash-a", STAGE_TEXT)
+    monkeypatch.setitem(artifact_store.STAGE_SUFFIXES, STAGE_TEXT, ".text.json")
+    assert store.get_stages(["hash-a"]) == {"hash-a": set()}
+
+
+def test_stages_recorded_without_suffix(store):
+    store._conn.execute(
+        "INSERT INTO stages (content_hash, stage, updated_at) VALUES (?, ?, 0), (?, ?, 0)",
+        ("hash-a", STAGE_TEXT, "hash-b", STAGE_TEXT)
+    )
+    # Stages recorded before the suffix was tracked count only if their artifact exists in the current format
+    artifact_store.artifact_path(store.artifact_dir("hash-a"), artifact_store.STAGE_SUFFIXES[STAGE_TEXT]).write_text("")
+    assert store.get_stages(["hash-a", "hash-b"]) == {"hash-a": {STAGE_TEXT}, "hash-b": set()}
+
+
+def write_file(path, content, mtime_ns=None):
+    path.write_bytes(content)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_unchanged_files_are_hashed_once(tmp_path, store, hashed_paths):
+    path = write_file(tmp_path / "a.pdf", b"first")
+    hashes = store.content_hashes([path, path])
+    assert hashes == {path: generate_file_checksum(path)}
+    assert store.content_hashes([path]) == hashes
+    assert hashed_paths == [path]
+
+
+def test_hashes_are_persisted(tmp_path, store, hashed_paths):
+    path = write_file(tmp_path / "a.pdf", b"first")
+    hashes = store.content_hashes([path])
+    reopened = ArtifactStore(store.cache_dir)
+    try:
+        assert reopened.content_hashes([path]) == hashes
+    finally:
+        reopened.close()
+    assert hashed_paths == [path]
+
+
+def test_files_are_hashed_again_once_modified(tmp_path, store, hashed_paths):
+    path = write_file(tmp_path / "a.pdf", b"first", mtime_ns=1_000_000_000)
+    first_hash = store.content_hashes([path])[path]
+
+    # Same size, rewritten later
+    write_file(tmp_path / "a.pdf", b"other", mtime_ns=2_000_000_000)
+    second_hash = store.content_hashes([path])[path]
+    assert second_hash != first_hash
+
+    # Same mtime, another size
+    write_file(tmp_path / "a.pdf", b"longer content", mtime_ns=2_000_000_000)
+    assert store.content_hashes([path])[path] == generate_file_checksum(path)
+    assert hashed_paths == [path, path, path]
+
+
+def test_files_are_hashed_again_once_touched(tmp_path, store, hashed_paths):
+    path = write_file(tmp_path / "a.pdf", b"first", mtime_ns=1_000_000_000)
+    first_hash = store.content_hashes([path])[path]
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    assert store.content_hashes([path])[path] == first_hash
+    assert hashed_paths == [path, path]
+
+
+def test_files_are_hashed_again_once_replaced(tmp_path, store, hashed_paths):
+    path = write_file(tmp_path / "a.pdf", b"first", mtime_ns=1_000_000_000)
+    store.content_hashes([path])
+
+    # Replaced by another file of the same size & mtime, only the inode tells them apart
+    replacement = write_file(tmp_path / "b.pdf", b"other", mtime_ns=1_000_000_000)
+    os.replace(replacement, path)
+    assert store.content_hashes([path])[path] == generate_file_checksum(path)
+    assert hashed_paths == [path, path]
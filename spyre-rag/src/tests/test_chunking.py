@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+import digitize.doc_utils as doc_utils
+from common.tokenizer_utils import Tokenizer
+
+FONT_SIZES = [20.0, 16.0, 12.0]
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+
+
+class WordTokenizer(Tokenizer):
+    model_id = "words"
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer(monkeypatch):
+    monkeypatch.setattr(doc_utils, "get_emb_tokenizer", lambda endpoint: WordTokenizer())
+    monkeypatch.setattr(doc_utils, "get_token_cache", lambda: None)
+
+
+def random_text(rng):
+    sentences = [" ".join(rng.choices(WORDS, k=rng.randint(3, 12))).capitalize() + "." for _ in range(rng.randint(1, 6))]
+    return " ".join(sentences)
+
+
+def random_blocks(rng):
+    blocks = []
+    page_no = 1
+    for _ in range(rng.randint(1, 60)):
+        page_no += rng.random() < 0.2
+        kind = rng.random()
+        if kind < 0.2:
+            block = {"label": "section_header", "text": random_text(rng)[:40], "font_size": rng.choice(FONT_SIZES)}
+        elif kind < 0.35:
+            # Empty blocks still carry a page & source node
+            block = {"label": "text", "text": rng.choice(["", "   "])}
+        elif kind < 0.4:
+            block = {"label": rng.choice(["code", "formula", "list_item"]), "text": random_text(rng)}
+        elif kind < 0.45:
+            block = {"label": "page_footer", "text": random_text(rng)}
+        else:
+            block = {"label": "text", "text": random_text(rng)}
+        block["prov"] = [{"page_no": page_no}]
+        blocks.append(block)
+    return blocks
+
+
+def chunk_both(blocks):
+    serial = list(doc_utils.iter_chunks(enumerate(blocks), FONT_SIZES, "emb", 40))
+    parallel = list(doc_utils.iter_chunks_parallel(enumerate(blocks), FONT_SIZES, "emb", 40, max_workers=3))
+    return serial, parallel
+
+
+def test_empty_block_before_chapter():
+    blocks = [
+        {"label": "section_header", "text": "Chapter one", "font_size": 20.0, "prov": [{"page_no": 1}]},
+        {"label": "text", "text": "First chapter body.", "prov": [{"page_no": 1}]},
+        {"label": "section_header", "text": "Section", "font_size": 16.0, "prov": [{"page_no": 2}]},
+        {"label": "text", "text": "", "prov": [{"page_no": 2}]},
+        {"label": "section_header", "text": "Chapter two", "font_size": 20.0, "prov": [{"page_no": 3}]},
+        {"label": "text", "text": "Second chapter body.", "prov": [{"page_no": 3}]},
+    ]
+    serial, parallel = chunk_both(blocks)
+    assert serial == parallel
+    assert serial[-1]["source_nodes"] == ["#texts/5"]
+    assert serial[-1]["page_range"] == [3]
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_parallel_matches_serial(seed):
+    serial, parallel = chunk_both(random_blocks(random.Random(seed)))
+    assert serial == parallel
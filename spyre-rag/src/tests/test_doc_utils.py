@@ -0,0 +1,69 @@
+import pytest
+from docling_core.types.doc import BoundingBox, DocItemLabel, DoclingDocument, ProvenanceItem, Size
+
+import digitize.doc_utils as doc_utils
+from common.misc_utils import probe_suffix
+from digitize.artifact_store import artifact_path
+from digitize.doc_utils import load_converted_doc, load_pdf_probe, merge_converted_shards
+
+
+def shard(page_range, pages, texts):
+    doc = DoclingDocument(name="doc")
+    for page_no in pages:
+        doc.add_page(page_no=page_no, size=Size(width=100, height=100))
+    for page_no, text in texts:
+        prov = ProvenanceItem(page_no=page_no, bbox=BoundingBox(l=0, t=0, r=1, b=1), charspan=(0, len(text)))
+        doc.add_text(label=DocItemLabel.TEXT, text=text, prov=prov)
+    return page_range, doc
+
+
+def text_pages(doc):
+    return [(item.text, item.prov[0].page_no) for item in doc.texts]
+
+
+def test_merge_keeps_page_numbers(tmp_path):
+    shards = [
+        shard((1, 3), [1, 2, 3], [(1, "one"), (3, "three")]),
+        shard((4, 6), [4, 5, 6], [(5, "five")]),
+    ]
+    _, path, _, merged = merge_converted_shards("doc.pdf", shards, tmp_path, 0.0)
+    assert text_pages(merged) == [("one", 1), ("three", 3), ("five", 5)]
+    assert sorted(merged.pages) == [1, 2, 3, 4, 5, 6]
+    assert text_pages(load_converted_doc(path)) == text_pages(merged)
+
+
+def test_merge_shards_missing_boundary_pages(tmp_path):
+    # Neither the first page of the first shard, the last page of the second nor the first page of the third are present
+    shards = [
+        shard((1, 3), [2, 3], [(2, "two")]),
+        shard((4, 6), [4, 5], [(5, "five")]),
+        shard((7, 9), [8, 9], [(8, "eight"), (9, "nine")]),
+    ]
+    _, _, _, merged = merge_converted_shards("doc.pdf", shards, tmp_path, 0.0)
+    assert text_pages(merged) == [("two", 2), ("five", 5), ("eight", 8), ("nine", 9)]
+    assert sorted(merged.pages) == [2, 3, 4, 5, 8, 9]
+
+
+def test_merge_rejects_pages_out_of_the_shard_range(tmp_path):
+    # A shard numbered from 1 instead of its first page can't be placed in the document
+    shards = [shard((1, 2), [1, 2], [(1, "one")]), shard((3, 4), [1, 2], [(1, "three")])]
+    with pytest.raises(ValueError):
+        merge_converted_shards("doc.pdf", shards, tmp_path, 0.0)
+
+
+def test_pdf_probe_is_cached(monkeypatch, make_pdf, tmp_path):
+    path = make_pdf([[("Body", 12, 700)]])
+    probed = []
+    probe_pdf = doc_utils.probe_pdf
+    monkeypatch.setattr(doc_utils, "probe_pdf", lambda pdf_path: probed.append(pdf_path) or probe_pdf(pdf_path))
+
+    probe = load_pdf_probe(path, tmp_path)
+    assert probe["page_count"] == 1
+    assert load_pdf_probe(path, tmp_path) == probe
+    assert probed == [path]
+
+    # Probed again when the stage is to be re-run or the cached probe can't be read
+    load_pdf_probe(path, tmp_path, refresh=True)
+    artifact_path(tmp_path, probe_suffix).write_text("{")
+    assert load_pdf_probe(path, tmp_path) == probe
+    assert probed == [path, path, path]
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from common.emb_utils import PcaProjection, TruncateProjection, estimate_tokens, iter_token_batches, project
+
+
+def test_batches_stay_within_the_token_budget():
+    batches = list(iter_token_batches([3, 4, 2, 5, 1], lambda item: item, token_budget=7, max_size=10))
+    assert batches == [[3, 4], [2, 5], [1]]
+
+
+def test_batches_are_capped_in_size():
+    batches = list(iter_token_batches([1] * 5, lambda item: item, token_budget=100, max_size=2))
+    assert batches == [[1, 1], [1, 1], [1]]
+
+
+def test_item_over_the_budget_makes_its_own_batch():
+    batches = list(iter_token_batches([2, 10, 3], lambda item: item, token_budget=5, max_size=10))
+    assert batches == [[2], [10], [3]]
+
+
+def test_no_items_no_batches():
+    assert list(iter_token_batches([], lambda item: item)) == []
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens(None) == 1
+    assert estimate_tokens("a" * 40) == 11
+
+
+def sample_vectors(count=32, dim=8):
+    return np.random.default_rng(0).normal(size=(count, dim)).astype(np.float32)
+
+
+def test_pca_projection_round_trips_through_dict():
+    vectors = sample_vectors()
+    projection = PcaProjection.fit(vectors, 3)
+    loaded = PcaProjection.from_dict(projection.to_dict())
+    assert (loaded.dimension, loaded.components.shape) == (3, (3, 8))
+    np.testing.assert_array_equal(loaded.mean, projection.mean)
+    np.testing.assert_array_equal(loaded.components, projection.components)
+    np.testing.assert_array_equal(loaded.apply(vectors), projection.apply(vectors))
+
+
+def test_pca_projection_is_normalized():
+    projected = PcaProjection.fit(sample_vectors(), 3).apply(sample_vectors()[:4])
+    assert np.asarray(projected).shape == (4, 3)
+    np.testing.assert_allclose(np.linalg.norm(projected, axis=1), 1.0, rtol=1e-5)
+
+
+def test_pca_needs_as_many_samples_as_dimensions():
+    with pytest.raises(ValueError):
+        PcaProjection.fit(sample_vectors(count=2), 3)
+
+
+def test_truncate_projection():
+    np.testing.assert_allclose(TruncateProjection(2).apply([[3.0, 4.0, 12.0]]), [[0.6, 0.8]], rtol=1e-6)
+
+
+def test_project_without_projection_keeps_the_vectors():
+    vectors = [[1.0, 2.0]]
+    assert project(vectors) is vectors
+    assert project([], TruncateProjection(1)) == []
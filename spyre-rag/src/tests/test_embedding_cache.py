@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import pytest
+
+from common.emb_utils import TruncateProjection
+from common.embedding_cache import EmbeddingCache, embed_with_cache
+
+
+def vector(seed, dim=4):
+    return np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "embeddings")
+
+
+@pytest.fixture
+def cache(cache_dir):
+    cache = EmbeddingCache(cache_dir)
+    yield cache
+    cache.close()
+
+
+def matrix_path(cache_dir, dim=4):
+    return os.path.join(cache_dir, f"vectors_{dim}.f32")
+
+
+def assert_vectors(cached, expected):
+    assert cached.keys() == expected.keys()
+    for text, expected_vector in expected.items():
+        np.testing.assert_array_equal(cached[text], expected_vector)
+
+
+def test_get_many_returns_cached_vectors(cache):
+    cache.put_many("model", 511, ["alpha", "beta"], [vector(0), vector(1)])
+    cache.put_many("model", 511, ["gamma"], [vector(2, dim=8)])
+    assert_vectors(
+        cache.get_many("model", 511, ["alpha", "gamma", "delta", "alpha"]), {"alpha": vector(0), "gamma": vector(2, dim=8)}
+    )
+    assert (cache.lookups, cache.hits) == (3, 2)
+
+
+def test_vectors_are_keyed_by_model_and_truncation(cache):
+    cache.put_many("model", 511, ["alpha"], [vector(0)])
+    assert cache.get_many("other-model", 511, ["alpha"]) == {}
+    assert cache.get_many("model", 255, ["alpha"]) == {}
+
+
+def test_vectors_persist(cache_dir, cache):
+    cache.put_many("model", 511, ["alpha", "beta"], [vector(0), vector(1)])
+    cache.close()
+    reopened = EmbeddingCache(cache_dir)
+    try:
+        assert_vectors(reopened.get_many("model", 511, ["alpha", "beta"]), {"alpha": vector(0), "beta": vector(1)})
+    finally:
+        reopened.close()
+
+
+def test_partial_row_is_cut_off_on_open(cache_dir, cache):
+    cache.put_many("model", 511, ["alpha", "beta"], [vector(0), vector(1)])
+    cache.close()
+    # Crash while appending: the matrix ends with half a row, beta's row was never completely written
+    with open(matrix_path(cache_dir), "r+b") as f:
+        f.truncate(os.path.getsize(matrix_path(cache_dir)) - 6)
+
+    reopened = EmbeddingCache(cache_dir)
+    try:
+        assert os.path.getsize(matrix_path(cache_dir)) == 4 * 4
+        assert_vectors(reopened.get_many("model", 511, ["alpha", "beta"]), {"alpha": vector(0)})
+
+        reopened.put_many("model", 511, ["beta", "gamma"], [vector(1), vector(2)])
+        assert_vectors(
+            reopened.get_many("model", 511, ["alpha", "beta", "gamma"]),
+            {"alpha": vector(0), "beta": vector(1), "gamma": vector(2)}
+        )
+    finally:
+        reopened.close()
+
+
+def test_partial_row_is_cut_off_before_appending(cache_dir, cache):
+    cache.put_many("model", 511, ["alpha"], [vector(0)])
+    cache.get_many("model", 511, ["alpha"])
+    # Unindexed partial row left by a failed append of another process
+    with open(matrix_path(cache_dir), "ab") as f:
+        f.write(b"\0" * 6)
+
+    cache.put_many("model", 511, ["beta"], [vector(1)])
+    assert os.path.getsize(matrix_path(cache_dir)) == 2 * 4 * 4
+    assert_vectors(cache.get_many("model", 511, ["alpha", "beta"]), {"alpha": vector(0), "beta": vector(1)})
+
+
+def test_vectors_missing_from_the_matrix_are_misses(cache_dir, cache):
+    cache.put_many("model", 511, ["alpha"], [vector(0)])
+    cache.close()
+    os.remove(matrix_path(cache_dir))
+    open(matrix_path(cache_dir), "wb").close()
+
+    reopened = EmbeddingCache(cache_dir)
+    try:
+        assert reopened.get_many("model", 511, ["alpha"]) == {}
+    finally:
+        reopened.close()
+
+
+class FakeEmbedder:
+    emb_model = "model"
+    truncate_prompt_tokens = 511
+
+    def __init__(self):
+        self.requests = []
+
+    def embed_raw(self, texts):
+        self.requests.append(list(texts))
+        return [vector(len(text)) for text in texts]
+
+
+def test_embed_with_cache_embeds_the_missing_texts_once(cache):
+    embedder = FakeEmbedder()
+    cache.put_many("model", 511, ["a"], [vector(1)])
+    vectors = embed_with_cache(embedder, ["a", "bb", "bb", "ccc"], cache)
+    assert embedder.requests == [["bb", "ccc"]]
+    np.testing.assert_allclose(vectors, [vector(1), vector(2), vector(2), vector(3)])
+
+    embed_with_cache(embedder, ["bb", "ccc"], cache)
+    assert embedder.requests == [["bb", "ccc"]]
+
+
+def test_embed_with_cache_projects_the_raw_vectors(cache):
+    embedder = FakeEmbedder()
+    raw = embed_with_cache(embedder, ["aaaa"], cache)
+    projected = embed_with_cache(embedder, ["aaaa"], cache, TruncateProjection(2))
+    np.testing.assert_allclose(projected[0], raw[0][:2] / np.linalg.norm(raw[0][:2]), rtol=1e-6)
+    # The cache keeps the raw vectors whatever the projection
+    np.testing.assert_allclose(cache.get_many("model", 511, ["aaaa"])["aaaa"], raw[0])
+
+
+def test_embed_without_cache():
+    embedder = FakeEmbedder()
+    assert len(embed_with_cache(embedder, ["a", "b"])) == 2
+    assert embedder.requests == [["a", "b"]]
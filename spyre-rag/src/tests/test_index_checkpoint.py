@@ -0,0 +1,50 @@
+import pytest
+
+from common.index_checkpoint import IndexCheckpoint
+from digitize.ingest import resumable_chunks
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    checkpoint = IndexCheckpoint(str(tmp_path))
+    yield checkpoint
+    checkpoint.close()
+
+
+def chunks(doc_id, content_hash, indexes):
+    return [{"doc_id": doc_id, "content_hash": content_hash, "chunk_index": index} for index in indexes]
+
+
+def test_committed_chunks_per_version(checkpoint):
+    checkpoint.commit(chunks("doc-a", "v1", [0, 1]) + chunks("doc-a", "v2", [0]) + [{"page_content": "unversioned"}])
+    checkpoint.commit(chunks("doc-a", "v1", [1, 2]))
+    assert checkpoint.committed("doc-a", "v1") == {0, 1, 2}
+    assert checkpoint.committed("doc-a", "v2") == {0}
+    assert checkpoint.committed("doc-b", "v1") == set()
+
+
+def test_discard_keeps_one_version(checkpoint):
+    checkpoint.commit(chunks("doc-a", "v1", [0, 1]) + chunks("doc-a", "v2", [0]) + chunks("doc-b", "v1", [0]))
+    checkpoint.discard("doc-a", "v2")
+    assert (checkpoint.committed("doc-a", "v1"), checkpoint.committed("doc-a", "v2")) == (set(), {0})
+    checkpoint.discard("doc-a")
+    assert checkpoint.committed("doc-a", "v2") == set()
+    assert checkpoint.committed("doc-b", "v1") == {0}
+
+
+def test_resume_committed_chunks(checkpoint):
+    checkpoint.commit(chunks("doc-a", "v1", [0, 1]) + chunks("doc-a", "v0", [0, 1, 2]))
+    assert resumable_chunks(checkpoint, "doc-a", "v1", indexed_chunk_count=2) == {0, 1}
+    # Chunks of the other versions are forgotten
+    assert checkpoint.committed("doc-a", "v0") == set()
+
+
+def test_committed_chunks_missing_from_the_index_are_not_resumed(checkpoint):
+    # The index was cleaned, or lost some chunks, since they were committed
+    checkpoint.commit(chunks("doc-a", "v1", [0, 1, 2]))
+    assert resumable_chunks(checkpoint, "doc-a", "v1", indexed_chunk_count=1) == set()
+    assert checkpoint.committed("doc-a", "v1") == set()
+
+
+def test_nothing_to_resume(checkpoint):
+    assert resumable_chunks(checkpoint, "doc-a", "v1", indexed_chunk_count=0) == set()
@@ -0,0 +1,72 @@
+from digitize.indexer import ChunkIndexer
+
+
+class FakeVectorStore:
+    def __init__(self, failing_chunks=(), error=None):
+        self.failing_chunks = set(failing_chunks)
+        self.error = error
+        self.indexed = []
+        self.deleted = []
+
+    def delete_documents(self, documents, keep_content_hashes=None):
+        self.deleted.append(documents)
+
+    def insert_chunks(self, chunks, embedder=None, embedding_cache=None, checkpoint=None, on_failed_chunks=None):
+        for chunk in chunks:
+            if self.error is not None:
+                raise self.error
+            if chunk["page_content"] in self.failing_chunks:
+                on_failed_chunks([chunk])
+            else:
+                self.indexed.append(chunk["page_content"])
+        return len(self.indexed)
+
+
+def chunks(doc_path, count):
+    return ({"filename": doc_path, "page_content": f"{doc_path} {i}"} for i in range(count))
+
+
+def test_chunks_are_indexed_in_document_order():
+    store = FakeVectorStore()
+    indexer = ChunkIndexer(store, embedder=None, queue_size=2)
+    indexer.add_document("a.pdf", chunks("a.pdf", 3), stale_documents={"doc-a": "a.pdf"})
+    indexer.add_document("b.pdf", chunks("b.pdf", 2))
+    indexer.close()
+    assert store.indexed == ["a.pdf 0", "a.pdf 1", "a.pdf 2", "b.pdf 0", "b.pdf 1"]
+    assert store.deleted == [{"doc-a": "a.pdf"}]
+    assert (indexer.indexed_chunks, indexer.failed_documents, indexer.error) == (5, set(), None)
+
+
+def test_failed_chunks_fail_their_document_only():
+    store = FakeVectorStore(failing_chunks={"b.pdf 1"})
+    indexer = ChunkIndexer(store, embedder=None)
+    for doc_path in ("a.pdf", "b.pdf", "c.pdf"):
+        indexer.add_document(doc_path, chunks(doc_path, 2))
+    indexer.close()
+    assert indexer.error is None
+    assert indexer.failed_documents == {"b.pdf"}
+    assert indexer.indexed_chunks == 5
+
+
+def test_unreadable_chunks_fail_their_document():
+    def broken_chunks():
+        yield {"filename": "a.pdf", "page_content": "a.pdf 0"}
+        raise OSError("truncated artifact")
+
+    store = FakeVectorStore()
+    indexer = ChunkIndexer(store, embedder=None)
+    indexer.add_document("a.pdf", broken_chunks())
+    indexer.add_document("b.pdf", chunks("b.pdf", 1))
+    indexer.close()
+    assert (indexer.failed_documents, indexer.error) == ({"a.pdf"}, None)
+    assert store.indexed == ["a.pdf 0", "b.pdf 0"]
+
+
+def test_indexing_error_fails_the_remaining_documents():
+    store = FakeVectorStore(error=ConnectionError("OpenSearch unreachable"))
+    indexer = ChunkIndexer(store, embedder=None, queue_size=1)
+    for doc_path in ("a.pdf", "b.pdf", "c.pdf"):
+        indexer.add_document(doc_path, chunks(doc_path, 3))
+    indexer.close()
+    assert isinstance(indexer.error, ConnectionError)
+    assert indexer.indexed_chunks == 0
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+
+import common.llm_utils as llm_utils
+import common.tokenizer_utils as tokenizer_utils
+from common.tokenizer_utils import Tokenizer
+
+
+class CountingWordTokenizer(Tokenizer):
+    def __init__(self):
+        self.counted = []
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+    def count(self, text):
+        self.counted.append(text)
+        return super().count(text)
+
+
+@pytest.fixture
+def tokenizer(monkeypatch):
+    tokenizer = CountingWordTokenizer()
+    monkeypatch.setattr(tokenizer_utils, "get_llm_tokenizer", lambda endpoint: tokenizer)
+    return tokenizer
+
+
+def set_budget(monkeypatch, budget, template_tokens=10):
+    monkeypatch.setattr(llm_utils, "settings", SimpleNamespace(
+        max_input_length=budget + template_tokens, prompt_template_token_count=template_tokens
+    ))
+
+
+def doc(text, token_count=None):
+    document = {"page_content": text}
+    if token_count is not None:
+        document["token_count"] = token_count
+    return document
+
+
+def test_fits_without_tokenizing(monkeypatch, tokenizer):
+    set_budget(monkeypatch, 100)
+    documents = [doc("a b c", 3), doc("d e", 2)]
+    assert llm_utils.pack_context("why", documents, "llm") == "a b c\n\nd e"
+    assert tokenizer.counted == []
+
+
+def test_counts_missing_token_counts(monkeypatch, tokenizer):
+    set_budget(monkeypatch, 100)
+    documents = [doc("a b c", 3), doc("d e")]
+    assert llm_utils.pack_context("why", documents, "llm") == "a b c\n\nd e"
+    assert tokenizer.counted == ["why", "d e"]
+
+
+def test_trims_only_the_last_document(monkeypatch, tokenizer):
+    # question: 1 token, first document: 3 tokens + 1 separator, leaves 2 tokens for the second document
+    set_budget(monkeypatch, 7)
+    documents = [doc("a b c", 3), doc("d e f g", 4), doc("h", 1)]
+    assert llm_utils.pack_context("why", documents, "llm") == "a b c\n\nd e"
+    assert tokenizer.counted == ["why"]
+
+
+def test_drops_documents_past_the_budget(monkeypatch, tokenizer):
+    # question: 2 tokens, first document: 4 tokens + 1 separator, nothing left for the second document
+    set_budget(monkeypatch, 7)
+    documents = [doc("a b c d", 4), doc("e f", 2)]
+    assert llm_utils.pack_context("why not", documents, "llm") == "a b c d"
+
+
+def test_question_over_the_budget(monkeypatch, tokenizer):
+    set_budget(monkeypatch, 2)
+    assert llm_utils.pack_context("why not now", [doc("a", 1)], "llm") == ""
@@ -0,0 +1,178 @@
+import pytest
+
+import common.misc_utils as misc_utils
+import common.opensearch as opensearch
+from common.opensearch import OpensearchVectorStore
+
+
+class FakeIndices:
+    def __init__(self):
+        self.calls = []
+        self.exists_index = True
+        self.settings = {"refresh_interval": "5s", "number_of_shards": "1"}
+        self.meta = {"vector_encoding": "float32"}
+
+    def exists(self, index):
+        return self.exists_index
+
+    def get_settings(self, index, name=None):
+        return {index: {"settings": {"index": dict(self.settings, uuid="uuid-1")}}}
+
+    def get_mapping(self, index):
+        return {index: {"mappings": {"_meta": self.meta}}}
+
+    def put_settings(self, index, body):
+        self.calls.append(("put_settings", body["index"]))
+
+    def refresh(self, index):
+        self.calls.append(("refresh",))
+
+
+class FakeSearchPipeline:
+    def put(self, id, body):
+        pass
+
+
+class FakeClient:
+    def __init__(self):
+        self.indices = FakeIndices()
+        self.search_pipeline = FakeSearchPipeline()
+        self.deleted = {}
+        self.delete_calls = []
+
+    def delete_by_query(self, index, body, conflicts, refresh):
+        self.delete_calls.append((body["query"], refresh))
+        doc_id = body["query"]["bool"]["should"][0]["term"]["doc_id"]
+        return {"deleted": self.deleted.get(doc_id, 0)}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    client = FakeClient()
+    monkeypatch.setattr(opensearch, "OpenSearch", lambda **kwargs: client)
+    monkeypatch.setattr(misc_utils, "LOCAL_CACHE_DIR", str(tmp_path))
+    return client
+
+
+@pytest.fixture
+def store(client):
+    return OpensearchVectorStore(index_name="test")
+
+
+def test_bulk_ingest_disables_refresh_and_replicas(monkeypatch, client, store):
+    monkeypatch.setattr(opensearch, "OPENSEARCH_BULK_INGEST", True)
+    with store.bulk_ingest():
+        assert client.indices.calls == [("put_settings", {"refresh_interval": "-1", "number_of_replicas": 0})]
+    # Settings that weren't set explicitly are restored to their defaults
+    assert client.indices.calls[1:] == [
+        ("put_settings", {"refresh_interval": "5s", "number_of_replicas": None}), ("refresh",)
+    ]
+
+
+def test_interrupted_bulk_ingest_restores_the_original_settings(monkeypatch, client, store):
+    monkeypatch.setattr(opensearch, "OPENSEARCH_BULK_INGEST", True)
+    store._apply_bulk_settings()
+    # Next ingestion reads the settings left by the interrupted one, not the bulk ingest settings
+    client.indices.settings = {"refresh_interval": "-1", "number_of_replicas": "0"}
+    with OpensearchVectorStore(index_name="test").bulk_ingest():
+        pass
+    assert client.indices.calls[-2:] == [
+        ("put_settings", {"refresh_interval": "5s", "number_of_replicas": None}), ("refresh",)
+    ]
+
+
+def test_bulk_ingest_disabled(monkeypatch, client, store):
+    monkeypatch.setattr(opensearch, "OPENSEARCH_BULK_INGEST", False)
+    with store.bulk_ingest():
+        pass
+    assert client.indices.calls == []
+
+
+def test_delete_documents_refreshes_once(client, store):
+    client.deleted = {"doc-a": 3, "doc-b": 2}
+    assert store.delete_documents({"doc-a": "a.pdf", "doc-b": "b.pdf", "doc-c": "c.pdf"}, {"doc-b": "hash-b"}) == 5
+    assert [refresh for _, refresh in client.delete_calls] == [False, False, False]
+    assert client.delete_calls[1][0]["bool"]["must_not"] == [{"term": {"content_hash": "hash-b"}}]
+    assert client.indices.calls == [("refresh",)]
+
+
+def test_delete_documents_leaves_the_refresh_to_the_bulk_ingest(client, store):
+    client.deleted = {"doc-a": 3}
+    store._bulk_ingest = True
+    store.delete_documents({"doc-a": "a.pdf"})
+    assert client.indices.calls == []
+
+
+def bulk_actions(count):
+    return [{"_index": "test", "_id": str(i), "_source": {}} for i in range(count)]
+
+
+def fake_streaming_bulk(statuses):
+    """
+    Fails the actions with the status of their id in the next entry of statuses, on every call.
+    """
+    attempts = []
+
+    def _streaming_bulk(client, actions, **kwargs):
+        attempts.append([action["_id"] for action in actions])
+        failures = statuses[len(attempts) - 1]
+        for action in actions:
+            if action["_id"] in failures:
+                yield False, {"index": {"_id": action["_id"], "status": failures[action["_id"]], "error": "failed"}}
+
+    return attempts, _streaming_bulk
+
+
+def test_bulk_retries_transient_failures_only(monkeypatch, store):
+    attempts, streaming_bulk = fake_streaming_bulk([{"1": 503, "2": 400, "3": "N/A"}, {"3": 502}, {}])
+    monkeypatch.setattr(opensearch.helpers, "streaming_bulk", streaming_bulk)
+    monkeypatch.setattr(opensearch.time, "sleep", lambda seconds: None)
+
+    indexed_ids, failed = store._bulk(bulk_actions(5))
+    assert attempts == [["0", "1", "2", "3", "4"], ["1", "3"], ["3"]]
+    assert indexed_ids == ["0", "1", "3", "4"]
+    assert [item["index"]["_id"] for item in failed] == ["2"]
+
+
+def test_bulk_gives_up_after_the_max_retries(monkeypatch, store):
+    monkeypatch.setattr(opensearch, "OPENSEARCH_BULK_MAX_RETRIES", 2)
+    attempts, streaming_bulk = fake_streaming_bulk([{"0": 503}] * 3)
+    monkeypatch.setattr(opensearch.helpers, "streaming_bulk", streaming_bulk)
+    sleeps = []
+    monkeypatch.setattr(opensearch.time, "sleep", sleeps.append)
+
+    indexed_ids, failed = store._bulk(bulk_actions(2))
+    assert attempts == [["0", "1"], ["0"], ["0"]]
+    assert sleeps == [opensearch.BULK_INITIAL_BACKOFF, opensearch.BULK_INITIAL_BACKOFF * 2]
+    assert (indexed_ids, [item["index"]["_id"] for item in failed]) == (["1"], ["0"])
+
+
+def test_calibrate_byte_scale_maps_the_percentile_to_127(monkeypatch):
+    monkeypatch.setattr(opensearch, "BYTE_CALIBRATION_PERCENTILE", 100)
+    assert opensearch.calibrate_byte_scale([[0.5, -0.25], [0.1, 0.0]]) == pytest.approx(254.0)
+    assert opensearch.calibrate_byte_scale([[0.0, 0.0]]) == 127.0
+
+
+def test_encode_vector_byte_scales_rounds_and_clips():
+    assert opensearch.encode_vector([0.5, -0.5, 0.126, 2.0, -2.0], "byte", scale=254.0) == [127, -127, 32, 127, -128]
+
+
+def test_encode_vector_fp16_normalizes():
+    encoded = opensearch.encode_vector([3.0, 4.0], "fp16")
+    assert encoded == pytest.approx([0.6, 0.8], abs=1e-3)
+    assert opensearch.encode_vector([0.0, 0.0], "fp16") == [0.0, 0.0]
+
+
+def test_encode_vector_float32_is_unchanged():
+    assert opensearch.encode_vector([0.1, -2.5], "float32") == pytest.approx([0.1, -2.5])
+
+
+def test_knn_vector_mapping_per_encoding():
+    mapping, meta = opensearch.knn_vector_mapping(8, "byte", scale=254.0)
+    assert (mapping["data_type"], mapping["method"]["space_type"]) == ("byte", "cosinesimil")
+    assert meta == {"vector_encoding": "byte", "vector_scale": 254.0}
+
+    mapping, meta = opensearch.knn_vector_mapping(8, "fp16")
+    assert mapping["method"]["engine"] == "faiss"
+    assert mapping["method"]["parameters"]["encoder"]["parameters"]["type"] == "fp16"
+    assert meta == {"vector_encoding": "fp16"}
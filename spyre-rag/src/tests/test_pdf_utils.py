@@ -0,0 +1,112 @@
+import pdfplumber.page
+import pytest
+
+import digitize.pdf_utils as pdf_utils
+from digitize.pdf_utils import PdfPageLines, TocIndex, build_line_index, load_pdf_pages, probe_pdf
+
+OUTLINE = [("Chapter One", [("Introduction", []), ("Details", [])]), ("Chapter Two", [])]
+
+
+def test_probe_pdf(make_pdf):
+    path = make_pdf([[("Chapter One", 20, 700)], [], [("Body", 12, 700)]], OUTLINE)
+    probe = probe_pdf(path)
+    assert probe["page_count"] == 3
+    assert probe["toc"] == {"Chapter One": 1, "Introduction": 2, "Details": 2, "Chapter Two": 1}
+    assert probe["text_pages"] == [True, False, True]
+    assert probe["file_size"] > 0
+
+
+def test_probe_pdf_without_outline(make_pdf):
+    probe = probe_pdf(make_pdf([[("Body", 12, 700)]]))
+    assert (probe["page_count"], probe["toc"], probe["text_pages"]) == (1, {}, [True])
+
+
+def test_probe_unreadable_pdf(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"%PDF-1.4 not really")
+    probe = probe_pdf(str(path))
+    assert (probe["page_count"], probe["toc"], probe["text_pages"]) == (0, {}, [])
+    assert probe["file_size"] == path.stat().st_size
+
+
+
+def test_build_line_index():
+    words = [
+        {"text": "Two", "top": 50.0, "bottom": 60.0, "x0": 40.0, "x1": 60.0, "size": 12.0, "fontname": "Body"},
+        {"text": "One", "top": 10.0, "bottom": 30.0, "x0": 10.0, "x1": 30.0, "size": 20.0, "fontname": "Bold"},
+        {"text": "Line", "top": 50.02, "bottom": 62.0, "x0": 10.0, "x1": 35.0, "size": 12.0, "fontname": "Body"},
+        {"text": "incomplete", "top": 80.0},
+    ]
+    lines = build_line_index(words)
+    assert [(line["text"], line["text_lower"], line["font_size"], line["font_name"]) for line in lines] == [
+        ("Line Two", "line two", 12.0, "Body"),
+        ("One", "one", 20.0, "Bold"),
+    ]
+    assert lines[0]["bbox"] == (10.0, 50.0, 60.0, 62.0)
+
+
+@pytest.fixture
+def extracted_pages(monkeypatch):
+    pages = []
+    extract_words = pdfplumber.page.Page.extract_words
+
+    def _extract_words(page, *args, **kwargs):
+        pages.append(page.page_number - 1)
+        return extract_words(page, *args, **kwargs)
+
+    monkeypatch.setattr(pdfplumber.page.Page, "extract_words", _extract_words)
+    return pages
+
+
+def test_page_lines_extracted_lazily(make_pdf, extracted_pages):
+    path = make_pdf([[("Chapter One", 20, 700), ("Body", 12, 650)], [("Second", 12, 700)], [("Third", 12, 700)]])
+    with load_pdf_pages(path) as pdf_pages:
+        assert len(pdf_pages) == 3
+        assert extracted_pages == []
+        assert [(line["text"], line["font_size"]) for line in pdf_pages[0]] == [("Chapter One", 20.0), ("Body", 12.0)]
+        pdf_pages[0]
+        assert extracted_pages == [0]
+
+
+def test_pages_without_text_layer_are_skipped(make_pdf, extracted_pages):
+    path = make_pdf([[("Scanned", 12, 700)], [("Body", 12, 700)]])
+    with load_pdf_pages(path, text_pages=[False, True]) as pdf_pages:
+        assert pdf_pages[0] == []
+        assert [line["text"] for line in pdf_pages[1]] == ["Body"]
+    assert extracted_pages == [1]
+
+
+def test_page_lines_cache_is_bounded(make_pdf, extracted_pages):
+    path = make_pdf([[("One", 12, 700)], [("Two", 12, 700)], [("Three", 12, 700)]])
+    with PdfPageLines(path, cache_size=2) as pdf_pages:
+        for page_index in (0, 1, 0, 2, 0, 1):
+            pdf_pages[page_index]
+    # Page 1 is the least recently used page once page 2 is looked up
+    assert extracted_pages == [0, 1, 2, 1]
+
+
+def test_toc_index_exact_matches():
+    toc_index = TocIndex({"Chapter One": 1, "1.1  Scope": 2})
+    assert toc_index.match_levels(["chapter one", "1.1 scope", "  CHAPTER   ONE "]) == [1, 2, 1]
+
+
+def test_toc_index_fuzzy_matches():
+    toc_index = TocIndex({"Installation Guide": 1, "Configuring the network": 2})
+    assert toc_index.match_levels(["Installation Guid", "Configuring the network interfaces", "Appendix"]) == [1, 2, 0]
+
+
+def test_toc_index_first_match_wins():
+    # Both TOC titles are contained in the header, the level of the first one is taken
+    toc_index = TocIndex({"Overview": 1, "Overview of the setup": 2})
+    assert toc_index.match_levels(["Overview of the setup steps"]) == [1]
+
+
+def test_toc_index_matches_in_batches(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "TOC_MATCH_BATCH_SIZE", 2)
+    toc_index = TocIndex({"Installation": 1, "Maintenance": 2})
+    titles = ["Installatio", "Glossary", "Maintenanc", "Index", "Installatio"]
+    assert toc_index.match_levels(titles) == [1, 0, 2, 0, 1]
+
+
+def test_empty_toc_index():
+    assert TocIndex({}).match_levels(["Chapter One", "Body"]) == [0, 0]
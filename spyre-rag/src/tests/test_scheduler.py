@@ -0,0 +1,105 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+import digitize.scheduler as scheduler
+from digitize.scheduler import IngestScheduler, GB, CONVERT_BASE_MEMORY, THREADED_START_METHOD
+
+create_converter_executor = IngestScheduler._create_converter_executor
+
+
+@pytest.fixture(autouse=True)
+def no_converter_processes(monkeypatch):
+    monkeypatch.setattr(scheduler, "get_cpu_count", lambda: 8)
+    monkeypatch.setattr(IngestScheduler, "_create_converter_executor", lambda self, start_method=None: ThreadPoolExecutor(1))
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def _make(**kwargs):
+        kwargs.setdefault("preload_models", False)
+        schedulers.append(IngestScheduler(**kwargs))
+        return schedulers[-1]
+
+    yield _make
+    for s in schedulers:
+        s.shutdown()
+
+
+def test_converters_sized_by_cores_and_memory(make_scheduler):
+    # 8 cores allow 4 converters, the memory budget only 3
+    s = make_scheduler(memory_budget=3 * CONVERT_BASE_MEMORY + GB)
+    assert s.convert_workers == 3
+    assert s.document_memory_budget == GB
+    assert s.worker_size == 8
+
+    s = make_scheduler(memory_budget=100 * GB)
+    assert s.convert_workers == 4
+
+
+def test_admits_up_to_the_free_converters(make_scheduler):
+    s = make_scheduler(convert_workers=2, memory_budget=100 * GB)
+    pending = [("a", 0), ("b", 0), ("c", 0)]
+    assert s.next_conversions(pending) == [("a", 0), ("b", 0)]
+    assert pending == [("c", 0)]
+    assert s.next_conversions(pending) == []
+
+    s.conversion_done(0)
+    assert s.next_conversions(pending) == [("c", 0)]
+
+
+def test_smaller_jobs_backfill_the_memory_budget(make_scheduler):
+    s = make_scheduler(convert_workers=4, memory_budget=4 * CONVERT_BASE_MEMORY + 10 * GB)
+    pending = [("large", 6 * GB), ("medium", 5 * GB), ("small", 3 * GB)]
+    assert s.next_conversions(pending) == [("large", 6 * GB), ("small", 3 * GB)]
+    assert pending == [("medium", 5 * GB)]
+
+    # Memory is released once the large conversion is done
+    s.conversion_done(6 * GB)
+    assert s.next_conversions(pending) == [("medium", 5 * GB)]
+
+
+def test_job_over_the_budget_runs_alone(make_scheduler):
+    s = make_scheduler(convert_workers=2, memory_budget=2 * CONVERT_BASE_MEMORY + GB)
+    pending = [("huge", 4 * GB), ("small", GB // 2)]
+    assert s.next_conversions(pending) == [("huge", 4 * GB)]
+    assert s.next_conversions(pending) == []
+
+    s.conversion_done(4 * GB)
+    assert s.next_conversions(pending) == [("small", GB // 2)]
+
+
+class FakeProcessPool:
+    def __init__(self, max_workers, mp_context, initializer):
+        self.start_method = mp_context.get_start_method() if mp_context else None
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@pytest.mark.parametrize("threads_running, preload_models, start_method", [
+    (False, True, "fork"),
+    (False, False, None),
+    (True, True, THREADED_START_METHOD),
+    (True, False, THREADED_START_METHOD),
+])
+def test_converters_forked_only_from_a_single_thread(monkeypatch, make_scheduler, threads_running, preload_models, start_method):
+    monkeypatch.setattr(scheduler, "ProcessPoolExecutor", FakeProcessPool)
+    s = make_scheduler(memory_budget=100 * GB)
+    s.preload_models = preload_models
+
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    if threads_running:
+        thread.start()
+    try:
+        assert create_converter_executor(s).start_method == start_method
+    finally:
+        stop.set()
+        if threads_running:
+            thread.join()
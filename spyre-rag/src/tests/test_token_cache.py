@@ -0,0 +1,35 @@
+from common.token_cache import TokenCountCache
+
+
+def test_get_many_returns_cached_counts(tmp_path):
+    cache = TokenCountCache(str(tmp_path / "tokens.db"))
+    cache.put_many("model", {"alpha": 1, "alpha beta": 2})
+    assert cache.get_many("model", ["alpha", "alpha beta", "gamma", "alpha"]) == {"alpha": 1, "alpha beta": 2}
+    assert (cache.lookups, cache.hits) == (3, 2)
+    assert cache.hit_rate() == 2 / 3 * 100
+
+
+def test_counts_are_keyed_by_tokenizer(tmp_path):
+    cache = TokenCountCache(str(tmp_path / "tokens.db"))
+    cache.put_many("model-a", {"alpha": 1})
+    assert cache.get_many("model-b", ["alpha"]) == {}
+
+
+def test_counts_persist(tmp_path):
+    cache = TokenCountCache(str(tmp_path / "tokens.db"))
+    cache.put_many("model", {"alpha": 1})
+    cache.close()
+    assert TokenCountCache(str(tmp_path / "tokens.db")).get_many("model", ["alpha"]) == {"alpha": 1}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = TokenCountCache(str(tmp_path / "tokens.db"), max_entries=10)
+    cache.put_many("model", {f"text {i}": i for i in range(10)})
+    # Recently read entries survive the eviction
+    cache.get_many("model", ["text 0", "text 1"])
+    cache.put_many("model", {"text 10": 10})
+
+    counts = cache.get_many("model", [f"text {i}" for i in range(11)])
+    assert len(counts) == 9
+    assert {"text 0", "text 1", "text 10"} <= counts.keys()
+    assert "text 2" not in counts
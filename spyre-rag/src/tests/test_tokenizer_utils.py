@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+import common.tokenizer_utils as tokenizer_utils
+from common.tokenizer_utils import Tokenizer, LocalTokenizer, RemoteTokenizer, get_tokenizer
+
+
+class WordTokenizer(Tokenizer):
+    model_id = "words"
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def fresh_instances(monkeypatch):
+    monkeypatch.setattr(tokenizer_utils, "_tokenizer_instances", {})
+
+
+def write_word_level_tokenizer(path):
+    vocab = {"[UNK]": 0, "alpha": 1, "beta": 2, "gamma": 3}
+    path.write_text(json.dumps({
+        "version": "1.0",
+        "truncation": None,
+        "padding": None,
+        "added_tokens": [],
+        "normalizer": None,
+        "pre_tokenizer": {"type": "Whitespace"},
+        "post_processor": None,
+        "decoder": None,
+        "model": {"type": "WordLevel", "vocab": vocab, "unk_token": "[UNK]"},
+    }))
+    return path
+
+
+def test_tokenizer_is_abstract():
+    with pytest.raises(TypeError):
+        Tokenizer()
+
+
+def test_count():
+    tokenizer = WordTokenizer()
+    assert tokenizer.count("alpha beta gamma") == 3
+    assert tokenizer.count("") == 0
+    assert tokenizer.count_batch(["alpha", "alpha beta", ""]) == [1, 2, 0]
+
+
+def test_truncate():
+    tokenizer = WordTokenizer()
+    assert tokenizer.truncate("alpha beta gamma", 3) == "alpha beta gamma"
+    assert tokenizer.truncate("alpha beta gamma", 5) == "alpha beta gamma"
+    assert tokenizer.truncate("alpha beta gamma", 2) == "alpha beta"
+    assert tokenizer.truncate("alpha beta gamma", 0) == ""
+    assert tokenizer.truncate("alpha beta gamma", -1) == ""
+
+
+def test_local_tokenizer(tmp_path):
+    pytest.importorskip("tokenizers")
+    tokenizer = LocalTokenizer(str(write_word_level_tokenizer(tmp_path / "tokenizer.json")))
+    assert tokenizer.encode("alpha beta delta") == [1, 2, 0]
+    assert tokenizer.count_batch(["alpha", "beta gamma", ""]) == [1, 2, 0]
+    assert tokenizer.encode_batch([]) == []
+    assert tokenizer.truncate("alpha beta gamma", 2) == tokenizer.decode([1, 2])
+
+
+def test_get_tokenizer_loads_from_directory(tmp_path):
+    pytest.importorskip("tokenizers")
+    write_word_level_tokenizer(tmp_path / "tokenizer.json")
+    tokenizer = get_tokenizer("http://emb", str(tmp_path), "model")
+    assert isinstance(tokenizer, LocalTokenizer)
+    assert tokenizer.model_id == "model"
+    assert get_tokenizer("http://emb", str(tmp_path), "model") is tokenizer
+
+
+def test_get_tokenizer_falls_back_to_remote(tmp_path):
+    tokenizer = get_tokenizer("http://emb", str(tmp_path / "missing.json"))
+    assert isinstance(tokenizer, RemoteTokenizer)
+    assert tokenizer.model_id == "http://emb"
+
+    broken = tmp_path / "tokenizer.json"
+    broken.write_text("{}")
+    assert isinstance(get_tokenizer("http://emb", str(broken), "model"), RemoteTokenizer)